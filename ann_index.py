@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# ============================================================================
+# ann_index.py - Indice ANN (IVF) persistente sopra lo store degli embedding
+# ============================================================================
+#
+# Inverted file index in puro NumPy: i vettori sono partizionati con k-means in
+# `nlist` liste; una query confronta solo i centroidi, poi scandisce in modo
+# esatto le `nprobe` liste più vicine. Più nprobe = più recall, più latenza
+# (nprobe >= nlist equivale alla ricerca esatta).
+#
+# File salvati nella directory dello store:
+#
+#   ivf_centroids.npy   (nlist, D) float32
+#   ivf_assign.npy      (N,) int32, lista di appartenenza di ogni riga
+#   ivf_meta.json       righe indicizzate + fingerprint dello store (vedi
+#                       embedding_store.py): sync rifiuta un indice rimasto
+#                       da uno store ricreato o accorciato
+#
+#   python ann_index.py build store/ --nlist 256
+#   python ann_index.py add store/            # indicizza le righe nuove
+#   python ann_index.py eval store/ --nprobe 1 4 16
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from scipy.spatial.distance import cdist
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+ASSIGN_FILE = "ivf_assign.npy"
+META_FILE = "ivf_meta.json"
+
+# Liste scandite per query (IVF e zone di livello 0)
+DEFAULT_NPROBE = int(os.getenv("LIGHTWIKI_NPROBE", "8"))
+
+# ============================================================================
+# FUNZIONI DI SUPPORTO
+# ============================================================================
+
+def assign_to_centroids(matrix, centroids, chunk_size=65536):
+    """Indice del centroide più vicino per ogni riga (a blocchi, anche su memmap)"""
+    centroid_norms = (centroids.astype(np.float32) ** 2).sum(axis=1)
+    labels = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), chunk_size):
+        block = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+        # ||x - c||^2 a meno di ||x||^2 (costante per riga)
+        scores = centroid_norms - 2 * block @ centroids.T
+        labels[start:start + len(block)] = scores.argmin(axis=1)
+    return labels
+
+def group_by_label(labels, n_labels):
+    """(members, offsets): righe ordinate per lista e confini di ogni lista"""
+    members = np.argsort(labels, kind='stable')
+    offsets = np.searchsorted(labels[members], np.arange(n_labels + 1))
+    return members, offsets
+
+def probe_lists(query, matrix, centroids, members, offsets, nprobe, k, allowed=None):
+    """Ricerca esatta ristretta alle `nprobe` partizioni con centroide più vicino
+
+    `allowed` (indici di partizione) limita la scelta a un sottoinsieme, per
+    la ricerca coarse-to-fine di zones.py. Se le partizioni scelte hanno meno
+    di k righe si scandiscono anche le successive in ordine di distanza (e,
+    se nemmeno `allowed` basta, tutte): il risultato ha sempre min(k, N)
+    righe. Ritorna (indici, distanze, candidati scanditi).
+    """
+    if allowed is None:
+        allowed = np.arange(len(centroids))
+    elif offsets[allowed + 1].sum() - offsets[allowed].sum() < min(k, len(members)):
+        # Le zone ammesse non hanno k righe: ricerca su tutte le partizioni
+        return probe_lists(query, matrix, centroids, members, offsets, nprobe, k)
+    if len(allowed) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0), 0
+    order = allowed[np.argsort(cdist([query], centroids[allowed])[0])]
+    # Almeno nprobe partizioni, e quante servono per arrivare a k candidati
+    needed = int(np.searchsorted(np.cumsum(offsets[order + 1] - offsets[order]), k)) + 1
+    probed = order[:max(nprobe, needed)]
+
+    candidates = np.concatenate([members[offsets[c]:offsets[c + 1]] for c in probed])
+    if len(candidates) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0), 0
+    candidates.sort()  # accesso sequenziale al memmap
+
+    distances = cdist([query], matrix[candidates])[0]
+    k = min(k, len(candidates))
+    top = np.argpartition(distances, k - 1)[:k]
+    top = top[np.argsort(distances[top])]
+    return candidates[top], distances[top], len(candidates)
+
+# ============================================================================
+# INDICE IVF
+# ============================================================================
+
+class IVFIndex:
+    """Inverted file index: centroidi k-means + assegnazione di ogni riga"""
+
+    def __init__(self, centroids, assign, fingerprint=None):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assign = np.asarray(assign, dtype=np.int32)
+        self.fingerprint = fingerprint
+        self._lists = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.assign)
+
+    @classmethod
+    def build(cls, matrix, nlist=None, sample_size=100_000, seed=0):
+        """k-means su un campione della matrice, poi assegnazione di tutte le righe"""
+        from sklearn.cluster import MiniBatchKMeans
+
+        n = len(matrix)
+        if n == 0:
+            raise ValueError("Cannot build an index over an empty matrix")
+        nlist = min(nlist or max(1, int(4 * np.sqrt(n))), n)
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, sample_size), replace=False))
+        kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=seed, n_init=3,
+                                 batch_size=max(1024, 4 * nlist))
+        kmeans.fit(np.asarray(matrix[sample], dtype=np.float32))
+
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        return cls(centroids, assign_to_centroids(matrix, centroids))
+
+    def add(self, matrix):
+        """Inserimento incrementale: nuove righe (in coda) assegnate ai centroidi esistenti"""
+        self.assign = np.concatenate([self.assign, assign_to_centroids(matrix, self.centroids)])
+        self._lists = None
+
+    def sync(self, store):
+        """Indicizza le righe dello store aggiunte dopo l'ultima build/add
+
+        StaleIndexError se l'indice salvato non è di questo store.
+        """
+        if self.fingerprint is not None:
+            store.check_index("IVF index", len(self), self.fingerprint)
+        self.fingerprint = store.fingerprint()
+        if len(self) < len(store):
+            self.add(store.matrix[len(self):])
+        return self
+
+    def search(self, query, matrix, k=5, nprobe=DEFAULT_NPROBE):
+        """Top k approssimati: (indici, distanze, candidati scanditi)"""
+        if self._lists is None:
+            self._lists = group_by_label(self.assign, self.nlist)
+        members, offsets = self._lists
+        return probe_lists(np.asarray(query, dtype=np.float32), matrix,
+                           self.centroids, members, offsets, nprobe, k)
+
+    # ------------------------------------------------------------------------
+    # Persistenza
+    # ------------------------------------------------------------------------
+
+    def save(self, path):
+        """Salva nella directory dello store `path` (fingerprint di quello store se manca)"""
+        import embedding_store
+
+        if self.fingerprint is None:
+            self.fingerprint = embedding_store.open_store(path).fingerprint()
+        np.save(os.path.join(path, CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(path, ASSIGN_FILE), self.assign)
+        with open(os.path.join(path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"rows": len(self), "fingerprint": self.fingerprint}, f)
+
+    @classmethod
+    def load(cls, path):
+        # Indice senza meta (o con meta di un'altra build): fingerprint vuoto, sync lo rifiuta
+        meta = {}
+        if os.path.exists(os.path.join(path, META_FILE)):
+            with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        assign = np.load(os.path.join(path, ASSIGN_FILE))
+        fingerprint = meta.get("fingerprint", "") if meta.get("rows") == len(assign) else ""
+        return cls(np.load(os.path.join(path, CENTROIDS_FILE)), assign, fingerprint)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, CENTROIDS_FILE))
+
+# ============================================================================
+# MAIN ENTRY POINT
+# ============================================================================
+
+def evaluate(store, index, nprobes, n_queries=100, k=10, seed=0):
+    """Recall@k e latenza media rispetto alla ricerca esatta, per ogni nprobe"""
+    import lib3d
+
+    rng = np.random.default_rng(seed)
+    queries = store.matrix[rng.choice(len(store), size=min(n_queries, len(store)), replace=False)]
+
+    started = time.perf_counter()
+    exact = [set(lib3d.k_nearest_matrix(q, store.matrix, k)[0].tolist()) for q in queries]
+    report = {"exact": {"latency_ms": (time.perf_counter() - started) * 1000 / len(queries)}}
+
+    for nprobe in nprobes:
+        hits, scanned = 0, 0
+        started = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            idx, _, n_scanned = index.search(q, store.matrix, k, nprobe)
+            hits += len(truth & set(idx.tolist()))
+            scanned += n_scanned
+        report[f"nprobe={nprobe}"] = {
+            "recall": hits / sum(len(t) for t in exact),
+            "latency_ms": (time.perf_counter() - started) * 1000 / len(queries),
+            "scanned": scanned / len(queries),
+        }
+    return report
+
+def main():
+    import embedding_store
+
+    parser = argparse.ArgumentParser(description='Build and query the IVF index of an embedding store.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('build', help='Train centroids and index every row.')
+    p.add_argument('store_path')
+    p.add_argument('--nlist', type=int, default=None, help='Number of lists (default 4*sqrt(N)).')
+
+    p = sub.add_parser('add', help='Index rows appended to the store since the last build.')
+    p.add_argument('store_path')
+
+    p = sub.add_parser('eval', help='Report recall and latency against exact search.')
+    p.add_argument('store_path')
+    p.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16])
+    p.add_argument('--queries', type=int, default=100)
+    p.add_argument('-k', type=int, default=10)
+
+    args = parser.parse_args()
+    store = embedding_store.open_store(args.store_path)
+
+    if args.command == 'build':
+        index = IVFIndex.build(store.matrix, nlist=args.nlist)
+        index.save(args.store_path)
+        print(f"Indexed {len(index)} embeddings into {index.nlist} lists")
+    elif args.command == 'add':
+        index = IVFIndex.load(args.store_path)
+        before = len(index)
+        index.sync(store).save(args.store_path)
+        print(f"Indexed {len(index) - before} new embeddings ({len(index)} total)")
+    else:
+        index = IVFIndex.load(args.store_path).sync(store)
+        print(json.dumps(evaluate(store, index, args.nprobe, args.queries, args.k), indent=2))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
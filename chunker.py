@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# ============================================================================
+# chunker.py - Chunk per sezione Markdown + vettori di documento aggregati
+# ============================================================================
+#
+# mxbai-embed-large vede ~512 token: un pagecontent intero viene troncato. Qui
+# il testo si divide lungo le intestazioni Markdown (stesse "## Sezione" che
+# parse_markdown_file usa per trovare l'inizio del contenuto), le sezioni
+# troppo lunghe si spezzano per paragrafi e quelle corte si uniscono alla
+# precedente. Ogni chunk si embedda a batch; il vettore del documento è la
+# media dei suoi chunk pesata sulla lunghezza.
+#
+# Layout dentro uno store di chunk (id "PMC123#0", "PMC123#1", ...):
+#
+#   chunks.jsonl   {"id", "doc_id", "section", "chars", "text"} per chunk
+#   docs/          EmbeddingStore dei vettori di documento (id "PMC123")
+#
+#   python chunker.py chunk paper.md            # anteprima dei chunk
+#   python chunker.py aggregate store/          # (ri)crea store/docs
+
+import os
+import re
+import sys
+import json
+import argparse
+
+import numpy as np
+
+CHUNKS_FILE = "chunks.jsonl"
+DOCS_DIR = "docs"
+MAX_CHARS = 1500
+MIN_CHARS = 200
+
+HEADING = re.compile(r'^(#{1,6})\s*(\S.*?)\s*$', re.MULTILINE)
+
+# ============================================================================
+# CHUNKING
+# ============================================================================
+
+def split_sections(markdown):
+    """[(titolo della sezione, testo con l'intestazione)]; il testo prima del primo titolo ha titolo ''"""
+    sections = []
+    matches = list(HEADING.finditer(markdown))
+    if not matches or matches[0].start() > 0:
+        head = markdown[:matches[0].start() if matches else len(markdown)]
+        if head.strip():
+            sections.append(("", head.strip()))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown)
+        text = markdown[match.start():end].strip()
+        if text:
+            sections.append((match.group(2), text))
+    return sections
+
+def _split_paragraph(paragraph, max_chars):
+    # Paragrafo più lungo del limite: tagli sullo spazio più vicino al limite
+    pieces = []
+    while len(paragraph) > max_chars:
+        cut = paragraph.rfind(" ", 0, max_chars)
+        cut = cut if cut > 0 else max_chars
+        pieces.append(paragraph[:cut].strip())
+        paragraph = paragraph[cut:].strip()
+    if paragraph:
+        pieces.append(paragraph)
+    return pieces
+
+def split_text(text, max_chars=MAX_CHARS):
+    """Paragrafi (separati da righe vuote) raggruppati fino a max_chars"""
+    chunks, current = [], ""
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        for piece in _split_paragraph(paragraph, max_chars) if paragraph else ():
+            if current and len(current) + len(piece) + 2 > max_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def chunk_markdown(markdown, max_chars=MAX_CHARS, min_chars=MIN_CHARS):
+    """Chunk [{"section", "text"}] che non superano max_chars e non tagliano le sezioni a metà frase"""
+    chunks, carry = [], ""
+    for title, text in split_sections(markdown):
+        # Sezione corta: si unisce al chunk precedente se ci sta (all'inizio, alla successiva)
+        if len(text) < min_chars:
+            if chunks and len(chunks[-1]["text"]) + len(text) + 2 <= max_chars:
+                chunks[-1]["text"] += "\n\n" + text
+                continue
+            if not chunks and len(carry) + len(text) + 2 <= max_chars:
+                carry = f"{carry}\n\n{text}" if carry else text
+                continue
+        if carry:
+            text, carry = f"{carry}\n\n{text}", ""
+        for i, piece in enumerate(split_text(text, max_chars)):
+            # I pezzi successivi ripetono il titolo come contesto
+            if i and title:
+                piece = f"{title}\n\n{piece}"
+            chunks.append({"section": title, "text": piece})
+    if carry:
+        chunks.append({"section": split_sections(markdown)[0][0], "text": carry})
+    return chunks
+
+def doc_id_of(chunk_id):
+    # str(): gli store importati da una lista di blob hanno id interi 0..N-1 (un
+    # documento per riga, con lo stesso id testuale di store/docs)
+    return str(chunk_id).split("#", 1)[0]
+
+# ============================================================================
+# VETTORI DI DOCUMENTO
+# ============================================================================
+
+def aggregate_matrix(matrix, doc_ids, weights=None, chunk_size=65536):
+    """Media pesata dei chunk per documento: (id documento in ordine di comparsa, matrice)
+
+    La media viene riscalata alla norma media dei suoi chunk (vettori unitari
+    restano unitari, le distanze restano confrontabili con quelle dei chunk).
+    """
+    from scipy.sparse import csr_matrix
+
+    unique, first, inverse = np.unique(np.asarray(doc_ids), return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    rows = rank[inverse]
+
+    n = len(doc_ids)
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+    totals = np.bincount(rows, weights=weights, minlength=len(unique))
+    sums = np.zeros((len(unique), matrix.shape[1]))
+    norms = np.zeros(len(unique))
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        block = np.asarray(matrix[start:stop], dtype=np.float64)
+        w = weights[start:stop]
+        group = csr_matrix((w, (rows[start:stop], np.arange(stop - start))), shape=(len(unique), stop - start))
+        sums += group @ block
+        norms += group @ np.linalg.norm(block, axis=1)
+
+    means = sums / totals[:, None]
+    lengths = np.linalg.norm(means, axis=1)
+    scale = np.divide(norms / totals, lengths, out=np.zeros_like(lengths), where=lengths > 0)
+    return [str(d) for d in unique[order]], (means * scale[:, None]).astype(np.float32)
+
+def embed_document(markdown, embed, max_chars=MAX_CHARS, prefix=""):
+    """Chunk + embedding a batch (`embed`: lista di testi -> lista di vettori) + vettore aggregato"""
+    chunks = chunk_markdown(markdown, max_chars)
+    if not chunks:
+        raise ValueError("Document has no text to embed")
+    vectors = np.asarray(embed([prefix + c["text"] for c in chunks]), dtype=np.float32)
+    _, doc = aggregate_matrix(vectors, np.zeros(len(chunks), dtype=int),
+                              weights=[len(c["text"]) for c in chunks])
+    return chunks, vectors, doc[0]
+
+def read_chunks(store_path):
+    """Righe di chunks.jsonl per id (vuoto se il file non esiste)"""
+    path = os.path.join(store_path, CHUNKS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {record["id"]: record for record in map(json.loads, f)}
+
+def doc_store_path(store_path):
+    return os.path.join(store_path, DOCS_DIR)
+
+def aggregate_store(store_path):
+    """Ricrea store/docs dai chunk dello store (pesi = lunghezze in chunks.jsonl se presenti)"""
+    import embedding_store
+
+    store = embedding_store.open_store(store_path)
+    records = read_chunks(store_path)
+    weights = [records[i]["chars"] if i in records else 1 for i in store.ids] if records else None
+    doc_ids, matrix = aggregate_matrix(store.matrix, [doc_id_of(i) for i in store.ids], weights)
+    return embedding_store.EmbeddingStore.from_matrix(doc_store_path(store_path), doc_ids, matrix)
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Section-aware chunking and document vectors.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('chunk', help='Show how a Markdown file is chunked.')
+    p.add_argument('markdown_file')
+    p.add_argument('--max-chars', type=int, default=MAX_CHARS)
+
+    p = sub.add_parser('aggregate', help='Build <store>/docs from the chunk vectors.')
+    p.add_argument('store_path')
+
+    args = parser.parse_args()
+
+    if args.command == 'chunk':
+        with open(args.markdown_file, 'r', encoding='utf-8') as f:
+            chunks = chunk_markdown(f.read(), args.max_chars)
+        for i, chunk in enumerate(chunks):
+            preview = chunk["text"][:60].replace("\n", " ")
+            print(f"{i:4d} {len(chunk['text']):6d} chars  [{chunk['section'] or '-'}]  {preview}")
+    else:
+        docs = aggregate_store(args.store_path)
+        print(f"Aggregated {len(docs)} documents into {docs.path}")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,202 @@
+# ============================================================================
+# corpus.py - Corpus di embedding tenuti in memoria dal processo
+# ============================================================================
+#
+# Con k_nearest_from_stdin il client deve inviare tutti i blob a ogni query.
+# Qui il corpus viene caricato una volta (da uno store o da una lista di blob)
+# e registrato con un id; le query inviano solo query_blob (o testo) e k.
+#
+#   load_corpus({"store": "store/"})                   -> {"corpus_id": "store/", "version": ...}
+#   get_corpus("store/").search(query_emb, k=5)        -> [{"id": ..., "distance": ...}]
+#
+# Il server gestisce le richieste in thread diversi: acquire_corpus() prende un
+# riferimento al corpus e release() lo rilascia. Un corpus sostituito da un
+# reload (o scaricato) chiude il proprio motore solo quando l'ultima ricerca in
+# corso lo rilascia.
+#
+# La versione cambia quando cambia il contenuto (righe aggiunte allo store o
+# blob diversi): un corpus da store viene ricaricato automaticamente.
+#
+# La ricerca esatta su corpus con almeno SHARD_MIN_ROWS righe usa
+# exact_search.ShardedSearch: la matrice passa in memoria condivisa e viene
+# divisa tra i processi del pool.
+
+import os
+import hashlib
+import threading
+
+import numpy as np
+
+import exact_search
+from ann_index import IVFIndex
+from embedding_store import EmbeddingStore, INDEX_FILE, MATRIX_FILE
+
+# ============================================================================
+# CORPUS
+# ============================================================================
+
+SHARD_MIN_ROWS = int(os.getenv("LIGHTWIKI_SHARD_MIN_ROWS", "100000"))
+
+def store_version(path):
+    """Versione di uno store: dipende da dimensione e mtime di matrice e sidecar"""
+    parts = []
+    for name in (MATRIX_FILE, INDEX_FILE):
+        st = os.stat(os.path.join(path, name))
+        parts.append(f"{st.st_size}:{st.st_mtime_ns}")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+class Corpus:
+    """Matrice di embedding in RAM + id dei documenti (+ indice IVF opzionale)"""
+
+    def __init__(self, corpus_id, ids, matrix, version, store_path=None, index=None):
+        self.corpus_id = corpus_id
+        self.ids = list(ids)
+        self.matrix = matrix
+        self.version = version
+        self.store_path = store_path
+        self.index = index
+        self.engine = None
+        self._engine_lock = threading.Lock()
+        self._users = 0
+        self._retired = False
+        self._state_lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, path, corpus_id=None):
+        version = store_version(path)
+        store = EmbeddingStore(path)
+        # Copia in RAM: le query non toccano più il disco
+        matrix = np.array(store.matrix, dtype=np.float32)
+        index = IVFIndex.load(path).sync(store) if IVFIndex.exists(path) else None
+        return cls(corpus_id or path, store.ids, matrix, version, store_path=path, index=index)
+
+    @classmethod
+    def from_blobs(cls, blobs_b64, ids=None, corpus_id=None):
+        import lib3d
+
+        matrix = np.ascontiguousarray(lib3d.b64list2matrix(blobs_b64))
+        version = hashlib.sha1(matrix.tobytes()).hexdigest()[:16]
+        ids = ids if ids is not None else list(range(len(matrix)))
+        if len(ids) != len(matrix):
+            raise ValueError(f"Got {len(ids)} ids for {len(matrix)} blobs")
+        return cls(corpus_id or version, ids, matrix, version)
+
+    def is_stale(self):
+        return self.store_path is not None and store_version(self.store_path) != self.version
+
+    def info(self):
+        return {
+            "corpus_id": self.corpus_id,
+            "version": self.version,
+            "count": len(self.ids),
+            "dim": int(self.matrix.shape[1]) if len(self.matrix) else 0,
+            "indexed": self.index is not None,
+        }
+
+    def search(self, query_emb, k=5, nprobe=None, exact=False):
+        """k documenti più vicini: [{"id": ..., "distance": ...}] in ordine crescente"""
+        import lib3d
+
+        if self.index is not None and not exact:
+            nearest_idx, distances, _ = self.index.search(query_emb, self.matrix, k,
+                                                          nprobe or lib3d.DEFAULT_NPROBE)
+        else:
+            nearest_idx, distances = self.search_exact(query_emb, k)
+
+        return [{"id": self.ids[i], "distance": float(d)} for i, d in zip(nearest_idx, distances)]
+
+    def search_exact(self, queries, k=5):
+        """Top k esatti di una query (D,) o di un batch (Q, D): (indici, distanze)"""
+        if len(self.matrix) < SHARD_MIN_ROWS or exact_search.DEFAULT_WORKERS < 2:
+            idx, dist = exact_search.search_matrix(queries, self.matrix, k)
+            return (idx[0], dist[0]) if np.ndim(queries) == 1 else (idx, dist)
+        with self._engine_lock:
+            if self.engine is None:
+                self.engine = exact_search.ShardedSearch(self.matrix)
+                # La copia privata non serve più: le query IVF leggono la memoria condivisa
+                self.matrix = self.engine.matrix
+        return self.engine.search(queries, k)
+
+    def acquire(self):
+        with self._state_lock:
+            self._users += 1
+        return self
+
+    def release(self):
+        with self._state_lock:
+            self._users -= 1
+            idle = self._retired and self._users == 0
+        if idle:
+            self._close_engine()
+
+    def close(self):
+        """Chiude il motore condiviso appena terminano le ricerche in corso"""
+        with self._state_lock:
+            self._retired = True
+            idle = self._users == 0
+        if idle:
+            self._close_engine()
+
+    def _close_engine(self):
+        with self._engine_lock:
+            if self.engine is not None:
+                self.engine.close()
+                self.engine = None
+
+# ============================================================================
+# REGISTRO DEI CORPUS CARICATI
+# ============================================================================
+
+_corpora = {}
+_lock = threading.Lock()
+
+def load_corpus(spec):
+    """Carica (o ricarica) un corpus da {"store": path} o {"blobs": [...], "ids": [...]}"""
+    corpus_id = spec.get("corpus_id")
+    if spec.get("store"):
+        corpus = Corpus.from_store(spec["store"], corpus_id)
+    elif spec.get("blobs"):
+        corpus = Corpus.from_blobs(spec["blobs"], spec.get("ids"), corpus_id)
+    else:
+        raise ValueError("Corpus needs either a store path or a blobs list")
+
+    with _lock:
+        previous = _corpora.get(corpus.corpus_id)
+        _corpora[corpus.corpus_id] = corpus
+    if previous is not None:
+        previous.close()
+    return corpus
+
+def get_corpus(corpus_id):
+    """Corpus registrato; un id che è la directory di uno store viene caricato al volo"""
+    with _lock:
+        corpus = _corpora.get(corpus_id)
+
+    if corpus is None or corpus.is_stale():
+        if corpus is not None and corpus.store_path:
+            return load_corpus({"store": corpus.store_path, "corpus_id": corpus_id})
+        if os.path.isdir(str(corpus_id)):
+            return load_corpus({"store": corpus_id})
+        raise KeyError(corpus_id)
+    return corpus
+
+def acquire_corpus(corpus_id):
+    """get_corpus con un riferimento preso: chiamare release() a fine ricerca"""
+    while True:
+        corpus = get_corpus(corpus_id)
+        with _lock:
+            # Preso sotto il lock del registro: un reload concorrente non può
+            # chiuderlo tra la lettura e l'acquire
+            if _corpora.get(corpus.corpus_id) is corpus:
+                return corpus.acquire()
+
+def unload_corpus(corpus_id):
+    with _lock:
+        corpus = _corpora.pop(corpus_id, None)
+    if corpus is not None:
+        corpus.close()
+    return corpus is not None
+
+def list_corpora():
+    with _lock:
+        return [c.info() for c in _corpora.values()]
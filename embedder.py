@@ -0,0 +1,180 @@
+# ============================================================================
+# embedder.py - Embedding in batch con pool di client Ollama
+# ============================================================================
+#
+# Le frasi vengono raggruppate in batch e i batch sono inviati in parallelo su
+# un numero limitato di client riutilizzati. Due endpoint:
+#
+#   "embeddings"   /api/embeddings, una richiesta per frase (default): vettori
+#                  grezzi, gli stessi di ollama.embeddings e dei blob già salvati
+#   "embed"        /api/embed, una richiesta per batch: vettori normalizzati
+#                  (norma 1), NON confrontabili con i blob grezzi. Chi lo sceglie
+#                  deve rigenerare embeddings_blob.json / gli store esistenti
+#
+# L'endpoint si sceglie con `endpoint=` o LIGHTWIKI_EMBED_ENDPOINT.
+#
+#   pool = EmbeddingPool(host="http://127.0.0.1:11434", concurrency=4)
+#   vectors = pool.embed(["frase uno", "frase due", ...])
+#
+# Con `cache=EmbeddingCache(...)` vengono inviati a Ollama solo i testi non
+# ancora visti (vedi embedding_cache.py).
+#
+# L'host di default è quello di `ollama.Client` (variabile OLLAMA_HOST), quindi
+# basta puntarlo a uno stub locale (vedi tools/stub_ollama.py) per i test.
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import ollama
+
+from embedding_cache import EmbeddingCache
+
+MODEL = 'mxbai-embed-large'
+ENDPOINTS = ("embeddings", "embed")
+
+# Codici HTTP per cui ha senso ritentare
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+def _is_transient(error):
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code in TRANSIENT_STATUS
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+# ============================================================================
+# POOL DI CLIENT
+# ============================================================================
+
+class EmbeddingPool:
+    """Invia batch di testi a Ollama con concorrenza limitata e retry"""
+
+    def __init__(self, host=None, model=MODEL, batch_size=32, concurrency=4,
+                 max_pending=None, retries=3, backoff=0.5, timeout=None, cache=None,
+                 endpoint="embeddings"):
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {endpoint!r} (expected one of {ENDPOINTS})")
+        self.model = model
+        self.endpoint = endpoint
+        # Vettori grezzi e normalizzati in chiavi di cache separate
+        self.cache_model = f"{model}@{endpoint}"
+        self.cache = cache
+        self.batch_size = batch_size
+        self.retries = retries
+        self.backoff = backoff
+
+        # Un client (connessione httpx) per worker, riutilizzato tra i batch
+        self._clients = queue.Queue()
+        for _ in range(concurrency):
+            self._clients.put(ollama.Client(host=host, timeout=timeout))
+
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+
+        # Backpressure: al massimo `max_pending` batch in volo o in coda
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * concurrency)
+
+    def _request(self, call):
+        for attempt in range(self.retries + 1):
+            try:
+                return call()
+            except Exception as e:
+                if attempt == self.retries or not _is_transient(e):
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def embed_batch(self, texts):
+        """Embedding di `texts` su un solo client, con retry sugli errori transitori
+
+        Con l'endpoint "embed" è un'unica richiesta; con "embeddings" una
+        richiesta per testo sulla stessa connessione.
+        """
+        client = self._clients.get()
+        try:
+            if self.endpoint == "embed":
+                embeddings = self._request(lambda: client.embed(model=self.model, input=list(texts)))["embeddings"]
+            else:
+                embeddings = [self._request(lambda: client.embeddings(model=self.model, prompt=text))["embedding"]
+                              for text in texts]
+        finally:
+            self._clients.put(client)
+
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+        return embeddings
+
+    def _submit(self, texts):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self.embed_batch, texts)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def embed(self, sentences):
+        """Embedding di tutte le frasi, nello stesso ordine dell'input"""
+        sentences = list(sentences)
+        if self.cache is None:
+            return self._embed_uncached(sentences)
+
+        embeddings = self.cache.get_many(self.cache_model, sentences)
+        missing = list(dict.fromkeys(s for s, e in zip(sentences, embeddings) if e is None))
+        if missing:
+            computed = self._embed_uncached(missing)
+            self.cache.put_many(self.cache_model, missing, computed)
+            computed = dict(zip(missing, computed))
+            embeddings = [computed[s] if e is None else e for s, e in zip(sentences, embeddings)]
+        return embeddings
+
+    def _embed_uncached(self, sentences):
+        futures = [self._submit(sentences[i:i + self.batch_size])
+                   for i in range(0, len(sentences), self.batch_size)]
+
+        embeddings = []
+        for future in futures:
+            embeddings.extend(future.result())
+        return embeddings
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while not self._clients.empty():
+            self._clients.get()._client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ============================================================================
+# POOL CONDIVISO
+# ============================================================================
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+def default_pool():
+    """Pool di processo, configurabile con le variabili LIGHTWIKI_EMBED_*
+
+    LIGHTWIKI_EMBED_CACHE è il file della cache (non impostata o vuota = cache
+    disattivata), LIGHTWIKI_EMBED_CACHE_MB la sua dimensione massima,
+    LIGHTWIKI_EMBED_ENDPOINT l'endpoint ("embeddings" o "embed").
+    """
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            cache_path = os.getenv("LIGHTWIKI_EMBED_CACHE", "")
+            cache = None
+            if cache_path:
+                cache = EmbeddingCache(cache_path,
+                                       max_bytes=int(os.getenv("LIGHTWIKI_EMBED_CACHE_MB", "512")) * 1024 * 1024)
+            _default_pool = EmbeddingPool(
+                batch_size=int(os.getenv("LIGHTWIKI_EMBED_BATCH", "32")),
+                concurrency=int(os.getenv("LIGHTWIKI_EMBED_CONCURRENCY", "4")),
+                cache=cache,
+                endpoint=os.getenv("LIGHTWIKI_EMBED_ENDPOINT", "embeddings"),
+            )
+        return _default_pool
@@ -0,0 +1,154 @@
+# ============================================================================
+# embedding_cache.py - Cache su disco degli embedding, indirizzata per contenuto
+# ============================================================================
+#
+# Chiave = sha256(nome modello + testo normalizzato). Gli embedding sono salvati
+# come float32 in un file SQLite, con davanti una LRU in memoria. Quando il file
+# supera `max_bytes` vengono eliminate le voci usate meno di recente.
+#
+#   cache = EmbeddingCache("embeddings_cache.sqlite")
+#   cached = cache.get_many(MODEL, texts)     # None dove manca
+#   cache.put_many(MODEL, texts, embeddings)
+#   cache.stats()                             # hit/miss, voci, byte
+
+import time
+import sqlite3
+import hashlib
+import unicodedata
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+def normalize_text(text):
+    """Normalizzazione usata per la chiave: NFC + spazi compattati"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Cache embedding: LRU in memoria + SQLite su disco con eviction per dimensione"""
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, memory_items=4096):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    # ------------------------------------------------------------------------
+    # LRU in memoria
+    # ------------------------------------------------------------------------
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    # ------------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------------
+
+    def get_many(self, model, texts):
+        """Embedding in cache per ogni testo (lista di float) oppure None"""
+        keys = [cache_key(model, t) for t in texts]
+        found = {}
+
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            missing = list(dict.fromkeys(k for k in keys if k not in found))
+
+            if missing:
+                now = time.time()
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk).fetchall()
+                    for key, vector in rows:
+                        found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+                        self._remember(key, found[key])
+                    self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                         [(now, key) for key, _ in rows])
+                self._db.commit()
+
+            missing = set(missing)
+            for key in keys:
+                if key not in found:
+                    self._counters["misses"] += 1
+                elif key in missing:
+                    self._counters["disk_hits"] += 1
+                else:
+                    self._counters["memory_hits"] += 1
+
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model, texts, embeddings):
+        """Salva gli embedding e applica l'eviction se si supera max_bytes"""
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32).tobytes()
+            rows.append((cache_key(model, text), model, vector, len(vector), now))
+
+        with self._lock:
+            for key, _, vector, _, _ in rows:
+                self._remember(key, np.frombuffer(vector, dtype=np.float32).tolist())
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+            self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Elimina le voci meno recenti fino a scendere al 90% di max_bytes
+        target = int(self.max_bytes * 0.9)
+        removed = []
+        for key, size in self._db.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            if self._total_bytes <= target:
+                break
+            removed.append(key)
+            self._total_bytes -= size
+
+        self._db.executemany("DELETE FROM embeddings WHERE key = ?", [(k,) for k in removed])
+        self._db.commit()
+        for key in removed:
+            self._memory.pop(key, None)
+        self._counters["evictions"] += len(removed)
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            lookups = hits + self._counters["misses"]
+            return dict(self._counters,
+                        hits=hits,
+                        hit_rate=hits / lookups if lookups else 0.0,
+                        entries=entries,
+                        bytes=self._total_bytes,
+                        memory_entries=len(self._memory))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# ============================================================================
+# embedding_store.py - Store binario degli embedding (matrice float32 + sidecar)
+# ============================================================================
+#
+# Layout di una directory store:
+#
+#   matrix.f32   matrice N x D float32 contigua (riga i = embedding i)
+#   index.json   {"dim": D, "dtype": "float32", "count": N, "generation": ...,
+#                 "rows": [{"id": ..., "offset": byte_offset}, ...]}
+#
+# La matrice si apre con np.memmap, quindi k_nearest/graph_nearest la leggono
+# senza decodificare base64 né copiare in memoria.
+#
+# Gli indici derivati (IVF, zone, codici quantizzati, grafo incrementale)
+# salvano righe coperte e fingerprint() dello store: "generation" cambia a ogni
+# create, quindi un indice rimasto da uno store ricreato viene riconosciuto
+# (StaleIndexError) invece di restituire righe sbagliate. create cancella
+# comunque i file derivati (DERIVED_FILES).
+#
+#   python embedding_store.py import embeddings_blob.json store/
+#   python embedding_store.py export store/ embeddings_blob.json
+#   python embedding_store.py info store/
+
+import os
+import sys
+import glob
+import json
+import uuid
+import hashlib
+import argparse
+
+import numpy as np
+
+MATRIX_FILE = "matrix.f32"
+INDEX_FILE = "index.json"
+
+# File calcolati dalla matrice: non più validi quando lo store viene ricreato
+DERIVED_FILES = ("ivf_*", "zones.npz", "quant_*.npz", "codes_*.npy", "projection_*d.npz",
+                 "pca_basis.npz", "graph_knn*.npz", "tiles.npz")
+
+class StaleIndexError(ValueError):
+    """Indice derivato costruito su un'altra matrice (store ricreato o accorciato)"""
+
+# ============================================================================
+# STORE
+# ============================================================================
+
+class EmbeddingStore:
+    """Matrice float32 su disco, aperta in memmap, con id per riga"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+
+        self.dim = index["dim"]
+        self.dtype = np.dtype(index.get("dtype", "float32"))
+        self.generation = index.get("generation", "")
+        self.rows = index["rows"]
+        self.ids = [row["id"] for row in self.rows]
+        self._positions = None
+        self._matrix = None
+
+    @classmethod
+    def create(cls, path, dim):
+        """Crea uno store vuoto (sovrascrive quello esistente e ne cancella i file derivati)"""
+        os.makedirs(path, exist_ok=True)
+        for pattern in DERIVED_FILES:
+            for derived in glob.glob(os.path.join(glob.escape(path), pattern)):
+                os.remove(derived)
+        open(os.path.join(path, MATRIX_FILE), 'wb').close()
+        _write_index(path, {"dim": dim, "dtype": "float32", "count": 0,
+                            "generation": uuid.uuid4().hex, "rows": []})
+        return cls(path)
+
+    @classmethod
+    def from_matrix(cls, path, ids, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        store = cls.create(path, matrix.shape[1])
+        store.append(ids, matrix)
+        return store
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def matrix(self):
+        """Matrice (N, D) in sola lettura, mappata dal file"""
+        if self._matrix is None:
+            if not self.rows:
+                self._matrix = np.zeros((0, self.dim), dtype=self.dtype)
+            else:
+                self._matrix = np.memmap(os.path.join(self.path, MATRIX_FILE), dtype=self.dtype,
+                                         mode='r', shape=(len(self.rows), self.dim))
+        return self._matrix
+
+    def fingerprint(self):
+        """Impronta per gli indici derivati: generazione + prima riga (non cambia con append)"""
+        digest = hashlib.sha1(self.generation.encode())
+        if self.rows:
+            digest.update(np.asarray(self.matrix[0]).tobytes())
+        return digest.hexdigest()[:16]
+
+    def check_index(self, name, rows, fingerprint):
+        """StaleIndexError se un indice di `rows` righe non è stato costruito su questo store"""
+        if fingerprint != self.fingerprint() or rows > len(self):
+            raise StaleIndexError(f"{name} in {self.path} was built for a different matrix "
+                                  f"({rows} rows, store has {len(self)}): rebuild it")
+
+    def index_of(self, doc_id):
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return self._positions[doc_id]
+
+    def get(self, doc_id):
+        return self.matrix[self.index_of(doc_id)]
+
+    def append(self, ids, matrix):
+        """Aggiunge righe in coda al file e aggiorna il sidecar"""
+        matrix = np.ascontiguousarray(matrix, dtype=self.dtype)
+        ids = list(ids)
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+            raise ValueError(f"Expected (n, {self.dim}) matrix, got {matrix.shape}")
+        if len(ids) != len(matrix):
+            raise ValueError(f"Got {len(ids)} ids for {len(matrix)} rows")
+
+        row_bytes = self.dim * self.dtype.itemsize
+        matrix_path = os.path.join(self.path, MATRIX_FILE)
+        with open(matrix_path, 'r+b') as f:
+            f.truncate(len(self.rows) * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(matrix.tobytes())
+
+        start = len(self.rows)
+        self.rows.extend({"id": doc_id, "offset": (start + i) * row_bytes} for i, doc_id in enumerate(ids))
+        self.ids.extend(ids)
+        _write_index(self.path, {"dim": self.dim, "dtype": self.dtype.name, "count": len(self.rows),
+                                 "generation": self.generation, "rows": self.rows})
+        self._positions = None
+        self._matrix = None
+
+def _write_index(path, index):
+    # Scrittura atomica: un crash non lascia mai un sidecar a metà
+    tmp = os.path.join(path, INDEX_FILE + ".tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp, os.path.join(path, INDEX_FILE))
+
+def open_store(path):
+    return EmbeddingStore(path)
+
+# ============================================================================
+# IMPORT / EXPORT DAL FORMATO BLOB JSON
+# ============================================================================
+
+def read_blob_json(json_path):
+    """Legge embeddings_blob.json: lista di base64 oppure {"blobs": [...], "ids": [...]}"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        blobs_b64 = data["blobs"]
+        ids = data.get("ids") or list(range(len(blobs_b64)))
+    else:
+        blobs_b64, ids = data, list(range(len(data)))
+    return ids, blobs_b64
+
+def import_blob_json(json_path, store_path):
+    import lib3d
+
+    ids, blobs_b64 = read_blob_json(json_path)
+    if not blobs_b64:
+        raise ValueError(f"No blobs in {json_path}")
+    matrix = lib3d.b64list2matrix(blobs_b64)
+    return EmbeddingStore.from_matrix(store_path, ids, matrix)
+
+def export_blob_json(store_path, json_path):
+    import lib3d
+
+    store = EmbeddingStore(store_path)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "ids": store.ids,
+            "blobs": [lib3d.blob2base64(b) for b in lib3d.matrix2blobs(store.matrix)],
+        }, f)
+    return store
+
+# ============================================================================
+# MAIN ENTRY POINT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert between blob JSON and the binary embedding store.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('import', help='Blob JSON -> store directory.')
+    p.add_argument('json_path')
+    p.add_argument('store_path')
+
+    p = sub.add_parser('export', help='Store directory -> blob JSON.')
+    p.add_argument('store_path')
+    p.add_argument('json_path')
+
+    p = sub.add_parser('info', help='Print store size and dimension.')
+    p.add_argument('store_path')
+
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        store = import_blob_json(args.json_path, args.store_path)
+        print(f"Imported {len(store)} embeddings (dim {store.dim}) into {args.store_path}")
+    elif args.command == 'export':
+        store = export_blob_json(args.store_path, args.json_path)
+        print(f"Exported {len(store)} embeddings to {args.json_path}")
+    else:
+        store = EmbeddingStore(args.store_path)
+        print(json.dumps({"count": len(store), "dim": store.dim, "dtype": store.dtype.name}))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# ============================================================================
+# exact_search.py - Ricerca esatta multi-core: shard in memoria condivisa
+# ============================================================================
+#
+# lib3d.k_nearest_matrix fa una cdist per query su un solo core. Qui la
+# matrice viene copiata una volta in un blocco multiprocessing.shared_memory
+# e divisa in shard contigui, uno per processo del pool (nessuna copia per
+# query: i worker si agganciano al blocco per nome). Ogni worker calcola le
+# distanze di un batch di query contro il suo shard come prodotto
+# matrice-matrice (||q||^2 + ||x||^2 - 2 Q X^T, una GEMM per blocco di righe)
+# e tiene un top 2k parziale con argpartition; il processo principale unisce
+# i candidati di tutti gli shard e ricalcola in float64 le distanze dei
+# migliori (stessi risultati di cdist).
+#
+# Ogni worker usa un solo thread BLAS (threadpoolctl): il parallelismo viene
+# dagli shard, non da thread annidati.
+#
+#   with ShardedSearch(matrix, workers=8) as engine:
+#       idx, dist = engine.search(queries, k=10)       # (Q, k) ciascuno
+#
+#   python exact_search.py bench store/ --workers 1 2 4 --queries 256
+
+import os
+import sys
+import json
+import time
+import weakref
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+DEFAULT_WORKERS = int(os.getenv("LIGHTWIKI_SEARCH_WORKERS", "0")) or os.cpu_count() or 1
+BLOCK_ROWS = 16384
+
+# ============================================================================
+# KERNEL (un processo)
+# ============================================================================
+
+def row_norms(matrix, chunk_size=65536):
+    """||x||^2 per riga in float32, a blocchi (anche su memmap)"""
+    norms = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), chunk_size):
+        block = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+        norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+    return norms
+
+def partial_top_k(queries, matrix, norms, k, offset=0, block_rows=BLOCK_ROWS):
+    """Top k (indici + offset, distanze al quadrato) di ogni query su `matrix`, a blocchi di righe
+
+    Ritorna due array (Q, min(k, N)) non ordinati.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    query_norms = np.einsum('ij,ij->i', queries, queries)[:, None]
+    best_idx = np.zeros((len(queries), 0), dtype=np.int64)
+    best_d2 = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(matrix), block_rows):
+        block = matrix[start:start + block_rows]
+        d2 = query_norms + norms[start:start + len(block)] - 2 * (queries @ block.T)
+        kk = min(k, len(block))
+        top = np.argpartition(d2, kk - 1, axis=1)[:, :kk]
+        # Fusione con i migliori dei blocchi precedenti
+        best_idx = np.concatenate([best_idx, top + start + offset], axis=1)
+        best_d2 = np.concatenate([best_d2, np.take_along_axis(d2, top, axis=1)], axis=1)
+        if best_idx.shape[1] > k:
+            keep = np.argpartition(best_d2, k - 1, axis=1)[:, :k]
+            best_idx = np.take_along_axis(best_idx, keep, axis=1)
+            best_d2 = np.take_along_axis(best_d2, keep, axis=1)
+    return best_idx, best_d2
+
+def merge_top_k(parts, k, queries, matrix, candidates=None):
+    """Unisce i top k parziali [(indici, d2)]: (indici, distanze) (Q, k) ordinati per distanza
+
+    La GEMM in float32 perde precisione vicino a distanza zero: i `candidates`
+    migliori (default 2k) vengono ricalcolati come in cdist (differenze,
+    float64) e riordinati, così distanze e ordine coincidono con la ricerca
+    classica. quantize.py lo usa per il re-ranking delle distanze approssimate.
+    """
+    idx = np.concatenate([p[0] for p in parts], axis=1)
+    d2 = np.concatenate([p[1] for p in parts], axis=1)
+    keep = min(max(candidates or 2 * k, k), idx.shape[1])
+    top = np.argpartition(d2, keep - 1, axis=1)[:, :keep]
+    idx = np.take_along_axis(idx, top, axis=1)
+
+    # Righe candidate lette una volta sola, in ordine (accesso sequenziale al memmap)
+    unique = np.unique(idx)
+    rows = np.asarray(matrix[unique], dtype=np.float64)
+    position = np.searchsorted(unique, idx)
+    diff = rows[position] - np.asarray(queries, dtype=np.float64)[:, None, :]
+    dist = np.sqrt(np.einsum('qkd,qkd->qk', diff, diff))
+
+    order = np.argsort(dist, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(dist, order, axis=1)
+
+def search_matrix(queries, matrix, k=5, norms=None):
+    """Ricerca esatta batch in un solo processo (stesso kernel dei worker)"""
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if len(matrix) == 0:
+        return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0))
+    norms = row_norms(matrix) if norms is None else norms
+    return merge_top_k([partial_top_k(queries, matrix, norms, 2 * k)], k, queries, matrix)
+
+# ============================================================================
+# WORKER
+# ============================================================================
+
+_shared = {}
+
+def _attach(name, shape):
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(1)
+    shm = shared_memory.SharedMemory(name=name)
+    rows, dim = shape
+    matrix = np.ndarray((rows, dim), dtype=np.float32, buffer=shm.buf)
+    norms = np.ndarray((rows,), dtype=np.float32, buffer=shm.buf, offset=rows * dim * 4)
+    _shared.update(shm=shm, matrix=matrix, norms=norms)
+
+def _search_shard(task):
+    start, stop, queries, k = task
+    return partial_top_k(queries, _shared["matrix"][start:stop], _shared["norms"][start:stop], k, offset=start)
+
+def _release(shm, pool):
+    pool.shutdown(wait=False, cancel_futures=True)
+    try:
+        shm.close()
+    except BufferError:
+        pass  # viste ancora in uso: il mapping resta finché non vengono rilasciate
+    shm.unlink()
+
+# ============================================================================
+# MOTORE
+# ============================================================================
+
+class ShardedSearch:
+    """Matrice (N, D) in memoria condivisa + pool di processi, uno shard per worker"""
+
+    def __init__(self, matrix, workers=None, chunk_size=65536):
+        self.workers = max(1, workers or DEFAULT_WORKERS)
+        rows, dim = matrix.shape
+        # Matrice float32 seguita dalle norme al quadrato, in un solo blocco
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, rows * (dim + 1) * 4))
+        self.matrix = np.ndarray((rows, dim), dtype=np.float32, buffer=self._shm.buf)
+        for start in range(0, rows, chunk_size):
+            self.matrix[start:start + chunk_size] = matrix[start:start + chunk_size]
+        self.norms = np.ndarray((rows,), dtype=np.float32, buffer=self._shm.buf, offset=rows * dim * 4)
+        self.norms[:] = row_norms(self.matrix)
+
+        bounds = np.linspace(0, rows, self.workers + 1).astype(int)
+        self.shards = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_attach,
+                                         initargs=(self._shm.name, (rows, dim)))
+        # Il blocco viene liberato anche se close() non viene chiamata
+        self._finalizer = weakref.finalize(self, _release, self._shm, self._pool)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def search(self, queries, k=5):
+        """Top k esatti: (indici, distanze) (Q, k) ordinati; una query 1D -> array 1D"""
+        single = np.ndim(queries) == 1
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not self.shards:
+            idx, dist = np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0))
+        else:
+            # 2k per shard: margine per il riordino esatto in merge_top_k
+            parts = self._pool.map(_search_shard, [(a, b, queries, 2 * k) for a, b in self.shards])
+            idx, dist = merge_top_k(list(parts), k, queries, self.matrix)
+        return (idx[0], dist[0]) if single else (idx, dist)
+
+    def close(self):
+        self.matrix = self.norms = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def bench(matrix, workers_list, n_queries=256, k=10, seed=0):
+    """Query/s del ciclo cdist di lib3d e del motore a shard; verifica che i risultati coincidano"""
+    import lib3d
+
+    rng = np.random.default_rng(seed)
+    queries = np.asarray(matrix[rng.choice(len(matrix), size=min(n_queries, len(matrix)), replace=False)])
+
+    started = time.perf_counter()
+    reference = [lib3d.k_nearest_matrix(q, matrix, k) for q in queries]
+    elapsed = time.perf_counter() - started
+    report = {"cdist per query": {"queries_per_s": len(queries) / elapsed}}
+
+    for workers in workers_list:
+        with ShardedSearch(matrix, workers) as engine:
+            engine.search(queries[:1], k)  # avvio dei worker
+            started = time.perf_counter()
+            idx, dist = engine.search(queries, k)
+            elapsed = time.perf_counter() - started
+        same = np.mean([len(set(i.tolist()) & set(r[0].tolist())) / len(r[0]) for i, r in zip(idx, reference)])
+        error = max(float(np.abs(d - r[1]).max()) for d, r in zip(dist, reference))
+        report[f"workers={workers}"] = {"queries_per_s": len(queries) / elapsed,
+                                        "same_neighbours": float(same), "max_distance_error": error}
+    return report
+
+def main():
+    import embedding_store
+
+    parser = argparse.ArgumentParser(description='Sharded multi-process exact search.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('bench', help='Compare with the single-core cdist loop.')
+    p.add_argument('store_path')
+    p.add_argument('--workers', type=int, nargs='+', default=[1, DEFAULT_WORKERS])
+    p.add_argument('--queries', type=int, default=256)
+    p.add_argument('-k', type=int, default=10)
+
+    args = parser.parse_args()
+    store = embedding_store.open_store(args.store_path)
+    print(json.dumps(bench(store.matrix, args.workers, args.queries, args.k), indent=2))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,295 @@
+# ============================================================================
+# graph_incremental.py - graph_nearest incrementale (PCA salvata + kNN aggiornato)
+# ============================================================================
+#
+# Invece di rifare PCA e kneighbors_graph su tutti i punti a ogni modifica del
+# corpus, si salva lo stato del grafo:
+#
+#   projection_<n>d.npz   base PCA (projection.py): la stessa di projection.py
+#                         fit e di graph_nearest non incrementale, quindi le
+#                         stesse righe finiscono alle stesse coordinate
+#   graph_knn_<n>d.npz    punti proiettati, liste dei k vicini (indici e
+#                         distanze), residuo di riferimento, id della base
+#                         usata e impronta delle righe coperte
+#
+# I nuovi embedding vengono proiettati con la base salvata e si aggiornano solo
+# le liste di vicini toccate (i nuovi nodi e i vecchi nodi che hanno un nuovo
+# punto più vicino del loro k-esimo vicino). Se la base "deriva" (i nuovi punti
+# sono spiegati molto peggio dalla PCA salvata) si rifà il fit completo. Se la
+# base è cambiata (projection.py fit, --refit) o le righe già nel grafo sono
+# cambiate, il grafo si ricostruisce con la base salvata.
+
+import os
+import hashlib
+
+import numpy as np
+from scipy.spatial.distance import cdist
+from sklearn.neighbors import NearestNeighbors
+
+import projection
+
+AXES = ("x", "y", "z")
+
+def knn_file(n_components):
+    return f"graph_knn_{n_components}d.npz"
+
+def default_k(points):
+    """Stessa euristica di lib3d.graph_nearest"""
+    return max(2, min(10, int(len(points) ** 0.5)))
+
+def basis_id(basis):
+    """Id di una base PCA (cambia se la base viene rifatta)"""
+    return hashlib.sha1(basis.mean.tobytes() + basis.components.tobytes()).hexdigest()[:16]
+
+def content_fingerprint(embeddings, rows, chunk_size=projection.CHUNK_SIZE):
+    """Impronta delle prime `rows` righe (sha1 dei float32, a blocchi)"""
+    digest = hashlib.sha1(str(rows).encode())
+    for start in range(0, rows, chunk_size):
+        digest.update(np.ascontiguousarray(embeddings[start:min(start + chunk_size, rows)], dtype=np.float32))
+    return digest.hexdigest()[:16]
+
+# ============================================================================
+# STATO DEL GRAFO
+# ============================================================================
+
+class IncrementalGraph:
+    """Base PCA + liste kNN dei punti proiettati, aggiornabili a blocchi"""
+
+    def __init__(self, basis, baseline_residual, points, neigh_idx, neigh_dist, fingerprint=""):
+        self.basis = basis
+        self.baseline_residual = float(baseline_residual)
+        self.points = points
+        self.neigh_idx = neigh_idx
+        self.neigh_dist = neigh_dist
+        self.fingerprint = str(fingerprint)
+        self.stale = False
+
+    @property
+    def k(self):
+        return self.neigh_idx.shape[1]
+
+    def __len__(self):
+        return len(self.points)
+
+    # ------------------------------------------------------------------------
+    # Proiezione
+    # ------------------------------------------------------------------------
+
+    def project(self, embeddings):
+        return self.basis.transform(np.asarray(embeddings))
+
+    def residual_ratio(self, embeddings, chunk_size=projection.CHUNK_SIZE):
+        """Frazione di varianza NON spiegata dalla base (0 = spiegata tutta)"""
+        # Base ortonormale: residuo = ||x - mean||^2 - ||proiezione||^2, a blocchi
+        total = explained = 0.0
+        for start in range(0, len(embeddings), chunk_size):
+            centered = np.asarray(embeddings[start:start + chunk_size], dtype=np.float64) - self.basis.mean
+            total += float((centered ** 2).sum())
+            explained += float(((centered @ self.basis.components.T) ** 2).sum())
+        return max(total - explained, 0.0) / total if total else 0.0
+
+    # ------------------------------------------------------------------------
+    # Fit completo
+    # ------------------------------------------------------------------------
+
+    @classmethod
+    def fit(cls, embeddings, n_components=3, choose_k=default_k, basis=None):
+        """Grafo completo; con `basis` riusa quella base invece di rifare la PCA"""
+        basis = basis or projection.Projection.fit(embeddings, n_components)
+
+        graph = cls(basis, 0.0, None, None, None)
+        graph.points = graph.project(embeddings)
+        graph.baseline_residual = graph.residual_ratio(embeddings)
+
+        k = min(choose_k(graph.points), len(embeddings) - 1)
+        neigh_dist, neigh_idx = NearestNeighbors(n_neighbors=k).fit(graph.points).kneighbors()
+        graph.neigh_idx, graph.neigh_dist = neigh_idx, neigh_dist
+        return graph
+
+    # ------------------------------------------------------------------------
+    # Aggiornamento incrementale
+    # ------------------------------------------------------------------------
+
+    def drift(self, embeddings):
+        """Aumento relativo del residuo dei nuovi punti rispetto al fit"""
+        if not self.baseline_residual:
+            return 0.0
+        return (self.residual_ratio(embeddings) - self.baseline_residual) / self.baseline_residual
+
+    def add(self, embeddings):
+        """Aggiunge nuovi punti in coda; ritorna il delta (nodi e archi aggiunti/rimossi)"""
+        new_points = self.project(embeddings)
+        n_old, k = len(self.points), self.k
+        all_points = np.vstack([self.points, new_points])
+        new_ids = np.arange(n_old, len(all_points))
+
+        # Vicini dei nuovi nodi (tra tutti i punti, escluso sé stesso)
+        nn = NearestNeighbors(n_neighbors=min(k + 1, len(all_points))).fit(all_points)
+        dist, idx = nn.kneighbors(new_points)
+        new_idx, new_dist = _drop_self(idx, dist, new_ids, k)
+
+        # Vecchi nodi per cui un nuovo punto batte il k-esimo vicino
+        old_idx, old_dist = self.neigh_idx.copy(), self.neigh_dist.copy()
+        changed = []
+        for start in range(0, n_old, 8192):
+            block = cdist(self.points[start:start + 8192], new_points)
+            rows = np.nonzero(block.min(axis=1) < old_dist[start:start + 8192, -1])[0]
+            for r in rows:
+                i = start + r
+                cand_idx = np.concatenate([old_idx[i], new_ids])
+                cand_dist = np.concatenate([old_dist[i], block[r]])
+                best = np.argsort(cand_dist, kind='stable')[:k]
+                old_idx[i], old_dist[i] = cand_idx[best], cand_dist[best]
+                changed.append(i)
+
+        delta = self._delta(changed, old_idx, old_dist, new_idx, new_dist, n_old)
+
+        self.points = all_points
+        self.neigh_idx = np.vstack([old_idx, new_idx])
+        self.neigh_dist = np.vstack([old_dist, new_dist])
+
+        delta["added_nodes"] = [_node(i, p) for i, p in zip(new_ids.tolist(), new_points)]
+        return delta
+
+    def _delta(self, changed, updated_idx, updated_dist, new_idx, new_dist, n_old):
+        before = self.neigh_idx
+        lists_after = lambda i: updated_idx[i] if i < n_old else new_idx[i - n_old]
+
+        removed, added = {}, {}
+        for i in changed:
+            old_set, new_set = set(before[i].tolist()), set(updated_idx[i].tolist())
+            for j in old_set - new_set:
+                # L'arco non orientato sparisce solo se manca anche j -> i
+                if i not in lists_after(j):
+                    removed[(min(i, j), max(i, j))] = True
+            for j, d in zip(updated_idx[i].tolist(), updated_dist[i].tolist()):
+                if j not in old_set and not (j < n_old and i in before[j]):
+                    added[(min(i, j), max(i, j))] = float(d)
+
+        for r, i in enumerate(range(n_old, n_old + len(new_idx))):
+            for j, d in zip(new_idx[r].tolist(), new_dist[r].tolist()):
+                added.setdefault((min(i, j), max(i, j)), float(d))
+
+        return {
+            "added_edges": [{"source": u, "target": v, "weight": w} for (u, v), w in added.items()],
+            "removed_edges": [{"source": u, "target": v} for (u, v) in removed],
+        }
+
+    # ------------------------------------------------------------------------
+    # Output e persistenza
+    # ------------------------------------------------------------------------
+
+    def edge_arrays(self):
+        """Archi non orientati (u < v) come array (sources, targets, weights)"""
+        n, k = self.neigh_idx.shape
+        rows = np.repeat(np.arange(n), k)
+        cols = self.neigh_idx.ravel()
+        u, v = np.minimum(rows, cols), np.maximum(rows, cols)
+        _, first = np.unique(u.astype(np.int64) * n + v, return_index=True)
+        return u[first], v[first], self.neigh_dist.ravel()[first]
+
+    def edges(self):
+        """Archi non orientati (u < v) con peso = distanza"""
+        sources, targets, weights = self.edge_arrays()
+        return [{"source": u, "target": v, "weight": w}
+                for u, v, w in zip(sources.tolist(), targets.tolist(), weights.tolist())]
+
+    def nodes(self):
+        return [_node(i, p) for i, p in enumerate(self.points)]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        n_components = self.basis.n_components
+        self.basis.save(projection.store_basis_path(path, n_components))
+        tmp = os.path.join(path, knn_file(n_components) + ".tmp.npz")
+        np.savez(tmp, points=self.points, neigh_idx=self.neigh_idx, neigh_dist=self.neigh_dist,
+                 baseline_residual=self.baseline_residual, basis_id=basis_id(self.basis),
+                 fingerprint=self.fingerprint)
+        os.replace(tmp, os.path.join(path, knn_file(n_components)))
+
+    @classmethod
+    def load(cls, path, basis):
+        """Liste kNN salvate (None se mancano); `stale` se calcolate con una base diversa da `basis`"""
+        knn_path = os.path.join(path, knn_file(basis.n_components))
+        if not os.path.exists(knn_path):
+            return None
+        with np.load(knn_path) as knn:
+            graph = cls(basis, knn["baseline_residual"], knn["points"], knn["neigh_idx"], knn["neigh_dist"],
+                        knn["fingerprint"])
+            graph.stale = str(knn["basis_id"]) != basis_id(basis)
+        return graph
+
+def _drop_self(idx, dist, self_ids, k):
+    """Rimuove il punto stesso dai risultati di kneighbors (o l'ultimo se non c'è)"""
+    out_idx = np.empty((len(idx), k), dtype=idx.dtype)
+    out_dist = np.empty((len(idx), k), dtype=dist.dtype)
+    for r, own in enumerate(self_ids):
+        keep = np.nonzero(idx[r] != own)[0][:k]
+        out_idx[r], out_dist[r] = idx[r][keep], dist[r][keep]
+    return out_idx, out_dist
+
+def _node(i, point):
+    node = {"id": int(i)}
+    node.update({axis: float(v) for axis, v in zip(AXES, point)})
+    return node
+
+# ============================================================================
+# API DI ALTO LIVELLO
+# ============================================================================
+
+def update_graph(embeddings, state_path, n_components=3, choose_k=default_k,
+                 drift_threshold=0.25, refit_after=1.0, fingerprint=None, refit=False):
+    """Porta lo stato salvato in `state_path` a coprire tutte le righe di `embeddings`
+
+    Le righe oltre quelle già nel grafo sono considerate nuove (corpus in sola
+    aggiunta). `fingerprint(rows)` è l'impronta delle prime `rows` righe
+    (default: content_fingerprint); se quella delle righe già nel grafo è
+    cambiata, o se il grafo ha più righe di `embeddings`, il grafo si
+    ricostruisce con la base salvata. La base si rifà con `refit=True`, se non
+    c'è, se la deriva supera `drift_threshold` o se i punti aggiunti
+    dall'ultimo fit superano `refit_after` volte quelli del fit. Ritorna
+    (grafo, delta); dopo una ricostruzione il delta ha tutti i nodi e gli
+    archi nuovi e, in "removed_edges", gli archi del grafo precedente che non
+    ci sono più.
+    """
+    embeddings = np.asarray(embeddings)
+    fingerprint = fingerprint or (lambda rows: content_fingerprint(embeddings, rows))
+
+    basis_path = projection.store_basis_path(state_path, n_components)
+    basis = projection.Projection.load(basis_path) if os.path.exists(basis_path) else None
+    if basis is not None and (basis.dim != embeddings.shape[1] or basis.n_components != n_components):
+        basis = None
+    previous = graph = IncrementalGraph.load(state_path, basis) if basis is not None else None
+
+    delta = {"refit": False, "drift": 0.0, "added_nodes": [], "added_edges": [], "removed_edges": []}
+    if refit:
+        graph = basis = None
+    if graph is not None and (graph.stale or len(graph) > len(embeddings)
+                              or graph.fingerprint != fingerprint(len(graph))):
+        graph = None  # base cambiata, righe rimosse o cambiate: grafo da rifare, la base resta
+
+    if graph is not None and len(graph) < len(embeddings):
+        new = embeddings[len(graph):]
+        delta["drift"] = graph.drift(new)
+        too_many = len(embeddings) - basis.n_fit > refit_after * basis.n_fit
+        if delta["drift"] > drift_threshold or too_many:
+            graph = basis = None
+        else:
+            delta.update(graph.add(new))
+
+    if graph is None:
+        graph = IncrementalGraph.fit(embeddings, n_components, choose_k, basis)
+        delta.update(refit=True, added_nodes=graph.nodes(), added_edges=graph.edges(),
+                     removed_edges=_removed_edges(previous, graph))
+
+    graph.fingerprint = fingerprint(len(graph))
+    graph.save(state_path)
+    return graph, delta
+
+def _removed_edges(before, after):
+    """Archi di `before` che non sono in `after` (grafo ricostruito)"""
+    if before is None:
+        return []
+    kept = set(zip(*(a.tolist() for a in after.edge_arrays()[:2])))
+    sources, targets, _ = before.edge_arrays()
+    return [{"source": u, "target": v} for u, v in zip(sources.tolist(), targets.tolist()) if (u, v) not in kept]
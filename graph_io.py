@@ -0,0 +1,123 @@
+# ============================================================================
+# graph_io.py - Scrittura del grafo in streaming (JSON) e in formato binario
+# ============================================================================
+#
+# graph_nearest costruiva tutto il grafo come dict Python e poi lo scriveva con
+# json.dump(..., indent=2). Qui il grafo resta in array numpy (punti, archi,
+# pesi) e viene scritto man mano:
+#
+#   write_graph_json(f, points, sources, targets, weights, blobs=None)
+#       stesso JSON di graph_nearest ({"nodes", "blobs", "edges"}), compatto;
+#       "blobs" è opzionale (None = omesso)
+#
+#   write_graph_binary(f, points, sources, targets, weights)
+#       layout a typed array per il frontend (fetch + ArrayBuffer), little-endian:
+#
+#         offset 0    char[4]   magic "LWG1"
+#         offset 4    uint32    n_nodes
+#         offset 8    uint32    dims (2 o 3)
+#         offset 12   uint32    n_edges
+#         offset 16   float32   coords[n_nodes * dims]   (x, y[, z] per nodo)
+#         ...         uint32    edges[n_edges * 2]       (source, target)
+#         ...         float32   weights[n_edges]
+#
+#       Tutte le sezioni sono allineate a 4 byte: in JS basta
+#       new Float32Array(buffer, 16, n_nodes * dims) ecc.
+#
+#   write_graph_ids(binary_path, n_nodes, ids=None)
+#       sidecar <nome>.ids.json del binario ({"nodes", "ids"}): LWG1 non ha id
+#       né etichette; index.html usa graph.bin solo se il sidecar c'è, ha lo
+#       stesso numero di nodi e non è più vecchio di graph.json
+
+import os
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b"LWG1"
+HEADER = struct.Struct("<4sIII")
+
+AXES = ("x", "y", "z")
+
+# ============================================================================
+# JSON IN STREAMING
+# ============================================================================
+
+def _write_array(f, items, chunk_size=4096):
+    # Scrive "[item, item, ...]" a blocchi, senza tenere in memoria la lista intera
+    f.write("[")
+    first = True
+    buffer = []
+    for item in items:
+        buffer.append(json.dumps(item, separators=(",", ":")))
+        if len(buffer) >= chunk_size:
+            f.write(("" if first else ",") + ",".join(buffer))
+            first, buffer = False, []
+    if buffer:
+        f.write(("" if first else ",") + ",".join(buffer))
+    f.write("]")
+
+def iter_nodes(points, extra=None):
+    """Nodi {"id", "x", "y"[, "z"]} generati dai punti; `extra(i)` aggiunge campi"""
+    dims = points.shape[1]
+    for i, row in enumerate(np.asarray(points, dtype=np.float64).tolist()):
+        node = {"id": i}
+        node.update(zip(AXES[:dims], row))
+        if extra is not None:
+            node.update(extra(i))
+        yield node
+
+def iter_edges(sources, targets, weights):
+    for u, v, w in zip(np.asarray(sources).tolist(), np.asarray(targets).tolist(),
+                       np.asarray(weights, dtype=np.float64).tolist()):
+        yield {"source": u, "target": v, "weight": w}
+
+def write_graph_json(f, points, sources, targets, weights, blobs=None, node_extra=None, extra=None):
+    """Scrive il grafo come JSON compatto; `blobs` è un iterabile di stringhe base64 (o None)"""
+    f.write('{"nodes":')
+    _write_array(f, iter_nodes(points, node_extra))
+    if blobs is not None:
+        f.write(',"blobs":')
+        _write_array(f, ({"id": i, "blob": b} for i, b in enumerate(blobs)))
+    f.write(',"edges":')
+    _write_array(f, iter_edges(sources, targets, weights))
+    for key, value in (extra or {}).items():
+        f.write(f',{json.dumps(key)}:')
+        json.dump(value, f, separators=(",", ":"))
+    f.write("}\n")
+
+# ============================================================================
+# FORMATO BINARIO
+# ============================================================================
+
+def write_graph_binary(f, points, sources, targets, weights):
+    """Scrive il layout LWG1 su un file aperto in modalità binaria"""
+    points = np.asarray(points, dtype="<f4")
+    f.write(HEADER.pack(MAGIC, points.shape[0], points.shape[1], len(sources)))
+    f.write(np.ascontiguousarray(points).tobytes())
+    f.write(np.column_stack([sources, targets]).astype("<u4").tobytes())
+    f.write(np.asarray(weights, dtype="<f4").tobytes())
+
+def ids_path(binary_path):
+    return os.path.splitext(binary_path)[0] + ".ids.json"
+
+def write_graph_ids(binary_path, n_nodes, ids=None):
+    """Sidecar del file binario: numero di nodi e id (None se il grafo non ne ha)"""
+    with open(ids_path(binary_path), 'w', encoding='utf-8') as f:
+        json.dump({"nodes": int(n_nodes), "ids": ids}, f)
+
+def read_graph_binary(f):
+    """Legge il layout LWG1: ritorna (points, sources, targets, weights)"""
+    data = f.read()
+    magic, n_nodes, dims, n_edges = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"Not a graph binary file (magic {magic!r})")
+
+    offset = HEADER.size
+    points = np.frombuffer(data, dtype="<f4", count=n_nodes * dims, offset=offset).reshape(n_nodes, dims)
+    offset += points.nbytes
+    edges = np.frombuffer(data, dtype="<u4", count=n_edges * 2, offset=offset).reshape(n_edges, 2)
+    offset += edges.nbytes
+    weights = np.frombuffer(data, dtype="<f4", count=n_edges, offset=offset)
+    return points, edges[:, 0], edges[:, 1], weights
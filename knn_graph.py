@@ -0,0 +1,50 @@
+# ============================================================================
+# knn_graph.py - Un solo calcolo kNN riusato per tutti i k candidati
+# ============================================================================
+#
+# find_optimal_neighbors_fast provava fino a 6 valori di k rifacendo ogni volta
+# kneighbors_graph, e graph_nearest lo rifaceva una volta in più. Qui le liste
+# dei vicini si calcolano una volta sola a k massimo: il grafo con k vicini è il
+# prefisso [:, :k] delle liste, e il numero di zone per OGNI k si ottiene in un
+# solo passaggio aggiungendo gli archi in ordine di rango (union-find
+# vettorizzato: a ogni passo si contraggono le componenti già trovate).
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.neighbors import NearestNeighbors
+
+def knn_lists(points, max_k):
+    """(distanze, indici) dei `max_k` vicini di ogni punto, escluso il punto stesso"""
+    max_k = min(max_k, len(points) - 1)
+    return NearestNeighbors(n_neighbors=max_k).fit(points).kneighbors()
+
+def zone_labels(neigh_idx):
+    """labels[k - 1] = zona (componente connessa, etichette 0..count-1) di ogni punto con k vicini
+
+    Le zone sono annidate: aggiungendo vicini le componenti si uniscono e basta,
+    quindi ogni zona a k è contenuta in una sola zona a k + 1.
+    """
+    n, max_k = neigh_idx.shape
+    labels = np.arange(n)
+    levels = []
+    for rank in range(max_k):
+        # Archi di rango `rank` tra le componenti correnti (grafo contratto)
+        src, dst = labels, labels[neigh_idx[:, rank]]
+        m = int(labels.max()) + 1
+        contracted = coo_matrix((np.ones(n, dtype=np.int8), (src, dst)), shape=(m, m))
+        _, merged = connected_components(contracted, directed=False)
+        labels = merged[labels]
+        levels.append(labels)
+    return levels
+
+def zone_counts(neigh_idx):
+    """counts[k - 1] = componenti connesse del grafo kNN con k vicini, per k = 1..max_k"""
+    return [int(labels.max()) + 1 for labels in zone_labels(neigh_idx)]
+
+def knn_adjacency(neigh_dist, neigh_idx, k, mode='distance'):
+    """Prefisso k delle liste come matrice sparsa, uguale a kneighbors_graph(include_self=False)"""
+    n = len(neigh_idx)
+    data = neigh_dist[:, :k].ravel() if mode == 'distance' else np.ones(n * k)
+    indptr = np.arange(0, n * k + 1, k)
+    return csr_matrix((data, neigh_idx[:, :k].ravel(), indptr), shape=(n, n))
@@ -1,27 +1,41 @@
 import os
-import ollama
+import math
 import struct
 import base64
 import json
-import matplotlib.pyplot as plt
-import networkx as nx
-import numpy as np
-from openai import OpenAI
-from dotenv import load_dotenv
-from scipy.spatial.distance import euclidean
-from sklearn.decomposition import PCA
-from sklearn.neighbors import kneighbors_graph
-
-# * import openai key saved on .env file
-load_dotenv()
-client = OpenAI(api_key = os.getenv("OPENAI_API_KEY"), base_url="https://api.deepseek.com")
-
-def json2points(blobs_json):
+import argparse
+
+# * heavy dependencies (numpy, scipy, sklearn, ollama, openai) are imported inside the
+# * functions that use them, so `import lib` stays cheap (see tools/bench_import.py)
+
+_client = None
+
+# * openai client, created on first use with the key saved on .env file
+def get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _client = OpenAI(api_key = os.getenv("OPENAI_API_KEY"), base_url="https://api.deepseek.com")
+    return _client
+
+# * keeps `lib.client` working for existing callers without creating it at import time
+def __getattr__(name):
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# * basis_path: saved 2D projection (projection.py), fitted on first use and then only applied
+def json2points(blobs_json, basis_path=None, refit=False):
+    import projection
+    from lib3d import blobs2matrix
+
     blobs = json2list(blobs_json)
-    embeddings = [blob2embedding(b) for b in blobs]
+    embeddings = blobs2matrix(blobs)
 
-    pca = PCA(n_components=2)
-    points_2d = pca.fit_transform(embeddings)
+    points_2d = projection.project(embeddings, 2, basis_path, refit)
     points_2d_list = points_2d.tolist()
 
     return points_2d_list
@@ -38,10 +52,16 @@ def blob2base64(blob):
 
 # * function to return a "blobbed" embedding of the sentence
 def get_blob(sentence):
-    embedding = ollama.embeddings(model='mxbai-embed-large', prompt=sentence)["embedding"]
-    blob = struct.pack(f'I{len(embedding)}f', len(embedding), *embedding)
+    return get_blobs([sentence])[0]
+
+# * batched version: many sentences per request over a shared Ollama client pool
+def get_blobs(sentences, pool=None):
+    import embedder
 
-    return blob
+    embeddings = (pool or embedder.default_pool()).embed(sentences)
+    blobs = [struct.pack(f'I{len(e)}f', len(e), *e) for e in embeddings]
+
+    return blobs
 
 # * function to convert blob to embedding
 def blob2embedding(embedding_blob):
@@ -52,36 +72,47 @@ def blob2embedding(embedding_blob):
 
 # * distance between 2 blobs
 def blob_distance(blob_a, blob_b):
+    from scipy.spatial.distance import euclidean
+
     embedding_a = blob2embedding(blob_a)
     embedding_b = blob2embedding(blob_b)
 
     return euclidean(embedding_a, embedding_b) 
 
 def k_nearest(blob_a, k, blobs_json):
+    import numpy as np
+    from lib3d import blobs2matrix
+
     blobs = json2list(blobs_json) 
+    matrix = blobs2matrix(blobs)
+    query = blobs2matrix([blob_a])[0]
 
-    distances = [(blob, blob_distance(blob_a, blob)) for blob in blobs]
-    distances.sort(key=lambda x: x[1])
+    distances = np.linalg.norm(matrix - query, axis=1)
+    order = np.argsort(distances, kind='stable')[:k]
 
-    embeddings = [(blob2embedding(blob), dist) for blob, dist in distances[:k]]
+    embeddings = [(matrix[i].tolist(), float(distances[i])) for i in order]
     return embeddings
 
 
 def calculate_optimal_zone_range(n_points):
-    base = max(3, int(np.log(n_points) * 2))
+    base = max(3, int(math.log(n_points) * 2))
     return max(2, int(base * 0.6)), min(n_points // 5, int(base * 1.4))
 
-def find_optimal_neighbors_fast(points, target_zones_range=(5, 20), max_neighbors=10):
+def find_optimal_neighbors_fast(points, target_zones_range=(5, 20), max_neighbors=10, knn=None):
+    from knn_graph import knn_lists, zone_counts
+
     n_points = len(points)
     low, high = 2, min(max_neighbors, n_points - 1)
     best_k, best_count = 3, 0
-    initial_k = max(2, int(n_points**0.5))
+    initial_k = min(max(2, int(n_points**0.5)), n_points - 1)
+
+    # * one kNN computation for every candidate k: counts[k - 1] = zones with k neighbours
+    if knn is None or knn[1].shape[1] < max(initial_k, high):
+        knn = knn_lists(points, max(initial_k, high))
+    counts = zone_counts(knn[1])
 
     def zone_count(k):
-        G = nx.from_scipy_sparse_array(
-            kneighbors_graph(points, n_neighbors=k, mode='connectivity', include_self=False)
-        )
-        return len(list(nx.connected_components(G)))
+        return counts[k - 1]
 
     count = zone_count(initial_k)
     if target_zones_range[0] <= count <= target_zones_range[1]:
@@ -102,49 +133,100 @@ def find_optimal_neighbors_fast(points, target_zones_range=(5, 20), max_neighbor
     return best_k, best_count
 
 
-def zone_count(k):
-    G = nx.from_scipy_sparse_array(kneighbors_graph(points, n_neighbors=k, mode='connectivity', include_self=False))
-    return len(list(nx.connected_components(G)))
-    
-    count = zone_count(initial_k)
-    if target_zones_range[0] <= count <= target_zones_range[1]:
-        return initial_k, count
-    
-    for _ in range(5):
-        mid = (low + high) // 2
-        count = zone_count(mid)
-        if target_zones_range[0] <= count <= target_zones_range[1]: return mid, count
-        if count < target_zones_range[0]: high = mid - 1
-        else: low = mid + 1
-        if abs(count - sum(target_zones_range)/2) < abs(best_count - sum(target_zones_range)/2):
-            best_k, best_count = mid, count
-    return best_k, best_count
-
-def graph_nearest(blobs_json):
-    points = json2points(blobs_json)
+def graph_nearest(blobs_json, basis_path=None):
+    points, sources, targets, weights = graph_nearest_arrays(blobs_json, basis_path)
     blobs = json2list(blobs_json)
 
-    min_zones, max_zones = calculate_optimal_zone_range(len(points))
-    optimal_k, zone_count = find_optimal_neighbors_fast(points, target_zones_range=(min_zones, max_zones))
-
-    A = kneighbors_graph(points, n_neighbors=optimal_k, mode='distance', include_self=False)
-    G = nx.from_scipy_sparse_array(A)
-
     graph_json = {
         "nodes": [{"id": i, "x": float(points[i][0]), "y": float(points[i][1])} for i in range(len(points))],
         "blobs": [{"id": i, "blob": blob2base64(blobs[i])} for i in range(len(blobs))],
-        "edges": [{"source": int(u), "target": int(v), "weight": float(d["weight"])}
-                for u, v, d in G.edges(data=True)]
+        "edges": [{"source": u, "target": v, "weight": w}
+                for u, v, w in zip(sources.tolist(), targets.tolist(), weights.tolist())]
     }
 
     return graph_json
 
+# * same graph as numpy arrays (points, sources, targets, weights), used by the streaming writers
+def graph_nearest_arrays(blobs_json, basis_path=None, refit=False):
+    import numpy as np
+    from knn_graph import knn_lists, knn_adjacency
+    from lib3d import sparse_edges
 
+    points = np.array(json2points(blobs_json, basis_path, refit))
+
+    min_zones, max_zones = calculate_optimal_zone_range(len(points))
+    knn = knn_lists(points, max(10, int(len(points)**0.5)))
+    optimal_k, zone_count = find_optimal_neighbors_fast(points, target_zones_range=(min_zones, max_zones), knn=knn)
 
-with open("embeddings_blob.json", "r", encoding="utf-8") as f:
-    data = json.load(f)
+    # * final distance graph is a prefix slice of the same neighbour lists
+    A = knn_adjacency(*knn, optimal_k)
+    sources, targets, weights = sparse_edges(A)
+
+    return points, sources, targets, weights
+
+# * incremental version: reuses the saved 2D PCA basis and kNN lists in state_path,
+# * only rows appended since the last call are projected and linked
+def graph_nearest_incremental(blobs_json, state_path="graph_state"):
+    blobs = json2list(blobs_json)
+    state, delta = update_incremental_graph(blobs_json, state_path)
+
+    graph_json = {
+        "nodes": state.nodes(),
+        "blobs": [{"id": i, "blob": blob2base64(blobs[i])} for i in range(len(blobs))],
+        "edges": state.edges(),
+        "delta": delta
+    }
+
+    return graph_json
 
-graph = graph_nearest(data)
-with open("graph.json", "w", encoding="utf-8") as f:
-    json.dump(graph, f, indent=2)
-print(f"Saved graph JSON to {"graph.json"}")
+# * returns the updated graph_incremental.IncrementalGraph state and the delta
+def update_incremental_graph(blobs_json, state_path="graph_state"):
+    import graph_incremental
+    from lib3d import blobs2matrix
+
+    def choose_k(points):
+        min_zones, max_zones = calculate_optimal_zone_range(len(points))
+        return find_optimal_neighbors_fast(points, target_zones_range=(min_zones, max_zones))[0]
+
+    return graph_incremental.update_graph(blobs2matrix(json2list(blobs_json)), state_path,
+                                          n_components=2, choose_k=choose_k)
+
+# * explicit entry point: embeddings_blob.json -> graph.json (streamed) and/or graph.bin
+def main():
+    parser = argparse.ArgumentParser(description='Build the 2D kNN graph from a blob JSON file.')
+    parser.add_argument('input', nargs='?', default='embeddings_blob.json')
+    parser.add_argument('output', nargs='?', default='graph.json')
+    parser.add_argument('--incremental', action='store_true', help='Reuse the saved PCA basis and kNN lists.')
+    parser.add_argument('--state', default='graph_state', help='State directory for --incremental.')
+    parser.add_argument('--basis', metavar='PATH', help='Saved 2D projection basis (fitted if missing).')
+    parser.add_argument('--refit', action='store_true', help='Refit the --basis projection.')
+    parser.add_argument('--no-blobs', action='store_true', help='Leave the base64 blobs out of graph.json.')
+    parser.add_argument('--binary', metavar='PATH', help='Also write the compact typed-array graph (e.g. graph.bin).')
+    args = parser.parse_args()
+
+    import graph_io
+
+    with open(args.input, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    extra = None
+    if args.incremental:
+        state, delta = update_incremental_graph(data, args.state)
+        points, (sources, targets, weights) = state.points, state.edge_arrays()
+        extra = {"delta": delta}
+    else:
+        points, sources, targets, weights = graph_nearest_arrays(data, args.basis, args.refit)
+
+    blobs = None if args.no_blobs else data["blobs"]
+    with open(args.output, "w", encoding="utf-8") as f:
+        graph_io.write_graph_json(f, points, sources, targets, weights, blobs=blobs, extra=extra)
+    print(f"Saved graph JSON to {args.output}")
+
+    if args.binary:
+        with open(args.binary, "wb") as f:
+            graph_io.write_graph_binary(f, points, sources, targets, weights)
+        graph_io.write_graph_ids(args.binary, len(points))
+        print(f"Saved binary graph to {args.binary}")
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,26 @@ import sys
 import json
 import base64
 import struct
+import threading
 import traceback
-import ollama
 import numpy as np
-import networkx as nx
 from scipy.spatial.distance import cdist
-from sklearn.decomposition import PCA
 from sklearn.neighbors import kneighbors_graph
 
+import chunker
+import embedder
+import embedding_store
+import corpus
+import exact_search
+import graph_incremental
+import graph_io
+import projection
+import tiles
+# Liste IVF scandite per query quando lo store ha un indice ANN (LIGHTWIKI_NPROBE)
+from ann_index import IVFIndex, DEFAULT_NPROBE, ASSIGN_FILE, CENTROIDS_FILE, META_FILE
+from zones import ZoneIndex, DEFAULT_BEAM, ZONES_FILE
+from quantize import QuantizedStore, DEFAULT_RERANK
+
 # ============================================================================
 # FUNZIONI BASE
 # ============================================================================
@@ -28,15 +40,22 @@ def blob2base64(blob):
     """Codifica blob binario -> base64"""
     return base64.b64encode(blob).decode()
 
+def embedding2blob(embedding):
+    """Converte embedding (lista di float) -> blob binario"""
+    return struct.pack(f'I{len(embedding)}f', len(embedding), *embedding)
+
 def get_blob(sentence):
     """Genera embedding e ritorna blob binario"""
-    response = ollama.embeddings(model='mxbai-embed-large', prompt=sentence)
-    if 'embedding' not in response:
+    return get_blobs([sentence])[0]
+
+def get_blobs(sentences, pool=None):
+    """Genera embedding in batch (pool di client Ollama) e ritorna i blob binari"""
+    pool = pool or embedder.default_pool()
+    embeddings = pool.embed(sentences)
+    if any(not e for e in embeddings):
         raise ValueError("No embedding in Ollama response")
-    
-    embedding = response["embedding"]
-    blob = struct.pack(f'I{len(embedding)}f', len(embedding), *embedding)
-    return blob
+
+    return [embedding2blob(e) for e in embeddings]
 
 def blob2embedding(embedding_blob):
     """Converte blob binario -> numpy array"""
@@ -52,6 +71,53 @@ def blob2embedding(embedding_blob):
     embedding = struct.unpack(f'{length}f', embedding_blob[4:])
     return np.array(embedding)
 
+# ============================================================================
+# DECODIFICA / CODIFICA IN BLOCCO
+# ============================================================================
+
+def _blob_dtype(dim):
+    """Layout di un blob come record numpy: header uint32 + dim float32"""
+    return np.dtype([('length', np.uint32), ('values', np.float32, (dim,))])
+
+def blobs2matrix(blobs):
+    """Lista di blob (o buffer concatenato) -> matrice (N, D) float32, senza tuple intermedie"""
+    buffer = blobs if isinstance(blobs, (bytes, bytearray, memoryview)) else b"".join(blobs)
+    if len(buffer) < 4:
+        raise ValueError(f"Blob too short: {len(buffer)} bytes")
+    
+    dim = int(np.frombuffer(buffer, dtype=np.uint32, count=1)[0])
+    row_size = 4 + dim * 4
+    if len(buffer) % row_size:
+        raise ValueError(f"Size mismatch: {len(buffer)} bytes is not a multiple of {row_size}")
+    
+    # Un solo controllo vettoriale su tutti gli header
+    records = np.frombuffer(buffer, dtype=_blob_dtype(dim))
+    if (records['length'] != dim).any():
+        bad = int(np.argmax(records['length'] != dim))
+        raise ValueError(f"Blob {bad} has length {records['length'][bad]}, expected {dim}")
+    
+    return records['values']
+
+def b64list2matrix(blobs_b64):
+    """Lista di blob base64 -> matrice (N, D) float32"""
+    return blobs2matrix([base642blob(b) for b in blobs_b64])
+
+def matrix2buffer(matrix):
+    """Matrice (N, D) -> buffer con tutti i blob concatenati"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    records = np.empty(len(matrix), dtype=_blob_dtype(matrix.shape[1]))
+    records['length'] = matrix.shape[1]
+    records['values'] = matrix
+    return records.tobytes()
+
+def matrix2blobs(matrix):
+    """Matrice (N, D) -> lista di blob binari (stesso formato di get_blob)"""
+    buffer = matrix2buffer(matrix)
+    if not buffer:
+        return []
+    row_size = len(buffer) // len(matrix)
+    return [buffer[i:i + row_size] for i in range(0, len(buffer), row_size)]
+
 # ============================================================================
 # FUNZIONI OTTIMIZZATE
 # ============================================================================
@@ -61,11 +127,23 @@ def k_nearest(blob_a, blobs, k=5):
     if not blobs:
         return []
     
-    k = min(k, len(blobs))
-    
-    # Converti tutto in numpy array
+    # Converti tutto in numpy array (un solo passaggio per tutti i blob)
     query_emb = blob2embedding(blob_a)
-    embeddings = np.array([blob2embedding(b) for b in blobs])
+    embeddings = blobs2matrix(blobs)
+    
+    nearest_idx, distances = k_nearest_matrix(query_emb, embeddings, k)
+    
+    return [{
+        "blobs": blob2base64(blobs[i]),
+        "distance": float(d)
+    } for i, d in zip(nearest_idx, distances)]
+
+def k_nearest_matrix(query_emb, embeddings, k=5):
+    """Top k su una matrice (N, D) (anche np.memmap): ritorna (indici, distanze) ordinati"""
+    if len(embeddings) == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0)
+    
+    k = min(k, len(embeddings))
     
     # Calcolo distanze vettorizzato
     distances = cdist([query_emb], embeddings, metric='euclidean')[0]
@@ -74,55 +152,485 @@ def k_nearest(blob_a, blobs, k=5):
     nearest_idx = np.argpartition(distances, min(k, len(distances)-1))[:k]
     nearest_idx = nearest_idx[np.argsort(distances[nearest_idx])]
     
+    return nearest_idx, distances[nearest_idx]
+
+# Indici degli store caricati dal processo (server): ricaricati se i loro file
+# cambiano, come tiles.get_index; le righe aggiunte allo store si indicizzano
+# in memoria con sync
+_indexes = {}
+_index_lock = threading.Lock()
+
+def _store_index(store, kind, files, load):
+    """Indice `kind` dello store dalla cache, sincronizzato con lo store (StaleIndexError se non è suo)"""
+    mtimes = tuple(os.stat(os.path.join(store.path, name)).st_mtime_ns
+                   if os.path.exists(os.path.join(store.path, name)) else None for name in files)
+    key = (os.path.abspath(store.path), kind)
+    with _index_lock:
+        cached = _indexes.get(key)
+        if cached is None or cached[0] != mtimes:
+            cached = _indexes[key] = (mtimes, load(store.path))
+        return cached[1].sync(store)
+
+def k_nearest_store(blob_a, store, k=5, nprobe=None, exact=False, zones=False, beam=None,
+                    quantized=None, rerank=None):
+    """Come k_nearest ma su uno EmbeddingStore (memmap, nessun base64 in input)
+
+    Se lo store ha un indice IVF (ann_index.py) la ricerca è approssimata su
+    `nprobe` liste; con `zones=True` è coarse-to-fine sulle zone di zones.py
+    (`beam` zone per livello, poi `nprobe` zone scandite); con `quantized`
+    ("float16", "int8", "pq") scorre i codici di quantize.py e riordina i
+    `rerank` migliori in modo esatto. `exact=True` o nessun indice -> ricerca
+    esatta.
+    """
+    query_emb = blob2embedding(blob_a)
+    if not exact and quantized:
+        codes = _store_index(store, f"quant_{quantized}",
+                                (f"codes_{quantized}.npy", f"quant_{quantized}.npz"),
+                                lambda path: QuantizedStore.load(path, quantized))
+        nearest_idx, distances = codes.search(query_emb, k, store.matrix,
+                                              DEFAULT_RERANK if rerank is None else rerank)
+    elif not exact and zones:
+        index = _store_index(store, "zones", (ZONES_FILE,), ZoneIndex.load)
+        nearest_idx, distances, _, _ = index.search(query_emb, store.matrix, k, nprobe or DEFAULT_NPROBE,
+                                                    beam or DEFAULT_BEAM)
+    elif not exact and IVFIndex.exists(store.path):
+        index = _store_index(store, "ivf", (CENTROIDS_FILE, ASSIGN_FILE, META_FILE), IVFIndex.load)
+        nearest_idx, distances, _ = index.search(query_emb, store.matrix, k, nprobe or DEFAULT_NPROBE)
+    else:
+        nearest_idx, distances = k_nearest_matrix(query_emb, store.matrix, k)
+    blobs = matrix2blobs(store.matrix[nearest_idx])
+    
     return [{
-        "blobs": blob2base64(blobs[i]),
-        "distance": float(distances[i])
-    } for i in nearest_idx]
+        "id": store.ids[i],
+        "blobs": blob2base64(blob),
+        "distance": float(d)
+    } for i, blob, d in zip(nearest_idx, blobs, distances)]
+
+def k_nearest_docs(blob_a, blobs, doc_ids, k=5):
+    """k_nearest a livello di documento: i blob dei chunk vengono aggregati per doc_ids"""
+    if not blobs:
+        return []
+    
+    ids, docs = chunker.aggregate_matrix(blobs2matrix(blobs), doc_ids)
+    nearest_idx, distances = k_nearest_matrix(blob2embedding(blob_a), docs, k)
+    blobs = matrix2blobs(docs[nearest_idx])
+    
+    return [{
+        "id": ids[i],
+        "blobs": blob2base64(blob),
+        "distance": float(d)
+    } for i, blob, d in zip(nearest_idx, blobs, distances)]
+
+def k_nearest_batch(queries, matrix, ks):
+    """Top k di più query in un solo passaggio (distanze matrice-matrice, una lettura della matrice)
 
-def graph_nearest(blobs_json_list):
-    """Crea grafo 3D da lista di blob"""
+    `ks` ha un k per query; ritorna [(indici, distanze)] nell'ordine delle query.
+    """
+    idx, dist = exact_search.search_matrix(queries, matrix, max(ks))
+    return [(i[:k], d[:k]) for i, d, k in zip(idx, dist, ks)]
+
+def sparse_edges(A):
+    """Archi non orientati (u < v) di una matrice di adiacenza sparsa, senza networkx
+
+    Equivale a nx.from_scipy_sparse_array(A).edges(data=True): i -> j e j -> i
+    diventano un solo arco. Ritorna (sources, targets, weights) come array.
+    """
+    coo = A.tocoo()
+    mask = coo.row != coo.col
+    u = np.minimum(coo.row[mask], coo.col[mask]).astype(np.int64)
+    v = np.maximum(coo.row[mask], coo.col[mask]).astype(np.int64)
+    _, first = np.unique(u * A.shape[0] + v, return_index=True)
+    return u[first], v[first], coo.data[mask][first].astype(np.float64)
+
+def graph_nearest(blobs_json_list, basis_path=None):
+    """Crea grafo 3D da lista di blob (con `basis_path` riusa la base PCA salvata)"""
     # Converti base64 -> blob
     blobs = [base642blob(b64) for b64 in blobs_json_list]
     
     # Converti blob -> embeddings
-    embeddings = np.array([blob2embedding(b) for b in blobs])
+    embeddings = blobs2matrix(blobs)
     
+    return graph_nearest_matrix(embeddings, blobs, basis_path)
+
+def graph_nearest_store(store, incremental=False, refit=False):
+    """Crea grafo 3D direttamente dalla matrice di uno EmbeddingStore
+
+    La base PCA 3D è salvata nello store (projection.py) e rifatta solo con
+    `refit=True`. Con `incremental=True` la stessa base e le liste kNN salvate
+    (graph_incremental.py) si aggiornano con le sole righe nuove e al
+    risultato si aggiunge il "delta" rispetto alla chiamata precedente.
+    """
+    points, sources, targets, weights, delta = graph_arrays_store(store, incremental, refit)
+    graph = graph_dict(points, sources, targets, weights, matrix2blobs(store.matrix))
+    
+    for node in graph["nodes"]:
+        node["doc_id"] = store.ids[node["id"]]
+    if delta is not None:
+        graph["delta"] = delta
+    return graph
+
+def graph_arrays_store(store, incremental=False, refit=False):
+    """Come graph_arrays ma da store; il quinto valore è il delta (None se non incrementale)"""
+    if not incremental:
+        basis_path = projection.store_basis_path(store.path, 3)
+        return graph_arrays(store.matrix, basis_path, refit) + (None,)
+    
+    # Store in sola aggiunta: le righe già viste cambiano solo se lo store viene ricreato
+    state, delta = graph_incremental.update_graph(store.matrix, store.path,
+                                                  fingerprint=lambda rows: store.fingerprint(), refit=refit)
+    return (state.points,) + state.edge_arrays() + (delta,)
+
+def graph_nearest_matrix(embeddings, blobs=None, basis_path=None):
+    """Crea grafo 3D da matrice (N, D); i blob in output sono ricostruiti se non dati"""
+    if blobs is None:
+        blobs = matrix2blobs(embeddings)
+    
+    return graph_dict(*graph_arrays(embeddings, basis_path), blobs)
+
+def graph_arrays(embeddings, basis_path=None, refit=False):
+    """PCA 3D + grafo kNN come array numpy: (points, sources, targets, weights)
+
+    La PCA è fatta a blocchi (projection.py); con `basis_path` la base viene
+    salvata e le chiamate successive fanno solo la proiezione.
+    """
     # PCA per riduzione dimensionale a 3D
-    pca = PCA(n_components=3)
-    points = pca.fit_transform(embeddings)
+    points = projection.project(embeddings, 3, basis_path, refit)
     
     # Calcola k ottimale per il grafo
     n = len(points)
     k = max(2, min(10, int(n**0.5)))
     
-    # Crea grafo dei vicini
+    # Crea grafo dei vicini (archi letti direttamente dalla matrice sparsa)
     A = kneighbors_graph(points, n_neighbors=k, mode='distance', include_self=False)
-    G = nx.from_scipy_sparse_array(A)
+    sources, targets, weights = sparse_edges(A)
     
+    return points, sources, targets, weights
+
+def graph_dict(points, sources, targets, weights, blobs):
+    """Grafo come dict {"nodes", "blobs", "edges"} (formato storico di graph_nearest)"""
     return {
-        "nodes": [
-            {
-                "id": i, 
-                "x": float(points[i][0]), 
-                "y": float(points[i][1]), 
-                "z": float(points[i][2])
-            }
-            for i in range(n)
-        ],
+        "nodes": list(graph_io.iter_nodes(points)),
         "blobs": [
-            {"id": i, "blob": blob2base64(blobs[i])}
-            for i in range(n)
+            {"id": i, "blob": blob2base64(blob)}
+            for i, blob in enumerate(blobs)
         ],
-        "edges": [
-            {
-                "source": int(u), 
-                "target": int(v), 
-                "weight": float(d["weight"])
-            }
-            for u, v, d in G.edges(data=True)
-        ]
+        "edges": list(graph_io.iter_edges(sources, targets, weights)),
+    }
+
+def iter_blobs_b64(matrix, chunk_size=4096):
+    """Blob base64 delle righe di una matrice, generati a blocchi (per lo streaming)"""
+    for start in range(0, len(matrix), chunk_size):
+        for blob in matrix2blobs(matrix[start:start + chunk_size]):
+            yield blob2base64(blob)
+
+def write_graph(out, embeddings, ids=None, arrays=None, blobs=True, binary_path=None, extra=None):
+    """Scrive il grafo su `out` in streaming (JSON compatto) o in formato binario
+
+    Con `binary_path` il grafo va nel file binario LWG1 (vedi graph_io.py) e su
+    `out` viene scritto solo un piccolo manifest JSON.
+    """
+    points, sources, targets, weights = arrays if arrays is not None else graph_arrays(embeddings)
+    
+    if binary_path:
+        with open(binary_path, 'wb') as f:
+            graph_io.write_graph_binary(f, points, sources, targets, weights)
+        graph_io.write_graph_ids(binary_path, len(points), ids)
+        manifest = {"binary": binary_path, "nodes": len(points), "dims": int(points.shape[1]),
+                    "edges": len(sources)}
+        if ids is not None:
+            manifest["ids"] = ids
+        manifest.update(extra or {})
+        json.dump(manifest, out)
+        out.write("\n")
+        return
+    
+    node_extra = (lambda i: {"doc_id": ids[i]}) if ids is not None else None
+    graph_io.write_graph_json(out, points, sources, targets, weights,
+                              blobs=iter_blobs_b64(embeddings) if blobs else None,
+                              node_extra=node_extra, extra=extra)
+
+# ============================================================================
+# DISPATCH COMANDI
+# ============================================================================
+
+class CommandError(ValueError):
+    """Errore di input di un comando (riportato senza traceback)"""
+
+def _require_text(input_data):
+    text = input_data.get('text')
+    if not text:
+        raise CommandError("Missing text in input")
+    return text
+
+def cmd_get_blob(input_data):
+    """Comando get_blob: testo -> blob base64"""
+    return blob2base64(get_blob(_require_text(input_data)))
+
+def cmd_get_blobs(input_data):
+    """Comando get_blobs_stdin: {"texts": [...]} -> lista di blob base64"""
+    texts = input_data.get('texts')
+    if not texts:
+        raise CommandError("Missing texts in input")
+    return [blob2base64(b) for b in get_blobs(texts)]
+
+def cmd_get_doc_blob(input_data):
+    """Comando get_doc_blob_stdin: Markdown lungo -> chunk per sezione embeddati a batch + blob aggregato"""
+    chunks, vectors, doc = chunker.embed_document(
+        _require_text(input_data), lambda texts: blobs2matrix(get_blobs(texts)),
+        input_data.get('max_chars', chunker.MAX_CHARS))
+    return {
+        "blob": blob2base64(embedding2blob(doc)),
+        "chunks": [{"section": c["section"], "chars": len(c["text"]), "blob": blob2base64(b)}
+                   for c, b in zip(chunks, matrix2blobs(vectors))],
     }
 
+def _parse_k(input_data):
+    # Un k negativo finirebbe in uno slice (quasi tutte le righe in risposta)
+    k = input_data.get('k', 5)
+    if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+        raise CommandError(f"k must be a positive integer, got {k!r}")
+    return k
+
+def _store_path(store_path, level):
+    # Livello "doc": lo store dei vettori di documento accanto ai chunk (chunker.py)
+    if level != 'doc':
+        return store_path
+    docs_path = chunker.doc_store_path(store_path)
+    if not os.path.exists(os.path.join(docs_path, embedding_store.INDEX_FILE)):
+        raise CommandError(f"No document vectors in {store_path} "
+                           f"(run: python chunker.py aggregate {store_path})")
+    return docs_path
+
+def cmd_k_nearest(input_data):
+    """Comando k_nearest_from_stdin: query + lista blob (o "store": path) -> k più vicini
+
+    "level": "chunk" (default) cerca tra i chunk, "doc" tra i vettori di
+    documento (store/docs, o blob aggregati per "doc_ids").
+    """
+    blob_b64 = input_data.get('query_blob')
+    blobs_b64_list = input_data.get('blobs', [])
+    level = input_data.get('level', 'chunk')
+    k = _parse_k(input_data)
+
+    if not blob_b64:
+        raise CommandError("Missing query_blob")
+    if level not in ('chunk', 'doc'):
+        raise CommandError(f"Unknown level: {level} (expected chunk or doc)")
+
+    if input_data.get('store'):
+        store_path = _store_path(input_data['store'], level)
+        use_zones = input_data.get('zones', False)
+        if use_zones and not ZoneIndex.exists(store_path):
+            raise CommandError(f"No zones in {store_path} (run: python zones.py build {store_path})")
+        quantized = input_data.get('quantized')
+        if quantized and not QuantizedStore.exists(store_path, quantized):
+            raise CommandError(f"No {quantized} codes in {store_path} "
+                               f"(run: python quantize.py build {store_path} --format {quantized})")
+        try:
+            results = k_nearest_store(base642blob(blob_b64), embedding_store.open_store(store_path), k,
+                                      nprobe=input_data.get('nprobe'), exact=input_data.get('exact', False),
+                                      zones=use_zones, beam=input_data.get('beam'),
+                                      quantized=quantized, rerank=input_data.get('rerank'))
+        except embedding_store.StaleIndexError as e:
+            raise CommandError(str(e))
+        if level == 'chunk':
+            for result in results:
+                result["doc_id"] = chunker.doc_id_of(result["id"])
+        return results
+
+    if not blobs_b64_list:
+        raise CommandError("No blobs provided")
+
+    blob = base642blob(blob_b64)
+    blobs = [base642blob(b64) for b64 in blobs_b64_list]
+
+    if level == 'doc':
+        doc_ids = input_data.get('doc_ids')
+        if not doc_ids or len(doc_ids) != len(blobs):
+            raise CommandError("level doc with blobs needs doc_ids (one per blob)")
+        return k_nearest_docs(blob, blobs, doc_ids, k)
+
+    return k_nearest(blob, blobs, k)
+
+def cmd_k_nearest_batch(input_data):
+    """Comando k_nearest_batch: {"queries": [{"query_blob", "k"}, ...], "k": default} + blobs / store / corpus_id
+
+    Tutte le query in un solo passaggio esatto; ritorna una lista di risultati
+    per query, nello stesso ordine e nello stesso formato di k_nearest_from_stdin
+    (o dei "results" di k_nearest_corpus con "corpus_id", che accetta anche "version").
+    """
+    queries = input_data.get('queries')
+    if not queries:
+        raise CommandError("Missing queries")
+    default_k = input_data.get('k', 5)
+    try:
+        query_blobs = [base642blob(q['query_blob']) for q in queries]
+        ks = [int(q.get('k', default_k)) for q in queries]
+    except (KeyError, TypeError, AttributeError):
+        raise CommandError("Every query needs a query_blob")
+    if min(ks) < 1:
+        raise CommandError("k must be at least 1")
+    try:
+        query_matrix = blobs2matrix(query_blobs)
+    except ValueError as e:
+        raise CommandError(f"Queries must share one dimension: {e}")
+    level = input_data.get('level', 'chunk')
+    if level not in ('chunk', 'doc'):
+        raise CommandError(f"Unknown level: {level} (expected chunk or doc)")
+
+    def check_dim(matrix):
+        if len(matrix) and matrix.shape[1] != query_matrix.shape[1]:
+            raise CommandError(f"Query dimension {query_matrix.shape[1]} does not match corpus dimension {matrix.shape[1]}")
+
+    if input_data.get('corpus_id') is not None:
+        try:
+            loaded = corpus.acquire_corpus(input_data['corpus_id'])
+        except KeyError:
+            raise CommandError(f"Unknown corpus: {input_data['corpus_id']}")
+        except embedding_store.StaleIndexError as e:
+            raise CommandError(str(e))
+        try:
+            version = input_data.get('version')
+            if version and version != loaded.version:
+                raise CommandError(f"Corpus version mismatch: requested {version}, loaded {loaded.version}")
+            check_dim(loaded.matrix)
+            idx, dist = loaded.search_exact(query_matrix, max(ks))
+        finally:
+            loaded.release()
+        return [[{"id": loaded.ids[i], "distance": float(d)} for i, d in zip(row_i[:k], row_d[:k])]
+                for row_i, row_d, k in zip(idx.tolist(), dist.tolist(), ks)]
+
+    if input_data.get('store'):
+        store = embedding_store.open_store(_store_path(input_data['store'], level))
+        check_dim(store.matrix)
+        results = k_nearest_batch(query_matrix, store.matrix, ks)
+        # Ogni riga trovata viene codificata una volta sola anche se compare in più risposte
+        rows = np.unique(np.concatenate([i for i, _ in results]))
+        encoded = dict(zip(rows.tolist(), (blob2base64(b) for b in matrix2blobs(store.matrix[rows]))))
+        batch = []
+        for idx, dist in results:
+            hits = [{"id": store.ids[i], "blobs": encoded[i], "distance": float(d)}
+                    for i, d in zip(idx.tolist(), dist.tolist())]
+            if level == 'chunk':
+                for hit in hits:
+                    hit["doc_id"] = chunker.doc_id_of(hit["id"])
+            batch.append(hits)
+        return batch
+
+    blobs_b64_list = input_data.get('blobs')
+    if not blobs_b64_list:
+        raise CommandError("No blobs provided")
+    if level == 'doc':
+        raise CommandError("level doc needs a store")
+    try:
+        matrix = b64list2matrix(blobs_b64_list)
+    except ValueError as e:
+        raise CommandError(f"Blobs must share one dimension: {e}")
+    check_dim(matrix)
+    # I blob trovati si rimandano com'erano in input (nessuna ricodifica)
+    return [[{"blobs": blobs_b64_list[i], "distance": float(d)}
+             for i, d in zip(idx.tolist(), dist.tolist())]
+            for idx, dist in k_nearest_batch(query_matrix, matrix, ks)]
+
+def cmd_graph_nearest(input_data):
+    """Comando graph_nearest: lista blob (o {"blobs": [...]} / {"store": path}) -> grafo 3D"""
+    if isinstance(input_data, dict):
+        if input_data.get('store'):
+            return graph_nearest_store(embedding_store.open_store(input_data['store']),
+                                       incremental=input_data.get('incremental', False),
+                                       refit=input_data.get('refit', False))
+        basis_path = input_data.get('basis')
+        input_data = input_data.get('blobs', [])
+    else:
+        basis_path = None
+    if not input_data:
+        raise CommandError("No blobs provided")
+    return graph_nearest(input_data, basis_path)
+
+def cmd_graph_tile(input_data):
+    """Comando graph_tile: {"tiles": path, "z": 3, "tile": [x, y]} -> nodi o cluster della tile (tiles.py)"""
+    if not input_data.get('tiles') or 'z' not in input_data or 'tile' not in input_data:
+        raise CommandError("Missing tiles, z or tile")
+    try:
+        return tiles.get_index(input_data['tiles']).tile(
+            input_data['z'], input_data['tile'],
+            input_data.get('max_nodes', tiles.MAX_NODES), input_data.get('detail', tiles.DETAIL))
+    except (OSError, ValueError) as e:
+        raise CommandError(str(e))
+
+def cmd_load_corpus(input_data):
+    """Comando load_corpus: {"store": path} o {"blobs": [...], "ids": [...]} -> id e versione"""
+    try:
+        return corpus.load_corpus(input_data).info()
+    except ValueError as e:
+        raise CommandError(str(e))
+
+def cmd_k_nearest_corpus(input_data):
+    """Comando k_nearest_corpus: query_blob (o text) + k su un corpus già caricato"""
+    corpus_id = input_data.get('corpus_id')
+    if corpus_id is None:
+        raise CommandError("Missing corpus_id")
+    k = _parse_k(input_data)
+
+    if input_data.get('query_blob'):
+        query_emb = blob2embedding(base642blob(input_data['query_blob']))
+    elif input_data.get('text'):
+        query_emb = blob2embedding(get_blob(input_data['text']))
+    else:
+        raise CommandError("Missing query_blob or text")
+
+    try:
+        loaded = corpus.acquire_corpus(corpus_id)
+    except KeyError:
+        raise CommandError(f"Unknown corpus: {corpus_id}")
+    except embedding_store.StaleIndexError as e:
+        # Ricaricamento automatico di un corpus da store con un indice IVF non suo
+        raise CommandError(str(e))
+    # Il riferimento tiene aperto il motore anche se un reload sostituisce il corpus
+    try:
+        version = input_data.get('version')
+        if version and version != loaded.version:
+            raise CommandError(f"Corpus version mismatch: requested {version}, loaded {loaded.version}")
+        return {
+            "corpus_id": loaded.corpus_id,
+            "version": loaded.version,
+            "results": loaded.search(query_emb, k,
+                                     nprobe=input_data.get('nprobe'), exact=input_data.get('exact', False)),
+        }
+    finally:
+        loaded.release()
+
+def cmd_list_corpora(input_data):
+    """Comando list_corpora: corpus caricati nel processo"""
+    return corpus.list_corpora()
+
+COMMANDS = {
+    "get_blob": cmd_get_blob,
+    "get_blob_stdin": cmd_get_blob,
+    "get_blobs_stdin": cmd_get_blobs,
+    "get_doc_blob_stdin": cmd_get_doc_blob,
+    "k_nearest_from_stdin": cmd_k_nearest,
+    "k_nearest_batch": cmd_k_nearest_batch,
+    "graph_nearest": cmd_graph_nearest,
+    "graph_tile": cmd_graph_tile,
+    "load_corpus": cmd_load_corpus,
+    "k_nearest_corpus": cmd_k_nearest_corpus,
+    "list_corpora": cmd_list_corpora,
+}
+
+def run_command(command, input_data):
+    """Esegue un comando registrato in COMMANDS (usato da CLI e server)"""
+    handler = COMMANDS.get(command)
+    if handler is None:
+        raise CommandError(f"Unknown command: {command}")
+    return handler(input_data)
+
+def _read_stdin_json():
+    input_str = sys.stdin.read()
+    if not input_str:
+        raise CommandError("Empty stdin")
+    return json.loads(input_str)
+
 # ============================================================================
 # MAIN ENTRY POINT
 # ============================================================================
@@ -130,8 +638,7 @@ def graph_nearest(blobs_json_list):
 def main():
     try:
         if len(sys.argv) < 2:
-            print(json.dumps({"error": "No command provided"}), file=sys.stderr)
-            sys.exit(1)
+            raise CommandError("No command provided")
         
         command = sys.argv[1]
         
@@ -140,84 +647,62 @@ def main():
         # ====================================================================
         if command == "get_blob":
             if len(sys.argv) < 3:
-                print(json.dumps({"error": "Missing text argument"}), file=sys.stderr)
-                sys.exit(1)
+                raise CommandError("Missing text argument")
             
-            text = sys.argv[2]
-            result = get_blob(text)
-            print(blob2base64(result))
+            print(run_command(command, {"text": sys.argv[2]}))
         
         # ====================================================================
-        # COMANDO: get_blob_stdin (da stdin - PIÙ SICURO)
+        # COMANDO: graph_nearest (da file, directory store o stdin con '-')
+        #   opzioni: --incremental (solo store), --no-blobs, --binary PATH,
+        #            --basis PATH (base PCA salvata, per i file), --refit
         # ====================================================================
-        elif command == "get_blob_stdin":
-            input_str = sys.stdin.read()
-            if not input_str:
-                print(json.dumps({"error": "Empty stdin"}), file=sys.stderr)
-                sys.exit(1)
-            
-            input_data = json.loads(input_str)
-            text = input_data.get('text')
-            
-            if not text:
-                print(json.dumps({"error": "Missing text in input"}), file=sys.stderr)
-                sys.exit(1)
-            
-            result = get_blob(text)
-            print(blob2base64(result))
-        
-        # ====================================================================
-        # COMANDO: k_nearest_from_stdin
-        # ====================================================================
-        elif command == "k_nearest_from_stdin":
-            input_str = sys.stdin.read()
-            if not input_str:
-                print(json.dumps({"error": "Empty stdin"}), file=sys.stderr)
-                sys.exit(1)
-            
-            input_data = json.loads(input_str)
-            blob_b64 = input_data.get('query_blob')
-            blobs_b64_list = input_data.get('blobs', [])
-            k = input_data.get('k', 5)
-            
-            if not blob_b64:
-                print(json.dumps({"error": "Missing query_blob"}), file=sys.stderr)
-                sys.exit(1)
+        elif command == "graph_nearest":
+            if len(sys.argv) < 3:
+                raise CommandError("Missing input argument")
             
-            if not blobs_b64_list:
-                print(json.dumps({"error": "No blobs provided"}), file=sys.stderr)
-                sys.exit(1)
+            options = sys.argv[3:]
+            binary_path = options[options.index("--binary") + 1] if "--binary" in options[:-1] else None
+            basis_path = options[options.index("--basis") + 1] if "--basis" in options[:-1] else None
+            refit = "--refit" in options
             
-            blob = base642blob(blob_b64)
-            blobs = [base642blob(b64) for b64 in blobs_b64_list]
+            if os.path.isdir(sys.argv[2]):
+                store = embedding_store.open_store(sys.argv[2])
+                *arrays, delta = graph_arrays_store(store, "--incremental" in options, refit)
+                embeddings, ids = store.matrix, store.ids
+                extra = {"delta": delta} if delta is not None else None
+            else:
+                if sys.argv[2] == '-':
+                    blobs_json = json.loads(sys.stdin.read())
+                else:
+                    with open(sys.argv[2], 'r') as f:
+                        blobs_json = json.load(f)
+                if isinstance(blobs_json, dict):
+                    blobs_json = blobs_json.get('blobs', [])
+                if not blobs_json:
+                    raise CommandError("No blobs provided")
+                embeddings, ids, extra = b64list2matrix(blobs_json), None, None
+                arrays = graph_arrays(embeddings, basis_path, refit)
             
-            result = k_nearest(blob, blobs, k)
-            print(json.dumps(result))
+            # Scrittura in streaming su stdout (niente indent=2, niente dict intermedi)
+            write_graph(sys.stdout, embeddings, ids, arrays, blobs="--no-blobs" not in options,
+                        binary_path=binary_path, extra=extra)
         
         # ====================================================================
-        # COMANDO: graph_nearest
+        # COMANDI DA STDIN (get_blob_stdin, k_nearest_from_stdin, ...)
         # ====================================================================
-        elif command == "graph_nearest":
-            if len(sys.argv) < 3:
-                print(json.dumps({"error": "Missing input argument"}), file=sys.stderr)
-                sys.exit(1)
-            
-            if sys.argv[2] == '-':
-                blobs_json_str = sys.stdin.read()
-            else:
-                with open(sys.argv[2], 'r') as f:
-                    blobs_json_str = f.read()
-            
-            blobs_json = json.loads(blobs_json_str)
-            result = graph_nearest(blobs_json)
-            print(json.dumps(result, indent=2))
+        elif command in COMMANDS:
+            result = run_command(command, _read_stdin_json())
+            print(result if isinstance(result, str) else json.dumps(result))
         
         # ====================================================================
         # COMANDO SCONOSCIUTO
         # ====================================================================
         else:
-            print(json.dumps({"error": f"Unknown command: {command}"}), file=sys.stderr)
-            sys.exit(1)
+            raise CommandError(f"Unknown command: {command}")
+    
+    except CommandError as e:
+        print(json.dumps({"error": str(e)}), file=sys.stderr)
+        sys.exit(1)
     
     except Exception as e:
         print(json.dumps({
@@ -227,4 +712,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
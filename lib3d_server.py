@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# ============================================================================
+# lib3d_server.py - Server HTTP persistente per i comandi di lib3d
+# ============================================================================
+#
+# Tiene caricati numpy/scipy/sklearn/ollama in un unico processo e serve gli
+# stessi comandi di `lib3d.py` senza pagare l'avvio dell'interprete a ogni
+# chiamata.
+#
+#   python lib3d_server.py --port 8765
+#
+#   POST /<comando>   body JSON come lo stdin della CLI -> risultato JSON
+#   GET  /stats       latenza per comando (count, errori, media, p50, p95, max)
+#   GET  /cache       contatori della cache embedding (hit/miss, voci, byte)
+#   GET  /health      {"status": "ok"}
+#   GET  /tiles/meta            con --tiles: estensione, livelli, conteggi (tiles.py)
+#   GET  /tiles/<z>/<x>/<y>     nodi o cluster della tile (?max_nodes=&detail=)
+#
+# Le richieste sono servite in parallelo (un thread per connessione).
+
+import sys
+import json
+import time
+import argparse
+from urllib.parse import parse_qs
+import threading
+import traceback
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import lib3d
+import embedder
+import tiles
+
+# ============================================================================
+# STATISTICHE LATENZA
+# ============================================================================
+
+class LatencyStats:
+    """Latenze per comando, thread-safe (ultimi `window` campioni per i percentili)"""
+
+    def __init__(self, window=1024):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._totals = {}
+
+    def record(self, command, elapsed_ms, ok=True):
+        with self._lock:
+            samples = self._samples.setdefault(command, deque(maxlen=self.window))
+            samples.append(elapsed_ms)
+            totals = self._totals.setdefault(command, {"count": 0, "errors": 0, "total_ms": 0.0})
+            totals["count"] += 1
+            totals["total_ms"] += elapsed_ms
+            if not ok:
+                totals["errors"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for command, totals in self._totals.items():
+                ordered = sorted(self._samples[command])
+                result[command] = {
+                    "count": totals["count"],
+                    "errors": totals["errors"],
+                    "mean_ms": totals["total_ms"] / totals["count"],
+                    "p50_ms": _percentile(ordered, 50),
+                    "p95_ms": _percentile(ordered, 95),
+                    "max_ms": ordered[-1],
+                }
+            return result
+
+def _percentile(ordered, q):
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+# ============================================================================
+# HANDLER HTTP
+# ============================================================================
+
+class Lib3dRequestHandler(BaseHTTPRequestHandler):
+    server_version = "lib3d/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        path = path.strip('/')
+        if path.startswith("tiles/") or path == "tiles":
+            self._send_tile(path.split('/')[1:], parse_qs(query))
+        elif path == "stats":
+            self._send_json(200, self.server.stats.snapshot())
+        elif path == "cache":
+            cache = embedder.default_pool().cache
+            self._send_json(200, cache.stats() if cache else {"enabled": False})
+        elif path == "health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown path: /{path}"})
+
+    def do_POST(self):
+        command = self.path.split('?', 1)[0].strip('/')
+        started = time.perf_counter()
+        status, payload = 200, None
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if not body:
+                raise lib3d.CommandError("Empty body")
+            payload = lib3d.run_command(command, json.loads(body))
+        except (lib3d.CommandError, json.JSONDecodeError) as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": str(e), "traceback": traceback.format_exc()}
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if command in lib3d.COMMANDS:
+            self.server.stats.record(command, elapsed_ms, ok=status == 200)
+        self._send_json(status, payload, elapsed_ms)
+
+    def _send_tile(self, parts, query):
+        started = time.perf_counter()
+        if not self.server.tiles_path:
+            self._send_json(404, {"error": "No tile index (start the server with --tiles)"})
+            return
+        try:
+            index = tiles.get_index(self.server.tiles_path)
+            if parts == ["meta"]:
+                payload = index.meta()
+            else:
+                z, *coords = (int(p) for p in parts)
+                options = {name: int(query[name][0]) for name in ("max_nodes", "detail") if name in query}
+                payload = index.tile(z, coords, **options)
+            status = 200
+        except FileNotFoundError as e:
+            status, payload = 404, {"error": f"Tile index not found: {e.filename}"}
+        except ValueError as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            # File illeggibile o troncato (OSError, BadZipFile): risposta JSON comunque
+            status, payload = 500, {"error": str(e), "traceback": traceback.format_exc()}
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.server.stats.record("tiles", elapsed_ms, ok=status == 200)
+        # Il frontend può essere servito da un'altra origine (file statico)
+        self._send_json(status, payload, elapsed_ms, {"Access-Control-Allow-Origin": "*"})
+
+    def _send_json(self, status, payload, elapsed_ms=None, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if elapsed_ms is not None:
+            self.send_header("X-Latency-Ms", f"{elapsed_ms:.3f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+class Lib3dServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, quiet=False, tiles_path=None):
+        super().__init__(address, Lib3dRequestHandler)
+        self.stats = LatencyStats()
+        self.quiet = quiet
+        self.tiles_path = tiles_path
+
+# ============================================================================
+# MAIN ENTRY POINT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve lib3d commands from one warm process.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind.')
+    parser.add_argument('--port', type=int, default=8765, help='Port to bind.')
+    parser.add_argument('--quiet', action='store_true', help='Disable per-request logging.')
+    parser.add_argument('--tiles', help='Tile index (tiles.npz or a store directory) served under /tiles/.')
+    args = parser.parse_args()
+
+    server = Lib3dServer((args.host, args.port), quiet=args.quiet, tiles_path=args.tiles)
+    print(f"lib3d server listening on http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# ============================================================================
+# pipeline.py - Ingestione end-to-end: scrape -> parse -> chunk -> embed -> index
+# ============================================================================
+#
+# Un solo job che collega scraper/scraper.py, scraper/generate_json.py,
+# embedder.py ed embedding_store.py. Ogni stadio ha i suoi worker e legge da
+# una coda limitata (queue.Queue(maxsize)): se uno stadio è lento, quelli a
+# monte si fermano invece di accumulare documenti in memoria.
+#
+#   source   URL dal CSV (o file Markdown già scaricati con --from-markdown)
+#   fetch    thread, sessione requests condivisa + pausa per host
+#   parse    processi: HTML -> Markdown -> voce di generate_json
+#   chunk    sezioni Markdown spezzate fino a --chunk-chars (chunker.py)
+#   embed    batch di chunk verso Ollama (embedder.EmbeddingPool)
+#   index    un writer: append a blocchi nello store, poi le righe
+#            corrispondenti di chunks.jsonl e documents.jsonl
+#
+# chunks.jsonl e documents.jsonl si scrivono solo per le righe entrate nello
+# store: un batch che fallisce nell'embedding non lascia chunk senza vettore.
+# Senza --append lo store (e i due file) si ricreano al primo batch indicizzato,
+# cancellando gli indici derivati (EmbeddingStore.create) e store/docs; se
+# nessun batch arriva allo store, quello vecchio resta intatto.
+#
+# Alla fine: store/ (matrix.f32, index.json, documents.jsonl, chunks.jsonl),
+# store/docs con i vettori per documento, indice IVF se le righe sono
+# abbastanza (e zone / codici quantizzati già presenti aggiornati),
+# graph.json, graph.bin + graph.ids.json (lib3d, senza blob), store/tiles.npz.
+#
+#   python pipeline.py --csv scraper/csv/SB_publication_PMC.csv -n 600 --store store/
+#   python pipeline.py --offline -n 200 --store /tmp/store      # fixture + stub Ollama, niente rete
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import chunker
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_DONE = object()
+
+def _import_scraper():
+    # scraper/ è una directory di script (import per nome tra i suoi moduli)
+    scraper_dir = os.path.join(ROOT, "scraper")
+    if scraper_dir not in sys.path:
+        sys.path.insert(0, scraper_dir)
+    import scraper
+    import generate_json
+    return scraper, generate_json
+
+# ============================================================================
+# STADI E CODE
+# ============================================================================
+
+def _feed(items, source):
+    for item in items:
+        source.put(item)
+    source.put(_DONE)
+
+class StageStats:
+    """Contatori di uno stadio (aggiornati dai suoi worker)"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items_in = self.items_out = self.errors = 0
+        self.busy = 0.0
+        self.started = self.finished = None
+        self.lock = threading.Lock()
+
+    def record(self, n_in, n_out, busy, error=False):
+        with self.lock:
+            if self.started is None:
+                self.started = time.perf_counter() - busy
+            self.items_in += n_in
+            self.items_out += n_out
+            self.busy += busy
+            self.errors += bool(error)
+
+    def info(self):
+        wall = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "in": self.items_in,
+            "out": self.items_out,
+            "errors": self.errors,
+            "seconds": round(wall, 3),
+            "out_per_s": round(self.items_out / wall, 2) if wall > 0 else None,
+            "utilization": round(self.busy / (wall * self.workers), 2) if wall > 0 else None,
+        }
+
+class Stage:
+    """`workers` thread che applicano `fn` agli elementi di `inbox`
+
+    `fn` riceve un elemento (o una lista di al massimo `batch_size` elementi
+    se batch_size > 1) e ritorna un iterabile di risultati per `outbox`:
+    può filtrare (nessun risultato) o moltiplicare (chunking).
+    """
+
+    def __init__(self, name, fn, workers, inbox, outbox, batch_size=1, linger=0.05):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.linger = linger
+        self.stats = StageStats(name, workers)
+        self._threads = [threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+                         for i in range(workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        threading.Thread(target=self._close, name=f"{self.name}-close", daemon=True).start()
+        return self
+
+    def _next(self):
+        """Prossimo elemento o batch; None quando lo stadio a monte ha finito"""
+        item = self.inbox.get()
+        if item is _DONE:
+            self.inbox.put(_DONE)  # lo vedono anche gli altri worker
+            return None
+        if self.batch_size == 1:
+            return item
+
+        batch, deadline = [item], time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            try:
+                item = self.inbox.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _DONE:
+                self.inbox.put(_DONE)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            started = time.perf_counter()
+            n_out, error = 0, False
+            try:
+                for result in self.fn(item):
+                    self.outbox.put(result)
+                    n_out += 1
+            except Exception as e:
+                error = True
+                print(f"[{self.name}] {type(e).__name__}: {e}", file=sys.stderr)
+            n_in = len(item) if self.batch_size > 1 else 1
+            self.stats.record(n_in, n_out, time.perf_counter() - started, error)
+
+    def _close(self):
+        for thread in self._threads:
+            thread.join()
+        self.stats.finished = time.perf_counter()
+        self.outbox.put(_DONE)
+
+# ============================================================================
+# FUNZIONI DEGLI STADI
+# ============================================================================
+
+def _document(generate_json, doc_id, markdown):
+    entry = generate_json.parse_markdown(markdown)
+    if not entry:
+        return None
+    return {"doc_id": doc_id, "title": entry["title"], "url": entry["page"]["url"],
+            "text": entry["pagecontent"]}
+
+def _parse_html(task):
+    """Worker di processo: (url, html, parser) -> (documento o None, Markdown o errore)"""
+    url, content, parser = task
+    scraper, generate_json = _import_scraper()
+    article = scraper.parse_page(content, url, parser)
+    if not isinstance(article, tuple):
+        return None, article
+    filename, markdown, _, _ = article
+    return _document(generate_json, os.path.splitext(filename)[0], markdown), markdown
+
+def _parse_markdown_file(path):
+    _, generate_json = _import_scraper()
+    with open(path, 'r', encoding='utf-8') as f:
+        return _document(generate_json, os.path.splitext(os.path.basename(path))[0], f.read())
+
+# ============================================================================
+# JOB
+# ============================================================================
+
+class Pipeline:
+    """Collega gli stadi; run() ritorna le statistiche per stadio"""
+
+    def __init__(self, store_path, pool, fetch_workers=8, parse_workers=None, chunk_workers=2,
+                 embed_workers=4, embed_batch=32, index_batch=1024, queue_size=256, delay=0.5,
+                 retries=3, parser='html.parser', chunk_chars=1500, markdown_dir=None, append=False):
+        self.store_path = store_path
+        self.pool = pool
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.chunk_workers = chunk_workers
+        self.embed_workers = embed_workers
+        self.embed_batch = embed_batch
+        self.index_batch = index_batch
+        self.queue_size = queue_size
+        self.delay = delay
+        self.retries = retries
+        self.parser = parser
+        self.chunk_chars = chunk_chars
+        self.markdown_dir = markdown_dir
+        self.append = append
+        self.store = None
+        self._documents = None
+        self._chunks = None
+        self._known_ids = set()
+
+    # ------------------------------------------------------------------------
+    # Funzioni per stadio
+    # ------------------------------------------------------------------------
+
+    def _fetch(self, url):
+        response, _ = self._scraper.fetch_page(url, self._session, self._throttle, self.retries)
+        if response is not None:
+            yield url, response.content
+
+    def _parse(self, page):
+        url, content = page
+        document, markdown = self._parse_pool.submit(_parse_html, (url, content, self.parser)).result()
+        if document is None:
+            if markdown:
+                print(f"[parse] {url}: {markdown}", file=sys.stderr)
+            return
+        if self.markdown_dir:
+            self._scraper.save_article(self.markdown_dir, document["doc_id"] + ".md", markdown)
+        yield document
+
+    def _parse_file(self, path):
+        document = self._parse_pool.submit(_parse_markdown_file, path).result()
+        if document is not None:
+            yield document
+
+    def _chunk(self, document):
+        """(id, testo da embeddare, riga di chunks.jsonl, riga di documents.jsonl o None) per chunk nuovo"""
+        doc_id = document["doc_id"]
+        chunks = chunker.chunk_markdown(document["text"], self.chunk_chars)
+        new = [(f"{doc_id}#{i}", chunk) for i, chunk in enumerate(chunks)
+               if f"{doc_id}#{i}" not in self._known_ids]
+        # La riga del documento viaggia col suo primo chunk nuovo
+        doc_record = {"doc_id": doc_id, "title": document["title"], "url": document["url"], "chunks": len(chunks)}
+        for n, (chunk_id, chunk) in enumerate(new):
+            record = {"id": chunk_id, "doc_id": doc_id, "section": chunk["section"],
+                      "chars": len(chunk["text"]), "text": chunk["text"]}
+            yield chunk_id, f"{document['title']}\n\n{chunk['text']}", record, doc_record if n == 0 else None
+
+    def _embed(self, batch):
+        vectors = np.asarray(self.pool.embed([text for _, text, _, _ in batch]), dtype=np.float32)
+        return zip(batch, vectors)
+
+    def _index(self, rows):
+        ids = [item[0] for item, _ in rows]
+        matrix = np.vstack([vector for _, vector in rows])
+        if self.store is None:
+            self._create_store(matrix.shape[1])
+        self.store.append(ids, matrix)
+        # Righe dei file solo dopo l'append: chunks.jsonl segue sempre lo store
+        for _, _, record, doc_record in (item for item, _ in rows):
+            if doc_record is not None:
+                self._documents.write(json.dumps(doc_record, ensure_ascii=False) + "\n")
+            self._chunks.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._documents.flush()
+        self._chunks.flush()
+        return ids
+
+    def _create_store(self, dim):
+        """Store nuovo (indici derivati cancellati da create), store/docs rimosso, file riscritti"""
+        import embedding_store
+
+        self.store = embedding_store.EmbeddingStore.create(self.store_path, dim)
+        shutil.rmtree(chunker.doc_store_path(self.store_path), ignore_errors=True)
+        self._open_records('w')
+
+    def _open_records(self, mode):
+        self._documents = open(os.path.join(self.store_path, "documents.jsonl"), mode, encoding='utf-8')
+        self._chunks = open(os.path.join(self.store_path, chunker.CHUNKS_FILE), mode, encoding='utf-8')
+
+    def _close_records(self):
+        for f in (self._documents, self._chunks):
+            if f is not None:
+                f.close()
+        self._documents = self._chunks = None
+
+    # ------------------------------------------------------------------------
+    # Esecuzione
+    # ------------------------------------------------------------------------
+
+    def run(self, urls=None, markdown_files=None):
+        import embedding_store
+
+        self._scraper, _ = _import_scraper()
+        os.makedirs(self.store_path, exist_ok=True)
+        if self.markdown_dir:
+            os.makedirs(self.markdown_dir, exist_ok=True)
+        if self.append and os.path.exists(os.path.join(self.store_path, embedding_store.INDEX_FILE)):
+            self.store = embedding_store.open_store(self.store_path)
+            self._known_ids = set(self.store.ids)
+            self._open_records('a')
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(6)]
+        stages = []
+        if markdown_files is None:
+            self._session = self._scraper.make_session(pool_size=self.fetch_workers)
+            self._throttle = self._scraper.HostThrottle(self.delay)
+            stages.append(Stage("fetch", self._fetch, self.fetch_workers, queues[0], queues[1]))
+            stages.append(Stage("parse", self._parse, self.parse_workers, queues[1], queues[2]))
+            items = urls
+        else:
+            self._session = None
+            stages.append(Stage("parse", self._parse_file, self.parse_workers, queues[1], queues[2]))
+            items = markdown_files
+        stages.append(Stage("chunk", self._chunk, self.chunk_workers, queues[2], queues[3]))
+        stages.append(Stage("embed", self._embed, self.embed_workers, queues[3], queues[4],
+                            batch_size=self.embed_batch))
+        stages.append(Stage("index", self._index, 1, queues[4], queues[5], batch_size=self.index_batch))
+        source = queues[0] if markdown_files is None else queues[1]
+
+        started = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as parse_pool:
+                self._parse_pool = parse_pool
+                for stage in stages:
+                    stage.start()
+                # Sorgente in un thread: il main thread deve già svuotare l'ultima
+                # coda, altrimenti con tutte le code piene nessuno stadio avanza
+                threading.Thread(target=_feed, args=(items, source), name="source", daemon=True).start()
+
+                # Lo stadio index produce gli id delle righe scritte
+                while queues[5].get() is not _DONE:
+                    pass
+        finally:
+            self._close_records()
+
+        if self._session is not None:
+            self._session.close()
+        return {"seconds": round(time.perf_counter() - started, 3),
+                "rows": len(self.store) if self.store is not None else 0,
+                "stages": [stage.stats.info() for stage in stages]}
+
+# ============================================================================
+# OUTPUT PER lib3d
+# ============================================================================
+
+def write_outputs(store_path, graph_json=None, graph_bin=None, ivf_min_rows=1000):
+    """Vettori per documento, indici ANN e file del grafo 3D dallo store
+
+    L'indice IVF si rifà se ci sono abbastanza righe (altrimenti uno già
+    presente viene solo aggiornato); zone e codici quantizzati già presenti
+    si aggiornano con le righe aggiunte (uno store ricreato non ne ha più).
+    """
+    import ann_index
+    import embedding_store
+    import graph_io
+    import lib3d
+    import quantize
+    import tiles
+    import zones
+
+    store = embedding_store.open_store(store_path)
+    outputs = {}
+    if len(store):
+        outputs["docs"] = len(chunker.aggregate_store(store_path))
+    if len(store) >= ivf_min_rows:
+        ann_index.IVFIndex.build(store.matrix).save(store_path)
+        outputs["ivf"] = store_path
+    elif ann_index.IVFIndex.exists(store_path):
+        ann_index.IVFIndex.load(store_path).sync(store).save(store_path)
+        outputs["ivf"] = store_path
+    if zones.ZoneIndex.exists(store_path):
+        zones.ZoneIndex.load(store_path).sync(store).save(store_path)
+        outputs["zones"] = store_path
+    for fmt in quantize.FORMATS:
+        if quantize.QuantizedStore.exists(store_path, fmt):
+            quantize.QuantizedStore.load(store_path, fmt).sync(store).save(store_path)
+            outputs[f"quant_{fmt}"] = store_path
+    if len(store) < 3 or not (graph_json or graph_bin):
+        return outputs
+
+    # Base PCA rifatta: lo store è appena cambiato
+    points, sources, targets, weights, _ = lib3d.graph_arrays_store(store, refit=True)
+    if graph_json:
+        with open(graph_json, 'w', encoding='utf-8') as f:
+            lib3d.write_graph(f, store.matrix, store.ids, (points, sources, targets, weights), blobs=False)
+        outputs["graph_json"] = graph_json
+    if graph_bin:
+        with open(graph_bin, 'wb') as f:
+            graph_io.write_graph_binary(f, points, sources, targets, weights)
+        graph_io.write_graph_ids(graph_bin, len(points), store.ids)
+        outputs["graph_bin"] = graph_bin
+
+    # Tile per la vista a livelli di dettaglio (lib3d_server.py --tiles store/)
+    tiles_path = os.path.join(store_path, tiles.TILES_FILE)
+    tiles.TileIndex.build(points[:, :2], sources, targets, weights, ids=store.ids).save(tiles_path)
+    outputs["tiles"] = tiles_path
+    return outputs
+
+def start_offline_backends(n_articles, dim):
+    """Fixture server degli articoli + stub di Ollama su porte libere (thread daemon)"""
+    _import_scraper()
+    sys.path.insert(0, os.path.join(ROOT, "tools"))
+    from fixture_server import FixtureServer
+    from stub_ollama import StubOllamaServer
+
+    fixtures = FixtureServer(("127.0.0.1", 0))
+    ollama_stub = StubOllamaServer(("127.0.0.1", 0), dim=dim)
+    for server in (fixtures, ollama_stub):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [fixtures.url(n) for n in range(n_articles)]
+    return urls, f"http://127.0.0.1:{ollama_stub.server_address[1]}"
+
+def main():
+    import embedder
+
+    parser = argparse.ArgumentParser(description='Scrape, parse, chunk, embed and index in one streaming job.')
+    parser.add_argument('--csv', default=os.path.join(ROOT, 'scraper', 'csv', 'SB_publication_PMC.csv'))
+    parser.add_argument('-n', type=int, default=None, help='Number of CSV rows (default: all).')
+    parser.add_argument('--from-markdown', metavar='DIR', help='Start from scraped Markdown files instead of the CSV.')
+    parser.add_argument('--store', default='store', help='Embedding store directory (output).')
+    parser.add_argument('--append', action='store_true', help='Append to an existing store, skipping known chunk ids.')
+    parser.add_argument('--markdown-dir', help='Also save the scraped Markdown here.')
+    parser.add_argument('--graph', default='graph.json', help='graph.json output ("" to skip).')
+    parser.add_argument('--binary', default='graph.bin', help='graph.bin output ("" to skip).')
+    parser.add_argument('--fetch-workers', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=None, help='Parser processes (default: one per CPU).')
+    parser.add_argument('--chunk-workers', type=int, default=2)
+    parser.add_argument('--embed-workers', type=int, default=4, help='Embedding batches in flight.')
+    parser.add_argument('--embed-batch', type=int, default=32)
+    parser.add_argument('--queue-size', type=int, default=256, help='Capacity of each inter-stage queue.')
+    parser.add_argument('--chunk-chars', type=int, default=1500)
+    parser.add_argument('--delay', type=float, default=0.5, help='Seconds between requests to the same host.')
+    parser.add_argument('--parser', choices=('html.parser', 'lxml'), default='html.parser')
+    parser.add_argument('--offline', action='store_true',
+                        help='Serve fixture articles and stub embeddings locally (no network, no Ollama).')
+    parser.add_argument('--stub-dim', type=int, default=1024, help='Embedding size of the offline stub.')
+    args = parser.parse_args()
+
+    urls = markdown_files = None
+    if args.offline:
+        urls, ollama_host = start_offline_backends(args.n or 100, args.stub_dim)
+        pool = embedder.EmbeddingPool(host=ollama_host, batch_size=args.embed_batch,
+                                      concurrency=args.embed_workers, cache=None)
+        args.delay = 0
+    else:
+        pool = embedder.default_pool()
+        if args.from_markdown:
+            _, generate_json = _import_scraper()
+            markdown_files = generate_json.list_markdown_files(args.from_markdown)[:args.n]
+        else:
+            scraper, _ = _import_scraper()
+            urls = scraper.read_urls(args.csv, args.n)
+
+    pipeline = Pipeline(args.store, pool, fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+                        chunk_workers=args.chunk_workers, embed_workers=args.embed_workers,
+                        embed_batch=args.embed_batch, queue_size=args.queue_size, delay=args.delay,
+                        parser=args.parser, chunk_chars=args.chunk_chars, markdown_dir=args.markdown_dir,
+                        append=args.append)
+    report = pipeline.run(urls=urls, markdown_files=markdown_files)
+    report["outputs"] = write_outputs(args.store, args.graph, args.binary)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# ============================================================================
+# projection.py - Proiezione PCA 2D/3D scalabile con base salvata su disco
+# ============================================================================
+#
+# json2points e lib3d.graph_nearest rifacevano PCA(n_components=...) completa
+# su tutta la matrice (N x 1024) a ogni chiamata. Qui il fit lavora a blocchi,
+# quindi va bene anche su uno store in memmap, e la base (mean + componenti)
+# si salva: le chiamate successive fanno solo (X - mean) @ components.T.
+#
+# Metodi di fit:
+#
+#   "randomized"   SVD randomizzata (range finder + power iteration) calcolata
+#                  con prodotti a blocchi: memoria O((N + D) * (dims + 10))
+#   "incremental"  sklearn IncrementalPCA.partial_fit blocco per blocco
+#
+# File della base (.npz): mean, components, explained_variance_ratio, n_fit
+#
+#   python projection.py fit store/ --dims 3
+#   python projection.py info store/projection_3d.npz
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+CHUNK_SIZE = 8192
+METHODS = ("randomized", "incremental")
+
+def basis_file(n_components):
+    """Nome del file della base nella directory di uno store (2D e 3D separati)"""
+    return f"projection_{n_components}d.npz"
+
+# ============================================================================
+# FUNZIONI DI SUPPORTO
+# ============================================================================
+
+def _chunks(matrix, chunk_size, dtype=np.float64):
+    for start in range(0, len(matrix), chunk_size):
+        yield np.asarray(matrix[start:start + chunk_size], dtype=dtype)
+
+def _moments(matrix, chunk_size):
+    """(media per colonna, varianza totale) in un solo passaggio"""
+    total = np.zeros(matrix.shape[1])
+    squares = 0.0
+    for block in _chunks(matrix, chunk_size):
+        total += block.sum(axis=0)
+        squares += float((block ** 2).sum())
+    mean = total / len(matrix)
+    return mean, squares - len(matrix) * float(mean @ mean)
+
+def _flip_signs(components):
+    # Segno deterministico (come svd_flip di sklearn): il valore assoluto
+    # massimo di ogni componente è positivo, così il layout non si specchia
+    signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+    signs[signs == 0] = 1
+    return components * signs[:, None]
+
+def _randomized_basis(matrix, mean, n_components, chunk_size, oversample=10, n_iter=4, seed=0):
+    """Prime `n_components` direzioni principali di (matrix - mean) a blocchi"""
+    n, dim = matrix.shape
+    rank = min(n_components + oversample, n, dim)
+    omega = np.random.default_rng(seed).standard_normal((dim, rank))
+
+    # I prodotti col blocco sono in float32 (come lo store); la media si
+    # sottrae a parte in float64 per non dover centrare ogni blocco
+    def times(right):
+        # (X - mean) @ right, riga per riga a blocchi
+        out = np.empty((n, right.shape[1]))
+        shift = mean @ right
+        right32 = right.astype(np.float32)
+        for start, block in zip(range(0, n, chunk_size), _chunks(matrix, chunk_size, np.float32)):
+            out[start:start + len(block)] = block @ right32
+        return out - shift
+
+    def transposed_times(left):
+        # (X - mean).T @ left, accumulato sui blocchi
+        out = -np.outer(mean, left.sum(axis=0))
+        for start, block in zip(range(0, n, chunk_size), _chunks(matrix, chunk_size, np.float32)):
+            out += block.T @ left[start:start + len(block)].astype(np.float32)
+        return out
+
+    q, _ = np.linalg.qr(times(omega))
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(transposed_times(q))
+        q, _ = np.linalg.qr(times(q))
+
+    # B = Q.T @ (X - mean) è piccolo (rank x D): SVD esatta
+    _, s, vt = np.linalg.svd(transposed_times(q).T, full_matrices=False)
+    return vt[:n_components], s[:n_components]
+
+# ============================================================================
+# BASE DI PROIEZIONE
+# ============================================================================
+
+class Projection:
+    """Base PCA (mean + componenti) riusabile: transform è un solo prodotto"""
+
+    def __init__(self, mean, components, explained_variance_ratio=None, n_fit=0):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.components = np.asarray(components, dtype=np.float64)
+        self.explained_variance_ratio = (np.asarray(explained_variance_ratio, dtype=np.float64)
+                                         if explained_variance_ratio is not None
+                                         else np.zeros(len(self.components)))
+        self.n_fit = int(n_fit)
+
+    @property
+    def n_components(self):
+        return len(self.components)
+
+    @property
+    def dim(self):
+        return len(self.mean)
+
+    @classmethod
+    def fit(cls, matrix, n_components=3, method="randomized", chunk_size=CHUNK_SIZE):
+        """Fit a blocchi su una matrice (N, D), anche memmap"""
+        if method not in METHODS:
+            raise ValueError(f"Unknown projection method {method!r} (expected one of {METHODS})")
+        n = len(matrix)
+        if n < 2:
+            raise ValueError("At least 2 embeddings are needed to fit a projection")
+
+        if method == "incremental":
+            from sklearn.decomposition import IncrementalPCA
+
+            # Ogni partial_fit vuole almeno n_components righe: l'ultimo blocco
+            # troppo corto si unisce al precedente
+            chunk_size = max(chunk_size, n_components)
+            bounds = list(range(0, n, chunk_size)) + [n]
+            if len(bounds) > 2 and bounds[-1] - bounds[-2] < n_components:
+                bounds.pop(-2)
+            ipca = IncrementalPCA(n_components=n_components)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                ipca.partial_fit(np.asarray(matrix[start:stop], dtype=np.float64))
+            return cls(ipca.mean_, _flip_signs(ipca.components_), ipca.explained_variance_ratio_, n)
+
+        mean, total_variance = _moments(matrix, chunk_size)
+        components, singular_values = _randomized_basis(matrix, mean, n_components, chunk_size)
+
+        ratio = singular_values ** 2 / total_variance if total_variance else np.zeros(n_components)
+        return cls(mean, _flip_signs(components), ratio, n)
+
+    def transform(self, matrix, chunk_size=CHUNK_SIZE):
+        """(N, D) -> (N, n_components) con la base salvata"""
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match projection dimension {self.dim}")
+        shift = self.mean @ self.components.T
+        out = np.empty((len(matrix), self.n_components))
+        for start, block in zip(range(0, len(matrix), chunk_size), _chunks(matrix, chunk_size)):
+            out[start:start + len(block)] = block @ self.components.T - shift
+        return out
+
+    # ------------------------------------------------------------------------
+    # Persistenza
+    # ------------------------------------------------------------------------
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, mean=self.mean, components=self.components,
+                 explained_variance_ratio=self.explained_variance_ratio, n_fit=self.n_fit)
+        os.replace(tmp, path)
+        return self
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["mean"], data["components"], data["explained_variance_ratio"], data["n_fit"])
+
+    def info(self):
+        return {
+            "dim": self.dim,
+            "n_components": self.n_components,
+            "n_fit": self.n_fit,
+            "explained_variance_ratio": [round(float(r), 6) for r in self.explained_variance_ratio],
+        }
+
+def project(matrix, n_components=3, basis_path=None, refit=False, method="randomized"):
+    """Proietta `matrix` in 2D/3D; con `basis_path` riusa (o crea) la base salvata
+
+    La base salvata viene rifatta se `refit` o se non corrisponde più alla
+    dimensione degli embedding / al numero di componenti richiesto.
+    """
+    if basis_path and not refit and os.path.exists(basis_path):
+        projection = Projection.load(basis_path)
+        if projection.dim == matrix.shape[1] and projection.n_components == n_components:
+            return projection.transform(matrix)
+
+    projection = Projection.fit(matrix, n_components, method=method)
+    if basis_path:
+        projection.save(basis_path)
+    return projection.transform(matrix)
+
+def store_basis_path(store_path, n_components):
+    return os.path.join(store_path, basis_file(n_components))
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    import embedding_store
+
+    parser = argparse.ArgumentParser(description='Fit and inspect the saved PCA projection of an embedding store.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('fit', help='Fit the projection basis over the store matrix (chunked).')
+    p.add_argument('store_path')
+    p.add_argument('--dims', type=int, choices=(2, 3), default=3)
+    p.add_argument('--method', choices=METHODS, default='randomized')
+    p.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    p = sub.add_parser('info', help='Show a saved basis.')
+    p.add_argument('basis_path')
+
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        store = embedding_store.open_store(args.store_path)
+        started = time.perf_counter()
+        projection = Projection.fit(store.matrix, args.dims, method=args.method, chunk_size=args.chunk_size)
+        elapsed = time.perf_counter() - started
+        path = store_basis_path(args.store_path, args.dims)
+        projection.save(path)
+        print(json.dumps(dict(projection.info(), path=path, method=args.method,
+                              fit_seconds=round(elapsed, 3)), indent=2))
+    else:
+        print(json.dumps(Projection.load(args.basis_path).info(), indent=2))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
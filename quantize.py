@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# ============================================================================
+# quantize.py - Store compresso (float16 / int8 / PQ) + ricerca con re-ranking
+# ============================================================================
+#
+# Un blob di get_blob sono 1024 float32 + 4 byte di header (4100 byte), 5468 in
+# base64 dentro embeddings_blob.json. Qui le righe di uno store si comprimono
+# in codici accanto alla matrice:
+#
+#   float16   2 byte per dimensione (÷2)
+#   int8      1 byte per dimensione, scala e offset per dimensione (÷4)
+#   pq        product quantization: m sottospazi, 256 centroidi ciascuno,
+#             1 byte per sottospazio (1024 dim, m = 128 -> ÷32)
+#
+# La ricerca scorre i codici a blocchi con distanze approssimate (GEMM sulle
+# righe decodificate a blocchi di DECODE_ROWS in un buffer riusato, così il
+# float32 temporaneo resta di pochi MB; o tabelle di distanza per PQ), tiene i `rerank`
+# candidati migliori e li riordina con le distanze esatte sulla matrice
+# float32 dello store (exact_search.merge_top_k). Senza matrice (rerank=0)
+# risponde dai soli codici.
+#
+# File nella directory dello store:
+#
+#   quant_<formato>.npz   parametri (scala/offset o codebook PQ) + righe codificate
+#                         e fingerprint dello store (vedi embedding_store.py)
+#   codes_<formato>.npy   codici (N, D) float16/int8 o (N, m) uint8, letti in mmap
+#
+#   python quantize.py build store/ --format int8 pq
+#   python quantize.py eval store/ --format float16 int8 pq --rerank 0 50 200
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+import exact_search
+
+FORMATS = ("float16", "int8", "pq")
+DEFAULT_RERANK = 50
+CHUNK_SIZE = 65536
+# Righe float16/int8 decodificate alla volta (1024 dim -> 16 MB di float32)
+DECODE_ROWS = 4096
+
+# Chiavi di quant_<formato>.npz che non sono parametri di decodifica
+META_KEYS = ("rows", "fingerprint")
+
+# ============================================================================
+# CODIFICA / DECODIFICA
+# ============================================================================
+
+def _default_pq_m(dim):
+    # 8 dimensioni per sottospazio (1 byte ogni 32 byte di float32)
+    m = max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return m
+
+def _train_pq(matrix, m, sample_size=20000, seed=0):
+    """Codebook (m, 256, D/m): k-means su un campione, sottospazio per sottospazio"""
+    from sklearn.cluster import MiniBatchKMeans
+
+    n, dim = matrix.shape
+    if dim % m:
+        raise ValueError(f"PQ needs the dimension ({dim}) to be a multiple of m ({m})")
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(matrix[np.sort(rng.choice(n, size=min(n, sample_size), replace=False))],
+                        dtype=np.float32)
+    clusters = min(256, len(sample))
+    sub = dim // m
+    codebook = np.zeros((m, 256, sub), dtype=np.float32)
+    for j in range(m):
+        kmeans = MiniBatchKMeans(n_clusters=clusters, random_state=seed, n_init=1,
+                                 batch_size=max(1024, 4 * clusters))
+        kmeans.fit(sample[:, j * sub:(j + 1) * sub])
+        codebook[j, :clusters] = kmeans.cluster_centers_
+        # Campione con meno di 256 righe: copie del primo centroide (argmin sceglie sempre l'originale)
+        codebook[j, clusters:] = kmeans.cluster_centers_[0]
+    return codebook
+
+class QuantizedStore:
+    """Codici di uno store in un formato compresso + parametri per decodificarli"""
+
+    def __init__(self, fmt, codes, params, fingerprint=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format: {fmt} (expected one of {', '.join(FORMATS)})")
+        self.format = fmt
+        self.codes = codes
+        self.params = params
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.codes)
+
+    @classmethod
+    def build(cls, matrix, fmt, pq_m=None):
+        """Parametri dai dati (min/max per dimensione, codebook PQ) e codifica di tutte le righe"""
+        if len(matrix) == 0:
+            raise ValueError("Cannot quantize an empty matrix")
+        if fmt == "int8":
+            lower = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+            upper = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+            for start in range(0, len(matrix), CHUNK_SIZE):
+                block = np.asarray(matrix[start:start + CHUNK_SIZE], dtype=np.float32)
+                lower, upper = np.minimum(lower, block.min(axis=0)), np.maximum(upper, block.max(axis=0))
+            params = {"offset": lower, "scale": np.maximum(upper - lower, 1e-12) / 255}
+        elif fmt == "pq":
+            params = {"codebook": _train_pq(matrix, pq_m or _default_pq_m(matrix.shape[1]))}
+        else:
+            params = {}
+        quantized = cls(fmt, None, params)
+        quantized.codes = quantized.encode(matrix)
+        return quantized
+
+    def encode(self, matrix):
+        """Righe float32 (N, D) -> codici, a blocchi (anche da memmap)"""
+        blocks = []
+        for start in range(0, len(matrix), CHUNK_SIZE):
+            block = np.asarray(matrix[start:start + CHUNK_SIZE], dtype=np.float32)
+            if self.format == "float16":
+                blocks.append(block.astype(np.float16))
+            elif self.format == "int8":
+                levels = np.rint((block - self.params["offset"]) / self.params["scale"])
+                blocks.append((np.clip(levels, 0, 255) - 128).astype(np.int8))
+            else:
+                codebook = self.params["codebook"]
+                m, _, sub = codebook.shape
+                codes = np.empty((len(block), m), dtype=np.uint8)
+                for j in range(m):
+                    part = block[:, j * sub:(j + 1) * sub]
+                    # ||x - c||^2 a meno di ||x||^2, come assign_to_centroids
+                    scores = (codebook[j] ** 2).sum(axis=1) - 2 * part @ codebook[j].T
+                    codes[:, j] = scores.argmin(axis=1)
+                blocks.append(codes)
+        return np.concatenate(blocks) if blocks else np.zeros((0,), dtype=np.uint8)
+
+    def decode(self, codes):
+        """Codici -> righe float32 approssimate"""
+        if self.format == "float16":
+            return codes.astype(np.float32)
+        if self.format == "int8":
+            return (codes.astype(np.float32) + 128) * self.params["scale"] + self.params["offset"]
+        codebook = self.params["codebook"]
+        m = codebook.shape[0]
+        return np.concatenate([codebook[j][codes[:, j]] for j in range(m)], axis=1)
+
+    def add(self, matrix):
+        """Righe nuove (in coda) codificate con i parametri esistenti"""
+        self.codes = np.concatenate([np.asarray(self.codes), self.encode(matrix)])
+
+    def sync(self, store):
+        """Codifica le righe aggiunte allo store; StaleIndexError se i codici non sono di questo store"""
+        if self.fingerprint is not None:
+            store.check_index(f"{self.format} codes", len(self), self.fingerprint)
+        self.fingerprint = store.fingerprint()
+        if len(self) < len(store):
+            self.add(store.matrix[len(self):])
+        return self
+
+    # ------------------------------------------------------------------------
+    # Ricerca
+    # ------------------------------------------------------------------------
+
+    def _tables(self, queries):
+        # ADC: distanze query-centroide (m, Q, 256), calcolate una volta per ricerca
+        codebook = self.params["codebook"]
+        m, _, sub = codebook.shape
+        tables = np.empty((m, len(queries), codebook.shape[1]), dtype=np.float32)
+        for j in range(m):
+            diff = queries[:, None, j * sub:(j + 1) * sub] - codebook[j][None]
+            tables[j] = np.einsum('qcd,qcd->qc', diff, diff)
+        return tables
+
+    def _decode_into(self, codes, out):
+        # Come decode(), ma in place nel buffer: nessun temporaneo della dimensione del blocco
+        np.copyto(out, codes, casting='unsafe')
+        if self.format == "int8":
+            out += 128
+            out *= self.params["scale"]
+            out += self.params["offset"]
+        return out
+
+    def _approx_d2(self, queries, codes, tables=None):
+        if self.format != "pq":
+            query_norms = np.einsum('ij,ij->i', queries, queries)[:, None]
+            d2 = np.empty((len(queries), len(codes)), dtype=np.float32)
+            buffer = np.empty((min(DECODE_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+            for start in range(0, len(codes), DECODE_ROWS):
+                part = np.asarray(codes[start:start + DECODE_ROWS])
+                block = self._decode_into(part, buffer[:len(part)])
+                d2[:, start:start + len(part)] = (query_norms + np.einsum('ij,ij->i', block, block)
+                                                  - 2 * queries @ block.T)
+            return d2
+        # Somma dei lookup nelle tabelle, un sottospazio alla volta
+        d2 = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for j, table in enumerate(tables):
+            d2 += table[:, codes[:, j]]
+        return d2
+
+    def search(self, queries, k=5, matrix=None, rerank=DEFAULT_RERANK):
+        """Top k: distanze approssimate sui codici, poi re-ranking esatto dei `rerank` migliori su `matrix`
+
+        Ritorna (indici, distanze) (Q, k); una query 1D -> array 1D. Con
+        matrix=None o rerank=0 le distanze sono quelle approssimate.
+        """
+        single = np.ndim(queries) == 1
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        keep = max(k, rerank if matrix is not None else 0)
+        tables = self._tables(queries) if self.format == "pq" else None
+
+        best_idx = np.zeros((len(queries), 0), dtype=np.int64)
+        best_d2 = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.codes), CHUNK_SIZE):
+            # float16/int8 restano nel memmap: _approx_d2 li legge a blocchi di DECODE_ROWS
+            codes = self.codes[start:start + CHUNK_SIZE]
+            d2 = self._approx_d2(queries, np.asarray(codes) if self.format == "pq" else codes, tables)
+            top = np.argpartition(d2, min(keep, d2.shape[1]) - 1, axis=1)[:, :keep]
+            best_idx = np.concatenate([best_idx, top + start], axis=1)
+            best_d2 = np.concatenate([best_d2, np.take_along_axis(d2, top, axis=1)], axis=1)
+            if best_idx.shape[1] > keep:
+                cut = np.argpartition(best_d2, keep - 1, axis=1)[:, :keep]
+                best_idx = np.take_along_axis(best_idx, cut, axis=1)
+                best_d2 = np.take_along_axis(best_d2, cut, axis=1)
+
+        if matrix is not None and rerank:
+            idx, dist = exact_search.merge_top_k([(best_idx, best_d2)], k, queries, matrix, candidates=rerank)
+        else:
+            order = np.argsort(best_d2, axis=1, kind='stable')[:, :k]
+            idx = np.take_along_axis(best_idx, order, axis=1)
+            dist = np.sqrt(np.maximum(np.take_along_axis(best_d2, order, axis=1), 0))
+        return (idx[0], dist[0]) if single else (idx, dist)
+
+    # ------------------------------------------------------------------------
+    # Persistenza
+    # ------------------------------------------------------------------------
+
+    @property
+    def nbytes(self):
+        return int(np.asarray(self.codes).nbytes + sum(np.asarray(p).nbytes for p in self.params.values()))
+
+    def save(self, path):
+        """Salva nella directory dello store `path` (fingerprint di quello store se manca)"""
+        import embedding_store
+
+        if self.fingerprint is None:
+            self.fingerprint = embedding_store.open_store(path).fingerprint()
+        meta = {"rows": np.array(len(self)), "fingerprint": np.array(self.fingerprint)}
+        # Codici prima dei parametri: un crash a metà lascia "rows" diverso dai codici
+        for name, write in ((f"codes_{self.format}.npy", lambda f: np.save(f, np.asarray(self.codes))),
+                            (f"quant_{self.format}.npz", lambda f: np.savez(f, **self.params, **meta))):
+            tmp = os.path.join(path, name + ".tmp")
+            with open(tmp, 'wb') as f:
+                write(f)
+            os.replace(tmp, os.path.join(path, name))
+
+    @classmethod
+    def load(cls, path, fmt):
+        with np.load(os.path.join(path, f"quant_{fmt}.npz")) as data:
+            params = {name: data[name] for name in data.files if name not in META_KEYS}
+            meta = {name: data[name] for name in META_KEYS if name in data.files}
+        codes = np.load(os.path.join(path, f"codes_{fmt}.npy"), mmap_mode='r')
+        # Codici senza meta (o di un altro salvataggio): fingerprint vuoto, sync li rifiuta
+        fingerprint = str(meta["fingerprint"]) if meta.get("rows", -1) == len(codes) and "fingerprint" in meta else ""
+        return cls(fmt, codes, params, fingerprint)
+
+    @staticmethod
+    def exists(path, fmt):
+        return os.path.exists(os.path.join(path, f"codes_{fmt}.npy"))
+
+# ============================================================================
+# MEMORIA / RECALL
+# ============================================================================
+
+def evaluate(store, quantized, reranks, n_queries=100, k=10, seed=0):
+    """Byte risparmiati e recall@k rispetto alla ricerca esatta float32, per ogni rerank"""
+    rng = np.random.default_rng(seed)
+    queries = np.asarray(store.matrix[rng.choice(len(store), size=min(n_queries, len(store)), replace=False)])
+    truth, _ = exact_search.search_matrix(queries, store.matrix, k)
+
+    float32_bytes = store.matrix.size * 4
+    # embeddings_blob.json: header di 4 byte + float32, in base64
+    blob_json_bytes = len(store) * 4 * ((4 + 4 * store.dim + 2) // 3)
+    report = {"float32": {"bytes": float32_bytes, "blob_json_bytes": blob_json_bytes}}
+
+    for q in quantized:
+        entry = {"bytes": q.nbytes, "ratio_vs_float32": float32_bytes / q.nbytes,
+                 "ratio_vs_blob_json": blob_json_bytes / q.nbytes}
+        for rerank in reranks:
+            started = time.perf_counter()
+            idx, _ = q.search(queries, k, store.matrix if rerank else None, rerank)
+            elapsed = time.perf_counter() - started
+            hits = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(idx, truth))
+            entry[f"rerank={rerank}"] = {"recall": hits / truth.size,
+                                         "latency_ms": elapsed * 1000 / len(queries)}
+        report[q.format] = entry
+    return report
+
+# ============================================================================
+# MAIN ENTRY POINT
+# ============================================================================
+
+def main():
+    import embedding_store
+
+    parser = argparse.ArgumentParser(description='Compressed embedding codes with exact re-ranking.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('build', help='Encode the store rows and save codes + parameters.')
+    p.add_argument('store_path')
+    p.add_argument('--format', nargs='+', choices=FORMATS, default=['int8'])
+    p.add_argument('--pq-m', type=int, default=None, help='PQ subspaces (default: dim / 8).')
+
+    p = sub.add_parser('add', help='Encode rows appended to the store since the last build.')
+    p.add_argument('store_path')
+    p.add_argument('--format', nargs='+', choices=FORMATS, default=['int8'])
+
+    p = sub.add_parser('eval', help='Report memory saved and recall lost against float32 search.')
+    p.add_argument('store_path')
+    p.add_argument('--format', nargs='+', choices=FORMATS, default=list(FORMATS))
+    p.add_argument('--rerank', type=int, nargs='+', default=[0, DEFAULT_RERANK])
+    p.add_argument('--queries', type=int, default=100)
+    p.add_argument('-k', type=int, default=10)
+
+    args = parser.parse_args()
+    store = embedding_store.open_store(args.store_path)
+
+    if args.command == 'build':
+        for fmt in args.format:
+            quantized = QuantizedStore.build(store.matrix, fmt, args.pq_m)
+            quantized.save(args.store_path)
+            print(f"{fmt}: {len(quantized)} rows, {quantized.nbytes / 1e6:.2f} MB "
+                  f"(float32: {store.matrix.size * 4 / 1e6:.2f} MB)")
+    elif args.command == 'add':
+        for fmt in args.format:
+            quantized = QuantizedStore.load(args.store_path, fmt)
+            before = len(quantized)
+            quantized.sync(store).save(args.store_path)
+            print(f"{fmt}: encoded {len(quantized) - before} new rows ({len(quantized)} total)")
+    else:
+        quantized = [QuantizedStore.load(args.store_path, fmt) if QuantizedStore.exists(args.store_path, fmt)
+                     else QuantizedStore.build(store.matrix, fmt) for fmt in args.format]
+        print(json.dumps(evaluate(store, [q.sync(store) for q in quantized], args.rerank, args.queries, args.k),
+                         indent=2))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,119 @@
+"""
+Micro-benchmark for process_internal_references on scraped articles.
+
+Compares the old implementation (13 separate re.sub passes, copied below)
+with the current single compiled pass, reporting MB/s for each. It also counts
+the articles where the outputs differ; those should be only pages where the
+old passes rewrote text inside links they had just generated (e.g. "Methods"
+inside "[Materials and Methods](...)"). It also checks that the new pass is
+idempotent.
+
+Articles are read from the Markdown files in scraped_content/ (body only,
+the header block is skipped). The internal links the scraper already added
+are unwrapped first, so both versions see plain html2text output.
+
+    python bench_references.py --input scraped_content --repeat 5
+"""
+import os
+import re
+import glob
+import time
+import argparse
+
+from scraper import process_internal_references
+
+
+def legacy_process_internal_references(markdown_content):
+    """
+    process_internal_references before the single-pass rewrite, for comparison.
+    """
+    markdown_content = re.sub(r'Figure (\d+)', r'[Figure \1](#figure-\1)', markdown_content)
+    markdown_content = re.sub(r'Table (\d+)', r'[Table \1](#table-\1)', markdown_content)
+    section_patterns = [
+        (r'Introduction', '[Introduction](#introduction)'),
+        (r'Materials and Methods', '[Materials and Methods](#materials-and-methods)'),
+        (r'Results', '[Results](#results)'),
+        (r'Discussion', '[Discussion](#discussion)'),
+        (r'Conclusion', '[Conclusion](#conclusion)'),
+        (r'References', '[References](#references)'),
+        (r'Abstract', '[Abstract](#abstract)'),
+        (r'Methods', '[Methods](#methods)'),
+        (r'Background', '[Background](#background)'),
+        (r'Acknowledgments', '[Acknowledgments](#acknowledgments)'),
+        (r'Funding Statement', '[Funding Statement](#funding-statement)'),
+    ]
+    for pattern, replacement in section_patterns:
+        markdown_content = re.sub(pattern, replacement, markdown_content)
+    return markdown_content
+
+
+INTERNAL_LINK = re.compile(r'\[([^\[\]]*)\]\(#[^)]*\)')
+
+
+def unwrap_internal_links(text):
+    """
+    Undo process_internal_references (repeated for the old nested links).
+    """
+    while True:
+        unwrapped = INTERNAL_LINK.sub(r'\1', text)
+        if unwrapped == text:
+            return text
+        text = unwrapped
+
+
+def load_articles(input_dir):
+    """
+    Body of every scraped Markdown file (text after the header block's closing ---).
+    """
+    articles = []
+    for path in sorted(glob.glob(os.path.join(input_dir, '*.md'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        parts = content.split('\n---\n', 2)
+        articles.append(unwrap_internal_links(parts[2] if len(parts) == 3 else content))
+    return articles
+
+
+def throughput(fn, articles, repeat):
+    """
+    Best-of-`repeat` MB/s of running fn over all articles.
+    """
+    total_bytes = sum(len(a.encode('utf-8')) for a in articles)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for article in articles:
+            fn(article)
+        best = min(best, time.perf_counter() - started)
+    return total_bytes / best / 1e6, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark process_internal_references.')
+    parser.add_argument('--input', default='scraped_content', help='Directory of scraped Markdown files.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs (best is reported).')
+    args = parser.parse_args()
+
+    articles = load_articles(args.input)
+    if not articles:
+        print(f"No Markdown files in {args.input} (run scraper.py first)")
+        return
+
+    size = sum(len(a.encode('utf-8')) for a in articles) / 1e6
+    print(f"{len(articles)} articles, {size:.2f} MB")
+
+    legacy_mbs, legacy_s = throughput(legacy_process_internal_references, articles, args.repeat)
+    current_mbs, current_s = throughput(process_internal_references, articles, args.repeat)
+    print(f"  13 x re.sub    {legacy_mbs:8.2f} MB/s  ({legacy_s:.3f}s)")
+    print(f"  single pass    {current_mbs:8.2f} MB/s  ({current_s:.3f}s)")
+    print(f"  speedup        {current_mbs / legacy_mbs:8.2f}x")
+
+    different = sum(legacy_process_internal_references(a) != process_internal_references(a) for a in articles)
+    once = [process_internal_references(a) for a in articles]
+    idempotent = all(process_internal_references(a) == a for a in once)
+    print(f"  outputs differing from the old passes: {different}/{len(articles)}")
+    print(f"  single pass idempotent: {idempotent}")
+
+
+if __name__ == '__main__':
+    main()
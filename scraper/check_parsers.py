@@ -0,0 +1,129 @@
+"""
+Check that the faster parser backend produces the same Markdown as the
+default one, on saved HTML fixtures.
+
+Fixtures are raw article pages (`<name>.html`) in a directory, by default
+the committed `fixtures/` next to this script: PMC-like pages generated by
+fixture_server.article_html plus a hand-written page with the markup PMC
+uses (author links, figures, tables, lists, references). Every page is
+converted with `html.parser` and with the candidate backend (default `lxml`)
+using a fixed scrape date; any difference is reported as a unified diff and
+the exit status is 1. When `<name>.md` exists next to the page it is treated
+as the expected output for both backends (`--update` rewrites it from
+`html.parser`). Timing per backend is printed at the end.
+
+    python check_parsers.py                                  # committed fixtures, offline
+    python check_parsers.py --generate 3 --update            # rewrite the generated pages and expected Markdown
+    python check_parsers.py pages/ --save-from csv/SB_publication_PMC.csv -n 20   # download real pages once
+"""
+import os
+import sys
+import time
+import difflib
+import argparse
+
+from scraper import PARSERS, fetch, make_session, parse_article, read_urls
+
+FIXED_DATE = '2000-01-01'
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture_url(name):
+    """
+    URL used for the header block of a fixture (only its last path part matters).
+    """
+    return f"https://pmc.ncbi.nlm.nih.gov/articles/{name}/"
+
+
+def save_fixtures(csv_file, n, fixtures_dir, delay=0.5):
+    """
+    Download the first n pages of the CSV into fixtures_dir as <name>.html.
+    """
+    os.makedirs(fixtures_dir, exist_ok=True)
+    with make_session(pool_size=1) as session:
+        for url in read_urls(csv_file, n):
+            name = [p for p in url.split('/') if p][-1]
+            with open(os.path.join(fixtures_dir, f"{name}.html"), 'wb') as f:
+                f.write(fetch(url, session, retries=3).content)
+            print(f"Saved {url}")
+            time.sleep(delay)
+
+
+def generate_fixtures(n, fixtures_dir):
+    """
+    Write fixture_server pages PMC1..PMCn into fixtures_dir as <name>.html.
+    """
+    from fixture_server import article_html
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    for i in range(1, n + 1):
+        with open(os.path.join(fixtures_dir, f"PMC{i}.html"), 'w', encoding='utf-8') as f:
+            f.write(article_html(i))
+
+
+def convert(content, name, parser):
+    article = parse_article(content, fixture_url(name), parser, scraped_date=FIXED_DATE)
+    return article[1] if article else ''
+
+
+def diff(expected, actual, label):
+    return ''.join(difflib.unified_diff(expected.splitlines(True), actual.splitlines(True),
+                                        fromfile=f"{label} (expected)", tofile=f"{label} (actual)", n=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Markdown output of two BeautifulSoup backends.')
+    parser.add_argument('fixtures', nargs='?', default=FIXTURES_DIR,
+                        help='Directory of saved <name>.html pages (default: the committed fixtures).')
+    parser.add_argument('--parser', choices=PARSERS, default='lxml', help='Backend to check against html.parser.')
+    parser.add_argument('--update', action='store_true', help='Write <name>.md expected files from html.parser.')
+    parser.add_argument('--save-from', metavar='CSV', help='First download pages from this CSV into the fixtures directory.')
+    parser.add_argument('-n', type=int, default=10, help='Pages to download with --save-from.')
+    parser.add_argument('--generate', type=int, metavar='N', help='First write N fixture_server pages into the fixtures directory.')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_fixtures(args.generate, args.fixtures)
+    if args.save_from:
+        save_fixtures(args.save_from, args.n, args.fixtures)
+
+    names = sorted(f[:-len('.html')] for f in os.listdir(args.fixtures) if f.endswith('.html'))
+    if not names:
+        print(f"No .html fixtures in {args.fixtures}")
+        sys.exit(1)
+
+    timings = {'html.parser': 0.0, args.parser: 0.0}
+    mismatches = 0
+    for name in names:
+        with open(os.path.join(args.fixtures, f"{name}.html"), 'rb') as f:
+            content = f.read()
+
+        outputs = {}
+        for backend in timings:
+            started = time.perf_counter()
+            outputs[backend] = convert(content, name, backend)
+            timings[backend] += time.perf_counter() - started
+
+        expected_path = os.path.join(args.fixtures, f"{name}.md")
+        if args.update:
+            with open(expected_path, 'w', encoding='utf-8') as f:
+                f.write(outputs['html.parser'])
+        expected = outputs['html.parser']
+        if os.path.exists(expected_path):
+            with open(expected_path, 'r', encoding='utf-8') as f:
+                expected = f.read()
+
+        failed = [b for b, out in outputs.items() if out != expected]
+        for backend in failed:
+            print(diff(expected, outputs[backend], f"{name} [{backend}]"))
+        print(f"{'OK  ' if not failed else 'DIFF'} {name}" + (f" ({', '.join(failed)})" if failed else ''))
+        mismatches += bool(failed)
+
+    print(f"\n{len(names) - mismatches}/{len(names)} fixtures identical")
+    for backend, seconds in timings.items():
+        print(f"  {backend:<12} {seconds:.3f}s ({seconds / len(names) * 1000:.1f} ms/page)")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Crawl manifest: what the scraper already fetched, so reruns can skip it.
+
+One record per URL with the output file, HTTP validators (ETag /
+Last-Modified), a SHA-256 of the downloaded page and the outcome. Records are
+appended to a JSON Lines file and flushed as each page finishes, so a crash
+loses at most the page in flight; on load the last line for a URL wins and a
+truncated last line is cut off the file, so the next append starts on a
+fresh line. `compact()` rewrites the file with one line per URL.
+
+    {"url": ..., "file": "PMC123.md", "etag": ..., "last_modified": ...,
+     "sha256": ..., "status": "ok" | "failed" | "no_content",
+     "http_status": 200, "error": null, "fetched_at": "2025-01-01T12:00:00"}
+"""
+import os
+import json
+import hashlib
+import datetime
+
+MANIFEST_FILE = 'crawl_manifest.jsonl'
+
+# Outcomes that --only-failed retries
+FAILED_STATUS = ('failed', 'no_content')
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class CrawlManifest:
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self._lines = 0
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                data = f.read()
+                complete = data.rfind(b'\n') + 1
+                if complete < len(data):
+                    # Partial last line from an interrupted run: appending after it would
+                    # glue the next record onto it
+                    f.truncate(complete)
+            for line in data[:complete].decode('utf-8', errors='replace').splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.records[record['url']] = record
+                self._lines += 1
+        self._file = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, url):
+        return self.records.get(url)
+
+    def is_done(self, url, output_dir):
+        """
+        True when the URL was scraped successfully and its file is still there.
+        """
+        record = self.records.get(url)
+        return bool(record and record['status'] == 'ok' and record.get('file')
+                    and os.path.exists(os.path.join(output_dir, record['file'])))
+
+    def is_failed(self, url):
+        record = self.records.get(url)
+        return bool(record and record['status'] in FAILED_STATUS)
+
+    def validators(self, url, output_dir):
+        """
+        Conditional GET headers for a page that is already on disk.
+        """
+        if not self.is_done(url, output_dir):
+            return {}
+        record = self.records[url]
+        headers = {}
+        if record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+        return headers
+
+    def record(self, url, status, response=None, file=None, sha256=None, error=None):
+        """
+        Append the outcome for a URL. Fields not given are kept from the previous record.
+        """
+        previous = self.records.get(url, {})
+        entry = {
+            'url': url,
+            'file': file or previous.get('file'),
+            'etag': previous.get('etag'),
+            'last_modified': previous.get('last_modified'),
+            'sha256': sha256 or previous.get('sha256'),
+            'status': status,
+            'http_status': response.status_code if response is not None else None,
+            'error': error,
+            'fetched_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        if response is not None:
+            entry['etag'] = response.headers.get('ETag') or entry['etag']
+            entry['last_modified'] = response.headers.get('Last-Modified') or entry['last_modified']
+
+        self.records[url] = entry
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._lines += 1
+        return entry
+
+    def counts(self):
+        counts = {}
+        for record in self.records.values():
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+        return counts
+
+    def compact(self):
+        """
+        Rewrite the file with only the latest record per URL.
+        """
+        self.close()
+        if self._lines <= len(self.records):
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for record in self.records.values():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp, self.path)
+        self._lines = len(self.records)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
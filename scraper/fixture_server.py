@@ -0,0 +1,146 @@
+"""
+Local HTTP fixture server that imitates PMC article pages, for running the
+scraper offline.
+
+Serves `GET /articles/PMC<n>/` with a small deterministic article (title,
+author links, sections and Figure/Table references) and writes a CSV in the
+same format as `SB_publication_PMC.csv` pointing at it. Pages carry ETag and
+Last-Modified headers and answer a matching If-None-Match with 304.
+`--latency` adds a fixed delay per request and `--fail-rate` answers a
+fraction of requests with 503, to exercise concurrency, backoff and retries.
+
+    python fixture_server.py --port 8780 --articles 200 --latency 0.2 --write-csv csv/fixture.csv
+    python scraper.py --csv csv/fixture.csv -n 200 --concurrency 16 --delay 0
+"""
+import csv
+import time
+import hashlib
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+SECTIONS = ["Abstract", "Introduction", "Materials and Methods", "Results", "Discussion", "Conclusion"]
+
+
+def article_html(n, paragraphs=6):
+    """
+    Deterministic PMC-like article page for article number n.
+    """
+    rng = random.Random(n)
+    words = ["microgravity", "spaceflight", "bone", "muscle", "radiation", "plant", "gene",
+             "expression", "cell", "mice", "stress", "response", "orbit", "tissue", "analysis"]
+    authors = [f"{rng.choice(['Anna', 'Marco', 'Li', 'Sara', 'John'])} {rng.choice(['Rossi', 'Smith', 'Chen', 'Bianchi'])}"
+               for _ in range(3)]
+    author_links = "".join(
+        f'<a href="https://pubmed.ncbi.nlm.nih.gov/?term=%22{a.replace(" ", "+")}%22%5BAuthor%5D">{a}</a> '
+        for a in authors)
+
+    body = []
+    for section in SECTIONS:
+        body.append(f"<h2>{section}</h2>")
+        for p in range(paragraphs):
+            text = " ".join(rng.choice(words) for _ in range(60))
+            body.append(f"<p>{text} (see Figure {p + 1} and Table {p % 3 + 1}).</p>")
+
+    return (f"<html><head><title>Fixture article {n}</title></head><body>"
+            f"<h1>Fixture article {n}: effects of {rng.choice(words)} on {rng.choice(words)}</h1>"
+            f"<article><div class=\"contrib-author\">{author_links}</div>{''.join(body)}</article>"
+            f"</body></html>")
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            failing = random.random() < self.server.fail_rate
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        parts = [p for p in self.path.split('/') if p]
+        if failing:
+            self._send(503, "fixture: simulated overload")
+        elif len(parts) == 2 and parts[0] == 'articles' and parts[1].startswith('PMC') and parts[1][3:].isdigit():
+            html = article_html(int(parts[1][3:]))
+            etag = '"' + hashlib.sha256(html.encode('utf-8')).hexdigest()[:16] + '"'
+            headers = {"ETag": etag, "Last-Modified": LAST_MODIFIED}
+            if self.headers.get('If-None-Match') == etag:
+                with self.server.lock:
+                    self.server.not_modified += 1
+                self._send(304, "", headers=headers)
+            else:
+                self._send(200, html, "text/html; charset=utf-8", headers)
+        else:
+            self._send(404, f"fixture: unknown path {self.path}")
+
+    def _send(self, status, text, content_type="text/plain; charset=utf-8", headers=None):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, fail_rate=0.0):
+        super().__init__(address, FixtureHandler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.not_modified = 0
+        self.lock = threading.Lock()
+
+    def url(self, n):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/articles/PMC{n}/"
+
+
+def write_csv(path, urls):
+    """
+    CSV with the same Title/Link columns as SB_publication_PMC.csv.
+    """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=['Title', 'Link'])
+        writer.writeheader()
+        for i, url in enumerate(urls):
+            writer.writerow({'Title': f"Fixture article {i}", 'Link': url})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve fixture article pages for the scraper.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--articles', type=int, default=100, help='Number of articles listed in the CSV.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay added to every response.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+    parser.add_argument('--write-csv', metavar='PATH', help='Write a CSV of fixture links to PATH.')
+    args = parser.parse_args()
+
+    server = FixtureServer((args.host, args.port), latency=args.latency, fail_rate=args.fail_rate)
+    if args.write_csv:
+        write_csv(args.write_csv, [server.url(n) for n in range(args.articles)])
+        print(f"Wrote {args.articles} fixture links to {args.write_csv}")
+    print(f"Fixture server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,13 @@ import json
 import os
 import re
 import glob
+import hashlib
+import argparse
 from datetime import datetime
+from multiprocessing import Pool
+
+# Per-file state of the previous JSONL run, stored next to the output
+STATE_SUFFIX = '.state.json'
 
 def parse_markdown_file(file_path):
     """
@@ -10,7 +16,12 @@ def parse_markdown_file(file_path):
     """
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
-    
+    return parse_markdown(content)
+
+def parse_markdown(content):
+    """
+    Extract the JSON entry from the text of a scraped Markdown file.
+    """
     # Extract YAML frontmatter
     frontmatter_match = re.search(r'^---\s*\n(.*?)\n---', content, re.DOTALL)
     if not frontmatter_match:
@@ -98,18 +109,124 @@ def generate_json_from_directory(input_dir, output_file):
     print(f"Generated JSON with {len(results)} entries to {output_file}")
     return results
 
+def list_markdown_files(input_dir):
+    md_files = sorted(glob.glob(os.path.join(input_dir, "*.md")))
+    return [f for f in md_files if not f.endswith('0template.md')]
+
+def _parse_to_line(task):
+    """
+    Worker: (name, path, previous sha256) -> (name, sha256, JSON line or None).
+    The line is None when the content hash is unchanged; '' when the file has no frontmatter.
+    """
+    name, path, previous_sha = task
+    with open(path, 'rb') as f:
+        raw = f.read()
+    sha = hashlib.sha256(raw).hexdigest()
+    if sha == previous_sha:
+        return name, sha, None
+    parsed_data = parse_markdown(raw.decode('utf-8'))
+    return name, sha, json.dumps(parsed_data, ensure_ascii=False) + '\n' if parsed_data else ''
+
+def _load_state(state_file):
+    if state_file and os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def generate_jsonl_from_directory(input_dir, output_file, workers=None, full=False):
+    """
+    Stream one JSON entry per line into output_file, parsing files in a process pool.
+
+    Results are written as they arrive, so memory does not grow with the corpus.
+    The state file next to the output records mtime, size, hash and line
+    position per file. On the next run a file with the same mtime and size,
+    or the same hash, is not parsed again: its previous line is copied.
+    `full=True` ignores the state.
+    """
+    state_file = output_file + STATE_SUFFIX
+    previous = {} if full or not os.path.exists(output_file) else _load_state(state_file)
+
+    md_files = list_markdown_files(input_dir)
+    unchanged, tasks, stats = [], [], {}
+    for path in md_files:
+        name = os.path.basename(path)
+        st = os.stat(path)
+        stats[name] = (st.st_mtime_ns, st.st_size)
+        entry = previous.get(name)
+        if entry and (entry['mtime_ns'], entry['size']) == stats[name]:
+            unchanged.append(name)
+        else:
+            tasks.append((name, path, entry['sha256'] if entry else None))
+
+    state, counts = {}, {'parsed': 0, 'unchanged': 0, 'skipped': 0}
+    tmp_file = output_file + '.tmp'
+    old = open(output_file, 'rb') if previous else None
+    try:
+        with open(tmp_file, 'wb') as out:
+            def write(name, sha, line_bytes):
+                state[name] = {'mtime_ns': stats[name][0], 'size': stats[name][1], 'sha256': sha,
+                               'offset': out.tell(), 'length': len(line_bytes)}
+                out.write(line_bytes)
+
+            def copy_previous(name, sha=None):
+                entry = previous[name]
+                old.seek(entry['offset'])
+                write(name, sha or entry['sha256'], old.read(entry['length']))
+                counts['unchanged' if entry['length'] else 'skipped'] += 1
+
+            for name in unchanged:
+                copy_previous(name)
+
+            if tasks:
+                with Pool(workers) as pool:
+                    for name, sha, line in pool.imap_unordered(_parse_to_line, tasks, chunksize=8):
+                        if line is None:
+                            copy_previous(name, sha)
+                        elif line:
+                            write(name, sha, line.encode('utf-8'))
+                            counts['parsed'] += 1
+                            print(f"Processed: {name}")
+                        else:
+                            write(name, sha, b'')
+                            counts['skipped'] += 1
+    finally:
+        if old is not None:
+            old.close()
+
+    os.replace(tmp_file, output_file)
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+    total = counts['parsed'] + counts['unchanged']
+    print(f"Generated JSONL with {total} entries to {output_file} "
+          f"({counts['parsed']} parsed, {counts['unchanged']} unchanged, {counts['skipped']} without frontmatter)")
+    return counts
+
 def main():
     """
     Main function to process scraped content and generate JSON.
     """
-    input_dir = 'scraped_content'
-    output_file = 'papers_data.json'
+    parser = argparse.ArgumentParser(description='Generate JSON from scraped Markdown files.')
+    parser.add_argument('--input', default='scraped_content', help='Directory of scraped Markdown files.')
+    parser.add_argument('--output', default=None,
+                        help='Output file (default: papers_data.json, or papers_data.jsonl with --jsonl).')
+    parser.add_argument('--jsonl', action='store_true',
+                        help='Stream JSON Lines from a process pool, skipping unchanged files.')
+    parser.add_argument('--workers', type=int, default=None, help='Parser processes for --jsonl (default: one per CPU).')
+    parser.add_argument('--full', action='store_true', help='With --jsonl, re-parse every file.')
+    args = parser.parse_args()
+
+    input_dir = args.input
+    output_file = args.output or ('papers_data.jsonl' if args.jsonl else 'papers_data.json')
     
     if not os.path.exists(input_dir):
         print(f"Error: Directory '{input_dir}' does not exist.")
         return
     
-    generate_json_from_directory(input_dir, output_file)
+    if args.jsonl:
+        generate_jsonl_from_directory(input_dir, output_file, workers=args.workers, full=args.full)
+    else:
+        generate_json_from_directory(input_dir, output_file)
 
 if __name__ == '__main__':
     main()
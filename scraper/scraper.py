@@ -7,192 +7,463 @@ import argparse
 import html2text
 import re
 import datetime
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from urllib.parse import urlparse
 
+from crawl_manifest import MANIFEST_FILE, CrawlManifest, content_hash
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
+
+# Status codes worth retrying (rate limiting and transient server errors)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# BeautifulSoup backends; lxml is optional and faster on large pages
+PARSERS = ('html.parser', 'lxml')
+
+# Section names linked by process_internal_references, mapped to their anchors
+SECTION_ANCHORS = {
+    'Introduction': 'introduction',
+    'Materials and Methods': 'materials-and-methods',
+    'Results': 'results',
+    'Discussion': 'discussion',
+    'Conclusion': 'conclusion',
+    'References': 'references',
+    'Abstract': 'abstract',
+    'Methods': 'methods',
+    'Background': 'background',
+    'Acknowledgments': 'acknowledgments',
+    'Funding Statement': 'funding-statement',
+}
+
+# One pass over the text: existing Markdown links (and image alt text) are
+# matched first and left alone, then Figure/Table numbers, then section names
+# (longest first, so "Materials and Methods" wins over "Methods"). Every
+# branch starts with a literal, which lets the regex engine skip ahead to
+# candidate characters instead of trying the alternation at every position.
+REFERENCE_PATTERN = re.compile(
+    r'\[[^\]]*\]\([^)]*\)|Figure \d+|Table \d+|'
+    + '|'.join(re.escape(name) for name in sorted(SECTION_ANCHORS, key=len, reverse=True))
+)
+
+def _reference_link(match):
+    text = match.group()
+    if text[0] == '[':
+        return text
+    anchor = SECTION_ANCHORS.get(text)
+    if anchor is None:
+        kind, number = text.split(' ')
+        anchor = f'{kind.lower()}-{number}'
+    return f'[{text}](#{anchor})'
+
 def process_internal_references(markdown_content):
     """
     Convert internal page references (Figure X, Table X, Section names) to proper Markdown links.
+    Text that is already inside a Markdown link is never rewritten.
+    """
+    return REFERENCE_PATTERN.sub(_reference_link, markdown_content)
+
+class HostThrottle:
+    """
+    Per-host politeness delay shared by all worker threads: requests to the
+    same host are spaced at least `delay` seconds apart, other hosts are not affected.
+    """
+    def __init__(self, delay=0.5):
+        self.delay = delay
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        if self.delay <= 0:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+class Progress:
+    """
+    Thread-safe counters with periodic progress/throughput lines.
+    """
+    def __init__(self, total, every=10):
+        self.total = total
+        self.every = every
+        self.done = self.ok = self.failed = self.skipped = self.bytes = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, ok, n_bytes=0, skipped=False):
+        with self._lock:
+            self.done += 1
+            self.ok += bool(ok) and not skipped
+            self.skipped += bool(skipped)
+            self.failed += not ok
+            self.bytes += n_bytes
+            if self.done % self.every == 0 or self.done == self.total:
+                print(self.summary(), flush=True)
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"[{self.done}/{self.total}] ok={self.ok} unchanged={self.skipped} failed={self.failed} "
+                f"{self.done / elapsed:.2f} pages/s {self.bytes / elapsed / 1e6:.2f} MB/s "
+                f"({elapsed:.1f}s)")
+
+def make_session(pool_size=10):
+    """
+    Shared requests.Session: keep-alive connections pooled across worker threads.
+    """
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch(url, session=None, throttle=None, retries=3, backoff=1.0, timeout=30, headers=None):
+    """
+    GET with retry and exponential backoff on connection errors, timeouts,
+    429 and 5xx (Retry-After is honoured when given in seconds). Extra
+    `headers` (e.g. conditional GET validators) are sent with the request.
     """
-    # Process figure references
-    markdown_content = re.sub(
-        r'Figure (\d+)',
-        r'[Figure \1](#figure-\1)',
-        markdown_content
-    )
+    for attempt in range(retries + 1):
+        if throttle:
+            throttle.wait(url)
+        try:
+            if session is None:
+                response = requests.get(url, headers={**HEADERS, **(headers or {})}, allow_redirects=True,
+                                        timeout=timeout)
+            else:
+                response = session.get(url, headers=headers, allow_redirects=True, timeout=timeout)
+            if response.status_code not in RETRY_STATUS or attempt == retries:
+                response.raise_for_status()  # Raise an exception for bad status codes
+                return response
+            retry_after = response.headers.get('Retry-After', '')
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+        time.sleep(delay)
+
+def parse_article(content, url, parser='html.parser', scraped_date=None):
+    """
+    Parse a downloaded article page into Markdown. CPU-bound and free of I/O,
+    so it can run in a process pool. Returns (filename, document, title,
+    number of authors), or None if the page has no main article content.
+    """
+    if scraped_date is None:
+        scraped_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    soup = BeautifulSoup(content, parser)
+
+    # Extract paper title
+    title = soup.find('h1') or soup.find('title')
+    paper_title = title.get_text(strip=True) if title else "Unknown Title"
+    
+    # Find the main content of the article
+    article_body = soup.find('article')  # More general selector
+    if not article_body:
+        return None
     
-    # Process table references  
-    markdown_content = re.sub(
-        r'Table (\d+)',
-        r'[Table \1](#table-\1)',
-        markdown_content
-    )
+    # Extract author names
+    authors = []
     
-    # Process section references (common section names)
-    section_patterns = [
-        (r'Introduction', '[Introduction](#introduction)'),
-        (r'Materials and Methods', '[Materials and Methods](#materials-and-methods)'),
-        (r'Results', '[Results](#results)'),
-        (r'Discussion', '[Discussion](#discussion)'),
-        (r'Conclusion', '[Conclusion](#conclusion)'),
-        (r'References', '[References](#references)'),
-        (r'Abstract', '[Abstract](#abstract)'),
-        (r'Methods', '[Methods](#methods)'),
-        (r'Background', '[Background](#background)'),
-        (r'Acknowledgments', '[Acknowledgments](#acknowledgments)'),
-        (r'Funding Statement', '[Funding Statement](#funding-statement)'),
+    # Method 1: Look for author links in the article body first (most reliable)
+    author_links = article_body.find_all('a', href=lambda href: href and "pubmed.ncbi.nlm.nih.gov" in href and "%22%5BAuthor%5D" in href)
+    for link in author_links:
+        author_name = link.get_text(strip=True)
+        if author_name and author_name not in authors:
+            authors.append(author_name)
+    
+    # Method 2: Look for author elements with specific class patterns
+    author_selectors = [
+        'span[class*="author"]',
+        'div[class*="author"]', 
+        'span[class*="contrib"]',
+        'div[class*="contrib"]',
+        'span[class*="auth"]',
+        'div[class*="auth"]',
+        '.author-name',
+        '.contrib-author',
+        '.fm-author'
     ]
     
-    for pattern, replacement in section_patterns:
-        markdown_content = re.sub(pattern, replacement, markdown_content)
+    for selector in author_selectors:
+        elements = soup.select(selector)
+        for element in elements:
+            text = element.get_text(strip=True)
+            if text and len(text) > 2 and len(text) < 50:  # Reasonable author name length
+                # Clean up author names (remove numbers, special characters, etc.)
+                clean_name = re.sub(r'[0-9\*†‡§¶#]', '', text).strip()
+                # Check if it looks like a person's name (at least two words, starts with capital)
+                if (clean_name and 
+                    len(clean_name.split()) >= 2 and 
+                    clean_name[0].isupper() and
+                    clean_name not in authors):
+                    authors.append(clean_name)
     
-    return markdown_content
-
-def scrape_url(url, output_dir):
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'}
-        response = requests.get(url, headers=headers, allow_redirects=True, timeout=30)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        # Extract paper title
-        title = soup.find('h1') or soup.find('title')
-        paper_title = title.get_text(strip=True) if title else "Unknown Title"
-        
-        # Find the main content of the article
-        article_body = soup.find('article')  # More general selector
-        
-        # Extract author names
-        authors = []
-        
-        if article_body:
-            # Method 1: Look for author links in the article body first (most reliable)
-            author_links = article_body.find_all('a', href=lambda href: href and "pubmed.ncbi.nlm.nih.gov" in href and "%22%5BAuthor%5D" in href)
-            for link in author_links:
-                author_name = link.get_text(strip=True)
-                if author_name and author_name not in authors:
-                    authors.append(author_name)
-        
-        # Method 2: Look for author elements with specific class patterns
-        author_selectors = [
-            'span[class*="author"]',
-            'div[class*="author"]', 
-            'span[class*="contrib"]',
-            'div[class*="contrib"]',
-            'span[class*="auth"]',
-            'div[class*="auth"]',
-            '.author-name',
-            '.contrib-author',
-            '.fm-author'
-        ]
-        
-        for selector in author_selectors:
-            elements = soup.select(selector)
-            for element in elements:
-                text = element.get_text(strip=True)
-                if text and len(text) > 2 and len(text) < 50:  # Reasonable author name length
-                    # Clean up author names (remove numbers, special characters, etc.)
-                    clean_name = re.sub(r'[0-9\*†‡§¶#]', '', text).strip()
-                    # Check if it looks like a person's name (at least two words, starts with capital)
-                    if (clean_name and 
-                        len(clean_name.split()) >= 2 and 
-                        clean_name[0].isupper() and
-                        clean_name not in authors):
-                        authors.append(clean_name)
-        
-        # Method 3: Look for author names in specific sections
-        author_sections = soup.find_all(['div', 'section'], 
-                                      class_=lambda x: x and any(keyword in str(x).lower() 
-                                      for keyword in ['author', 'contrib', 'affiliation']))
-        
-        for section in author_sections:
-            # Look for text that matches name patterns
-            name_pattern = re.compile(r'\b[A-Z][a-z]+ [A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b')
-            matches = name_pattern.findall(section.get_text())
-            for match in matches:
-                if len(match) > 4 and match not in authors:
-                    authors.append(match)
-        
-        # Clean and deduplicate authors
-        authors = list(dict.fromkeys(authors))[:15]  # Remove duplicates, limit to 15 authors
-        
-        if article_body:
-            # Replace author links with placeholders
-            for author_link in article_body.find_all('a', href=lambda href: href and "pubmed.ncbi.nlm.nih.gov" in href and "%22%5BAuthor%5D" in href):
-                author_name = author_link.get_text(strip=True)
-                author_link.replace_with(f'(:SearchAuthor:[{author_name}])')
-            
-            # Convert HTML to Markdown
-            h = html2text.HTML2Text()
-            h.ignore_links = False
-            h.ignore_images = False
-            markdown_content = h.handle(str(article_body))
-            
-            # Process internal page references to create links
-            markdown_content = process_internal_references(markdown_content)
-            
-            # Create standardized header block
-            header_block = f"""---
+    # Method 3: Look for author names in specific sections
+    author_sections = soup.find_all(['div', 'section'], 
+                                  class_=lambda x: x and any(keyword in str(x).lower() 
+                                  for keyword in ['author', 'contrib', 'affiliation']))
+    
+    for section in author_sections:
+        # Look for text that matches name patterns
+        name_pattern = re.compile(r'\b[A-Z][a-z]+ [A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\b')
+        matches = name_pattern.findall(section.get_text())
+        for match in matches:
+            if len(match) > 4 and match not in authors:
+                authors.append(match)
+    
+    # Clean and deduplicate authors
+    authors = list(dict.fromkeys(authors))[:15]  # Remove duplicates, limit to 15 authors
+    
+    # Replace author links with placeholders
+    for author_link in article_body.find_all('a', href=lambda href: href and "pubmed.ncbi.nlm.nih.gov" in href and "%22%5BAuthor%5D" in href):
+        author_name = author_link.get_text(strip=True)
+        author_link.replace_with(f'(:SearchAuthor:[{author_name}])')
+    
+    # Convert HTML to Markdown
+    h = html2text.HTML2Text()
+    h.ignore_links = False
+    h.ignore_images = False
+    markdown_content = h.handle(str(article_body))
+    
+    # Process internal page references to create links
+    markdown_content = process_internal_references(markdown_content)
+    
+    # Create standardized header block
+    header_block = f"""---
 title: "{paper_title}"
 authors: {', '.join(authors) if authors else 'Unknown Authors'}
 url: {url}
-scraped_date: {datetime.datetime.now().strftime('%Y-%m-%d')}
+scraped_date: {scraped_date}
 ---
 
 # {paper_title}
 
 **Authors:** {', '.join(authors) if authors else 'Unknown Authors'}  
 **Source:** {url}  
-**Scraped:** {datetime.datetime.now().strftime('%Y-%m-%d')}
+**Scraped:** {scraped_date}
 
 ---
 
 """
-            
-            # Create a safe filename from the URL
-            parsed_url = urlparse(url)
-            # Extract PMC ID or use last path component
-            path_parts = [p for p in parsed_url.path.split('/') if p]
-            if path_parts:
-                filename_base = path_parts[-1] if path_parts[-1] else path_parts[-2] if len(path_parts) > 1 else 'unknown'
-            else:
-                filename_base = 'unknown'
-            
-            # Clean filename to be filesystem-safe
-            filename_base = re.sub(r'[^\w\-_.]', '_', filename_base)
-            filename = f"{filename_base}.md"
-            filepath = os.path.join(output_dir, filename)
-            
-            # Write content to file with header
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(header_block + markdown_content)
-            print(f"Scraped and saved content from {url} to {filepath}")
-            print(f"  Title: {paper_title}")
-            print(f"  Authors: {len(authors)} found")
-        else:
+    
+    # Create a safe filename from the URL
+    parsed_url = urlparse(url)
+    # Extract PMC ID or use last path component
+    path_parts = [p for p in parsed_url.path.split('/') if p]
+    if path_parts:
+        filename_base = path_parts[-1] if path_parts[-1] else path_parts[-2] if len(path_parts) > 1 else 'unknown'
+    else:
+        filename_base = 'unknown'
+    
+    # Clean filename to be filesystem-safe
+    filename_base = re.sub(r'[^\w\-_.]', '_', filename_base)
+    filename = f"{filename_base}.md"
+
+    return filename, header_block + markdown_content, paper_title, len(authors)
+
+def save_article(output_dir, filename, document):
+    filepath = os.path.join(output_dir, filename)
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(document)
+    return filepath
+
+def report_saved(url, filepath, title, n_authors):
+    print(f"Scraped and saved content from {url} to {filepath}")
+    print(f"  Title: {title}")
+    print(f"  Authors: {n_authors} found")
+
+def scrape_url(url, output_dir, session=None, throttle=None, retries=0, backoff=1.0, timeout=30,
+               parser='html.parser'):
+    """
+    Fetch one article and save it as Markdown. Returns the number of bytes
+    downloaded, or None if the page could not be scraped.
+    """
+    try:
+        response = fetch(url, session, throttle, retries, backoff, timeout)
+        article = parse_article(response.content, url, parser)
+        if article is None:
             print(f"Could not find main content for {url}")
+            return None
+
+        filename, document, title, n_authors = article
+        report_saved(url, save_article(output_dir, filename, document), title, n_authors)
+        return len(response.content)
 
     except requests.exceptions.RequestException as e:
         print(f"Error fetching {url}: {e}")
     except Exception as e:
         print(f"An error occurred while processing {url}: {e}")
+    return None
 
-def main():
-    parser = argparse.ArgumentParser(description='Scrape URLs from a CSV file.')
-    parser.add_argument('-n', type=int, default=10, help='Number of URLs to scrape.')
-    args = parser.parse_args()
+# ----------------------------------------------------------------------------
+# Pipeline stages: fetch (threads, I/O-bound) -> parse (processes, CPU-bound)
+# ----------------------------------------------------------------------------
 
-    csv_file = 'csv/SB_publication_PMC.csv'
-    output_dir = 'scraped_content'
-    os.makedirs(output_dir, exist_ok=True)
+def fetch_page(url, session=None, throttle=None, retries=0, backoff=1.0, timeout=30, headers=None):
+    """
+    Fetch stage: (response, None), or (None, error message) on a network/HTTP error.
+    A 304 response is returned as is.
+    """
+    try:
+        return fetch(url, session, throttle, retries, backoff, timeout, headers), None
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching {url}: {e}")
+        return None, str(e)
+
+def parse_page(content, url, parser='html.parser'):
+    """
+    Parse stage (runs in a worker process): parse_article result, None when
+    there is no main content, or the error message as a string.
+    """
+    try:
+        return parse_article(content, url, parser)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
 
+def read_urls(csv_file, n=None):
+    """
+    'Link' column of the publication CSV (first n rows).
+    """
+    urls = []
     with open(csv_file, 'r', newline='', encoding='utf-8') as f:
         reader = csv.DictReader(f)
         for i, row in enumerate(reader):
-            if i >= args.n:
+            if n is not None and i >= n:
                 break
             url = row.get('Link')
             if url:
-                scrape_url(url, output_dir)
+                urls.append(url)
+    return urls
+
+def select_urls(urls, manifest, output_dir, resume=False, only_failed=False):
+    """
+    URLs to request on this run. `resume` skips pages already saved without
+    contacting the server; `only_failed` keeps only rows that failed last time.
+    """
+    if only_failed:
+        return [url for url in urls if manifest.is_failed(url)]
+    if resume:
+        return [url for url in urls if not manifest.is_done(url, output_dir)]
+    return list(urls)
+
+def scrape_all(urls, output_dir, concurrency=8, delay=0.5, retries=3, backoff=1.0, timeout=30,
+               parse_workers=None, parser='html.parser', manifest=None):
+    """
+    Scrape `urls` as two stages: a thread pool over one shared session fetches
+    pages, and a process pool of `parse_workers` (default: one per CPU) parses
+    them as soon as each download finishes (`parse_workers=0` parses in
+    threads instead). With a CrawlManifest, pages already on disk are
+    requested with conditional GETs and not rewritten when the server answers
+    304 or the content hash is unchanged; every outcome is recorded.
+    Returns the Progress counters.
+    """
+    progress = Progress(len(urls), every=max(1, min(10, len(urls) // 20 or 1)))
+    throttle = HostThrottle(delay)
+    parse_executor = (ThreadPoolExecutor(max_workers=concurrency) if parse_workers == 0
+                      else ProcessPoolExecutor(max_workers=parse_workers))
+
+    def record(url, status, response=None, **fields):
+        if manifest is not None:
+            manifest.record(url, status, response, **fields)
+
+    with make_session(pool_size=concurrency) as session, \
+            ThreadPoolExecutor(max_workers=concurrency) as fetch_pool, \
+            parse_executor as parse_pool:
+        stage = {}
+        for url in urls:
+            headers = manifest.validators(url, output_dir) if manifest is not None else None
+            future = fetch_pool.submit(fetch_page, url, session, throttle, retries, backoff, timeout, headers)
+            stage[future] = ('fetch', url, None)
+
+        pending = set(stage)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, url, response = stage.pop(future)
+                if kind == 'fetch':
+                    response, error = future.result()
+                    if response is None:
+                        record(url, 'failed', error=error)
+                        progress.update(False)
+                        continue
+
+                    previous = manifest.get(url) if manifest is not None else None
+                    if response.status_code == 304 or (
+                            previous and manifest.is_done(url, output_dir)
+                            and previous.get('sha256') == content_hash(response.content)):
+                        record(url, 'ok', response)
+                        progress.update(True, len(response.content), skipped=True)
+                        continue
+
+                    parsed = parse_pool.submit(parse_page, response.content, url, parser)
+                    stage[parsed] = ('parse', url, response)
+                    pending.add(parsed)
+                    continue
+
+                article = future.result()
+                if article is None:
+                    print(f"Could not find main content for {url}")
+                    record(url, 'no_content', response, sha256=content_hash(response.content))
+                elif isinstance(article, str):
+                    print(f"An error occurred while processing {url}: {article}")
+                    record(url, 'failed', response, error=article)
+                else:
+                    filename, document, title, n_authors = article
+                    report_saved(url, save_article(output_dir, filename, document), title, n_authors)
+                    record(url, 'ok', response, file=filename, sha256=content_hash(response.content))
+                progress.update(isinstance(article, tuple), len(response.content))
+    return progress
+
+def main():
+    parser = argparse.ArgumentParser(description='Scrape URLs from a CSV file.')
+    parser.add_argument('-n', type=int, default=10, help='Number of URLs to scrape.')
+    parser.add_argument('--csv', default='csv/SB_publication_PMC.csv', help='CSV file with a Link column.')
+    parser.add_argument('--output', default='scraped_content', help='Output directory for Markdown files.')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='Parallel fetches (1 = serial).')
+    parser.add_argument('--delay', type=float, default=0.5, help='Minimum seconds between requests to the same host.')
+    parser.add_argument('--retries', type=int, default=3, help='Retries on timeouts, 429 and 5xx.')
+    parser.add_argument('--backoff', type=float, default=1.0, help='Base backoff in seconds (doubles each retry).')
+    parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds.')
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help='Processes for HTML parsing (default: one per CPU, 0 = parse in threads).')
+    parser.add_argument('--parser', choices=PARSERS, default='html.parser',
+                        help='BeautifulSoup backend (lxml must be installed).')
+    parser.add_argument('--manifest', default=None,
+                        help=f'Crawl manifest path (default: <output>/{MANIFEST_FILE}).')
+    parser.add_argument('--no-manifest', action='store_true', help='Re-download everything, record nothing.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip pages already saved without revalidating them (e.g. after a crash).')
+    parser.add_argument('--only-failed', action='store_true', help='Only retry rows that failed on earlier runs.')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+
+    urls = read_urls(args.csv, args.n)
+    manifest = None
+    if not args.no_manifest:
+        manifest = CrawlManifest(args.manifest or os.path.join(args.output, MANIFEST_FILE))
+        selected = select_urls(urls, manifest, args.output, args.resume, args.only_failed)
+        if len(selected) < len(urls):
+            print(f"Manifest: {len(urls) - len(selected)} of {len(urls)} rows skipped, {len(selected)} to fetch")
+        urls = selected
+
+    try:
+        progress = scrape_all(urls, args.output, concurrency=args.concurrency, delay=args.delay,
+                              retries=args.retries, backoff=args.backoff, timeout=args.timeout,
+                              parse_workers=args.parse_workers, parser=args.parser, manifest=manifest)
+    finally:
+        if manifest is not None:
+            manifest.compact()
+    print(f"Done: {progress.summary()}")
+    if manifest is not None:
+        print(f"Manifest: {manifest.counts()}")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,34 @@
+"""
+Crash-resume behaviour of the crawl manifest.
+
+    python -m pytest scraper/test_crawl_manifest.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from crawl_manifest import CrawlManifest
+
+
+def test_record_after_truncated_last_line(tmp_path):
+    path = str(tmp_path / 'crawl_manifest.jsonl')
+    manifest = CrawlManifest(path)
+    manifest.record('u1', 'ok', file='u1.md')
+    manifest.record('u2', 'ok', file='u2.md')
+    manifest.close()
+
+    # Crash while writing the u2 line: only part of it reached the disk
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) - 20])
+
+    resumed = CrawlManifest(path)
+    assert list(resumed.records) == ['u1']
+    resumed.record('u3', 'ok', file='u3.md')
+    resumed.close()
+
+    reloaded = CrawlManifest(path)
+    assert list(reloaded.records) == ['u1', 'u3']
+    assert reloaded.get('u3')['file'] == 'u3.md'
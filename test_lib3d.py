@@ -0,0 +1,86 @@
+"""
+Store queries on stores imported from a plain blob list (integer ids).
+
+    python -m pytest test_lib3d.py
+"""
+import os
+import sys
+import json
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chunker
+import embedding_store
+import lib3d
+
+
+def _int_id_store(tmp_path):
+    matrix = np.random.default_rng(0).normal(size=(20, 8)).astype(np.float32)
+    blob_json = tmp_path / 'embeddings_blob.json'
+    blob_json.write_text(json.dumps([lib3d.blob2base64(b) for b in lib3d.matrix2blobs(matrix)]))
+    store_path = str(tmp_path / 'store')
+    embedding_store.import_blob_json(str(blob_json), store_path)
+    return store_path, matrix
+
+
+def test_k_nearest_store_with_int_ids(tmp_path):
+    store_path, matrix = _int_id_store(tmp_path)
+    query = lib3d.blob2base64(lib3d.matrix2blobs(matrix[3:4])[0])
+
+    results = lib3d.cmd_k_nearest({"query_blob": query, "store": store_path, "k": 2})
+    assert results[0]["id"] == 3
+    assert results[0]["doc_id"] == "3"
+
+
+def test_k_nearest_batch_store_with_int_ids(tmp_path):
+    store_path, matrix = _int_id_store(tmp_path)
+    queries = [{"query_blob": lib3d.blob2base64(b)} for b in lib3d.matrix2blobs(matrix[5:7])]
+
+    batch = lib3d.cmd_k_nearest_batch({"queries": queries, "store": store_path, "k": 1})
+    assert [hits[0]["id"] for hits in batch] == [5, 6]
+    assert [hits[0]["doc_id"] for hits in batch] == ["5", "6"]
+
+
+def test_aggregate_store_with_int_ids(tmp_path):
+    store_path, matrix = _int_id_store(tmp_path)
+
+    # One document per row: string ids, vectors unchanged
+    docs = chunker.aggregate_store(store_path)
+    assert docs.ids == [str(i) for i in range(20)]
+    assert np.allclose(docs.matrix, matrix, atol=1e-5)
+
+    query = lib3d.blob2base64(lib3d.matrix2blobs(matrix[3:4])[0])
+    results = lib3d.cmd_k_nearest({"query_blob": query, "store": store_path, "k": 1, "level": "doc"})
+    assert results[0]["id"] == "3"
+
+
+def test_k_must_be_positive(tmp_path):
+    import corpus
+
+    store_path, matrix = _int_id_store(tmp_path)
+    query = lib3d.blob2base64(lib3d.matrix2blobs(matrix[:1])[0])
+    corpus_id = corpus.load_corpus({"store": store_path}).corpus_id
+    try:
+        for k in (-1, 0, "3"):
+            with pytest.raises(lib3d.CommandError):
+                lib3d.cmd_k_nearest({"query_blob": query, "store": store_path, "k": k})
+            with pytest.raises(lib3d.CommandError):
+                lib3d.cmd_k_nearest_corpus({"query_blob": query, "corpus_id": corpus_id, "k": k})
+    finally:
+        corpus.unload_corpus(corpus_id)
+
+
+def test_ivf_store_query_returns_k_rows(tmp_path):
+    import ann_index
+
+    store_path, matrix = _int_id_store(tmp_path)
+    # One list per row: nprobe=1 alone would scan a single candidate
+    ann_index.IVFIndex.build(matrix, nlist=len(matrix)).save(store_path)
+    query = lib3d.blob2base64(lib3d.matrix2blobs(matrix[:1])[0])
+
+    results = lib3d.cmd_k_nearest({"query_blob": query, "store": store_path, "k": 5, "nprobe": 1})
+    exact = lib3d.cmd_k_nearest({"query_blob": query, "store": store_path, "k": 5, "exact": True})
+    assert [r["id"] for r in results] == [r["id"] for r in exact]
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# ============================================================================
+# tiles.py - Tile del grafo con livelli di dettaglio (quadtree / octree)
+# ============================================================================
+#
+# index.html scarica tutto graph.json e crea un elemento SVG per nodo e per
+# arco: oltre qualche migliaio di articoli il browser si blocca. Qui i punti
+# PCA del grafo vengono indicizzati una volta e il client chiede solo le tile
+# visibili al suo livello di zoom.
+#
+# Indice: quadtree (2D) o octree (3D) lineare. Ogni punto ha un codice Morton
+# a `depth` livelli; ordinati per codice, i punti di una cella a qualsiasi
+# livello sono un intervallo contiguo (due searchsorted). Per ogni livello L
+# si precalcolano i nodi riassuntivi (una per cella non vuota: centroide,
+# conteggio, nodo rappresentativo) e gli archi tra celle (conteggio e peso
+# medio degli archi kNN che le collegano).
+#
+# Tile (z, x, y[, w]) = cella al livello z. Se contiene al massimo
+# `max_nodes` punti si inviano i nodi veri con i loro archi, altrimenti i
+# cluster del livello z + detail (fino a 4^detail / 8^detail per tile).
+#
+#   python tiles.py build store/ --out store/tiles.npz
+#   python tiles.py build graph.bin --out tiles.npz --dims 2
+#   python tiles.py tile store/tiles.npz 3 2 5
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+import numpy as np
+
+TILES_FILE = "tiles.npz"
+DEFAULT_DEPTH = 12
+MAX_NODES = 2000
+DETAIL = 3
+MAX_EDGES = 5000
+
+# ============================================================================
+# CODICI MORTON
+# ============================================================================
+
+def morton(cells, depth):
+    """Interleave dei bit delle coordinate di cella (N, d) -> codici uint64"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    dims = cells.shape[1]
+    codes = np.zeros(len(cells), dtype=np.uint64)
+    for bit in range(depth):
+        for axis in range(dims):
+            codes |= ((cells[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(bit * dims + axis)
+    return codes
+
+def _range(keys, prefix, shift):
+    # Intervallo [lo, hi) delle chiavi ordinate che iniziano con `prefix`
+    lo = int(np.searchsorted(keys, np.uint64(prefix << shift), side='left'))
+    end = (prefix + 1) << shift
+    hi = len(keys) if end >= 1 << 64 else int(np.searchsorted(keys, np.uint64(end), side='left'))
+    return lo, hi
+
+def _edges_touching(first, second_order, second_sorted, lo, hi):
+    # Archi con almeno un estremo in [lo, hi): `first` è ordinato, l'altro estremo via argsort
+    a = np.arange(*np.searchsorted(first, [lo, hi]))
+    b = second_order[slice(*np.searchsorted(second_sorted, [lo, hi]))]
+    return np.union1d(a, b)
+
+def _by_second(second):
+    order = np.argsort(second, kind='stable')
+    return order, second[order]
+
+# ============================================================================
+# INDICE
+# ============================================================================
+
+class TileIndex:
+    """Punti ordinati per codice Morton + nodi e archi riassuntivi per livello"""
+
+    def __init__(self, arrays, ids=None):
+        self.arrays = arrays
+        self.ids = ids
+        self.depth = int(arrays["depth"])
+        self.levels = int(arrays["levels"])
+        self.dims = int(arrays["points"].shape[1])
+        self.lower, self.upper = arrays["lower"], arrays["upper"]
+
+    def __len__(self):
+        return len(self.arrays["points"])
+
+    @classmethod
+    def build(cls, points, sources, targets, weights, ids=None, depth=DEFAULT_DEPTH):
+        """Indicizza i punti (N, 2 o 3) e precalcola i livelli 0..depth"""
+        points = np.asarray(points, dtype=np.float32)
+        if points.ndim != 2 or points.shape[1] not in (2, 3):
+            raise ValueError(f"Expected (n, 2) or (n, 3) points, got {points.shape}")
+        if not 1 <= depth <= 64 // points.shape[1]:
+            raise ValueError(f"depth must be between 1 and {64 // points.shape[1]}")
+
+        lower, upper = points.min(axis=0), points.max(axis=0)
+        span = np.where(upper > lower, upper - lower, 1)
+        side = 1 << depth
+        cells = np.clip(((points - lower) / span * side).astype(np.int64), 0, side - 1)
+        codes = morton(cells, depth)
+        order = np.argsort(codes, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float32)
+        ru, rv = np.minimum(rank[sources], rank[targets]), np.maximum(rank[sources], rank[targets])
+        by_u = np.argsort(ru, kind='stable')
+        ru, rv, weights = ru[by_u], rv[by_u], weights[by_u]
+
+        arrays = {"depth": np.int64(depth), "lower": lower, "upper": upper,
+                  "points": points[order], "index": order, "codes": codes[order],
+                  "edge_u": ru, "edge_v": rv, "edge_w": weights}
+        arrays["edge_by_v"], arrays["edge_v_sorted"] = _by_second(rv)
+
+        # Livelli fino al primo in cui ogni cluster è un solo punto (da lì in giù: nodi veri)
+        sorted_points = arrays["points"].astype(np.float64)
+        levels = 0
+        while levels <= depth:
+            summary = _summarize(levels, depth, points.shape[1], arrays["codes"], sorted_points, ru, rv, weights)
+            if len(summary[f"L{levels}_start"]) == len(points):
+                break
+            arrays.update(summary)
+            levels += 1
+        arrays["levels"] = np.int64(levels)
+        return cls(arrays, ids)
+
+    # ------------------------------------------------------------------------
+    # Tile
+    # ------------------------------------------------------------------------
+
+    def meta(self):
+        return {"nodes": len(self), "edges": len(self.arrays["edge_u"]), "dims": self.dims,
+                "depth": self.depth, "lower": self.lower.tolist(), "upper": self.upper.tolist(),
+                "clusters": [len(self.arrays[f"L{level}_start"]) for level in range(self.levels)]}
+
+    def tile_bounds(self, z, coords):
+        size = (self.upper - self.lower) / (1 << z)
+        low = self.lower + size * np.asarray(coords)
+        return low.tolist(), (low + size).tolist()
+
+    def tile(self, z, coords, max_nodes=MAX_NODES, detail=DETAIL, max_edges=MAX_EDGES):
+        """Contenuto di una tile: nodi veri se sono pochi, altrimenti cluster del livello z + detail"""
+        coords = [int(c) for c in coords]
+        if len(coords) != self.dims:
+            raise ValueError(f"Expected {self.dims} tile coordinates, got {len(coords)}")
+        if not 0 <= z <= self.depth or not all(0 <= c < (1 << z) for c in coords):
+            raise ValueError(f"Tile {z}/{'/'.join(map(str, coords))} is outside the index")
+
+        prefix = int(morton([coords], z)[0])
+        lo, hi = _range(self.arrays["codes"], prefix, self.dims * (self.depth - z))
+        low, high = self.tile_bounds(z, coords)
+        result = {"z": z, "tile": coords, "bounds": [low, high], "count": hi - lo}
+
+        level = min(z + detail, self.depth)
+        if hi - lo <= max_nodes or level >= self.levels:
+            result.update(self._nodes(lo, hi, max_edges))
+        else:
+            result.update(self._clusters(level, prefix, z, max_edges))
+        return result
+
+    def _node(self, position):
+        i = int(self.arrays["index"][position])
+        node = {"id": i}
+        node.update(zip("xyz", self.arrays["points"][position].tolist()))
+        if self.ids is not None:
+            node["label"] = self.ids[i]
+        return node
+
+    def _nodes(self, lo, hi, max_edges):
+        a = self.arrays
+        edges = _edges_touching(a["edge_u"], a["edge_by_v"], a["edge_v_sorted"], lo, hi)
+        if len(edges) > max_edges:
+            edges = edges[np.argsort(a["edge_w"][edges], kind='stable')[:max_edges]]
+        u, v = a["edge_u"][edges], a["edge_v"][edges]
+        # Estremi fuori dalla tile: inviati a parte perché il client possa disegnare l'arco
+        outside = np.setdiff1d(np.concatenate([u, v]), np.arange(lo, hi))
+        index = a["index"]
+        return {
+            "mode": "nodes",
+            "nodes": [self._node(p) for p in range(lo, hi)],
+            "external": [self._node(p) for p in outside.tolist()],
+            "edges": [{"source": s, "target": t, "weight": w} for s, t, w in
+                      zip(index[u].tolist(), index[v].tolist(), a["edge_w"][edges].astype(np.float64).tolist())],
+        }
+
+    def _clusters(self, level, prefix, z, max_edges):
+        a = self.arrays
+        keys = a[f"L{level}_key"]
+        lo, hi = _range(keys, prefix, self.dims * (level - z))
+        edge_a, edge_b = a[f"L{level}_edge_a"], a[f"L{level}_edge_b"]
+        edges = _edges_touching(edge_a, a[f"L{level}_edge_by_b"], a[f"L{level}_edge_b_sorted"], lo, hi)
+        count = a[f"L{level}_edge_count"]
+        if len(edges) > max_edges:
+            edges = edges[np.argsort(-count[edges], kind='stable')[:max_edges]]
+
+        def cluster(c):
+            node = {"id": f"{level}:{int(keys[c])}", "count": int(a[f"L{level}_count"][c]),
+                    "rep": int(a["index"][a[f"L{level}_rep"][c]])}
+            node.update(zip("xyz", a[f"L{level}_centroid"][c].tolist()))
+            return node
+
+        ends = np.union1d(edge_a[edges], edge_b[edges])
+        return {
+            "mode": "clusters",
+            "level": level,
+            "nodes": [cluster(c) for c in range(lo, hi)],
+            "external": [cluster(c) for c in np.setdiff1d(ends, np.arange(lo, hi)).tolist()],
+            "edges": [{"source": f"{level}:{int(keys[s])}", "target": f"{level}:{int(keys[t])}",
+                       "count": int(n), "weight": float(w)}
+                      for s, t, n, w in zip(edge_a[edges], edge_b[edges], count[edges],
+                                            a[f"L{level}_edge_w"][edges])],
+        }
+
+    # ------------------------------------------------------------------------
+    # Persistenza
+    # ------------------------------------------------------------------------
+
+    def save(self, path):
+        tmp = path + ".tmp.npz"
+        extra = {"ids": np.asarray(json.dumps(self.ids))} if self.ids is not None else {}
+        np.savez(tmp, **self.arrays, **extra)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        ids = json.loads(str(arrays.pop("ids"))) if "ids" in arrays else None
+        return cls(arrays, ids)
+
+def _summarize(level, depth, dims, codes, points, ru, rv, weights):
+    """Cluster (una per cella non vuota) e archi tra cluster al livello `level`"""
+    keys = codes >> np.uint64(dims * (depth - level))
+    start = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    count = np.diff(np.append(start, len(keys)))
+    centroid = np.add.reduceat(points, start, axis=0) / count[:, None]
+
+    # Rappresentante: il membro più vicino al centroide
+    group = np.repeat(np.arange(len(start)), count)
+    dist = ((points - centroid[group]) ** 2).sum(axis=1)
+    rep = np.lexsort((dist, group))[start]
+
+    a, b = group[ru], group[rv]
+    cross = a != b
+    pair, inverse = np.unique(a[cross] * len(start) + b[cross], return_inverse=True)
+    edge_count = np.bincount(inverse, minlength=len(pair))
+    edge_w = np.bincount(inverse, weights=weights[cross], minlength=len(pair)) / np.maximum(edge_count, 1)
+    edge_a, edge_b = pair // len(start), pair % len(start)
+
+    by_b, b_sorted = _by_second(edge_b)
+    prefix = f"L{level}_"
+    return {prefix + "key": keys[start], prefix + "start": start, prefix + "count": count,
+            prefix + "centroid": centroid.astype(np.float32), prefix + "rep": rep,
+            prefix + "edge_a": edge_a, prefix + "edge_b": edge_b, prefix + "edge_by_b": by_b,
+            prefix + "edge_b_sorted": b_sorted, prefix + "edge_count": edge_count,
+            prefix + "edge_w": edge_w.astype(np.float32)}
+
+# ============================================================================
+# COSTRUZIONE DA STORE / FILE DEL GRAFO
+# ============================================================================
+
+def build_from_store(store_path, dims=2, depth=DEFAULT_DEPTH, refit=False):
+    """Indice dalle coordinate PCA del grafo dello store (base salvata in store/)"""
+    import embedding_store
+    import lib3d
+
+    store = embedding_store.open_store(store_path)
+    points, sources, targets, weights, _ = lib3d.graph_arrays_store(store, refit=refit)
+    return TileIndex.build(points[:, :dims], sources, targets, weights, ids=store.ids, depth=depth)
+
+def build_from_graph(graph_path, dims=2, depth=DEFAULT_DEPTH):
+    """Indice da graph.bin (LWG1) o graph.json"""
+    import graph_io
+
+    if graph_path.endswith(".bin"):
+        with open(graph_path, 'rb') as f:
+            points, sources, targets, weights = graph_io.read_graph_binary(f)
+    else:
+        with open(graph_path, 'r', encoding='utf-8') as f:
+            graph = json.load(f)
+        points = np.array([[n[axis] for axis in "xyz" if axis in n] for n in graph["nodes"]], dtype=np.float32)
+        edges = graph["edges"]
+        sources = [e["source"] for e in edges]
+        targets = [e["target"] for e in edges]
+        weights = [e.get("weight", 1.0) for e in edges]
+    return TileIndex.build(points[:, :dims], sources, targets, weights, depth=depth)
+
+def build(source, out=None, dims=2, depth=DEFAULT_DEPTH):
+    """Costruisce e salva; `source` è una directory store o un file del grafo"""
+    if os.path.isdir(source):
+        index = build_from_store(source, dims, depth)
+        out = out or os.path.join(source, TILES_FILE)
+    else:
+        index = build_from_graph(source, dims, depth)
+        out = out or TILES_FILE
+    index.save(out)
+    return index, out
+
+# Indici caricati dal processo (server): ricaricati se il file cambia
+_loaded = {}
+_lock = threading.Lock()
+
+def get_index(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, TILES_FILE)
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = _loaded[path] = (mtime, TileIndex.load(path))
+        return cached[1]
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Level-of-detail tiles for the graph view.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('build', help='Index a store directory or a graph.bin/graph.json file.')
+    p.add_argument('source')
+    p.add_argument('--out', help=f'Output file (default: <store>/{TILES_FILE} or ./{TILES_FILE}).')
+    p.add_argument('--dims', type=int, choices=(2, 3), default=2, help='2 = quadtree over x, y; 3 = octree.')
+    p.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help='Levels of the tree.')
+
+    p = sub.add_parser('tile', help='Print one tile as JSON.')
+    p.add_argument('index')
+    p.add_argument('z', type=int)
+    p.add_argument('coords', type=int, nargs='+')
+    p.add_argument('--max-nodes', type=int, default=MAX_NODES)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        index, out = build(args.source, args.out, args.dims, args.depth)
+        meta = index.meta()
+        print(f"Indexed {meta['nodes']} nodes, {meta['edges']} edges ({args.dims}D, depth {meta['depth']}) -> {out}")
+    else:
+        print(json.dumps(get_index(args.index).tile(args.z, args.coords, args.max_nodes)))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,83 @@
+"""
+Benchmark: networkx vs scipy.sparse.csgraph for the graph-building steps of
+graph_nearest / find_optimal_neighbors_fast.
+
+For each size it builds one kNN adjacency and times, with peak Python memory
+(tracemalloc), the two operations the backend needs:
+  - counting connected components (zones)
+  - listing undirected weighted edges
+
+    python tools/bench_graph.py --sizes 1000 10000 100000 --k 10
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import networkx as nx
+from scipy.sparse.csgraph import connected_components
+from sklearn.neighbors import kneighbors_graph
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib3d import sparse_edges
+
+
+def measure(fn):
+    """
+    Run fn once; return (result, seconds, peak traced MB).
+    """
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def networkx_zones(A):
+    return len(list(nx.connected_components(nx.from_scipy_sparse_array(A))))
+
+
+def networkx_edges(A):
+    G = nx.from_scipy_sparse_array(A)
+    return [(int(u), int(v), float(d["weight"])) for u, v, d in G.edges(data=True)]
+
+
+def csgraph_zones(A):
+    return connected_components(A, directed=False)[0]
+
+
+def csgraph_edges(A):
+    sources, targets, weights = sparse_edges(A)
+    return list(zip(sources.tolist(), targets.tolist(), weights.tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare networkx and csgraph graph building.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--k', type=int, default=10, help='Neighbours per node.')
+    parser.add_argument('--dims', type=int, default=3, help='Point dimension (3 = lib3d layout).')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'n':>8} {'step':<6} {'networkx s':>11} {'MB':>8} {'csgraph s':>10} {'MB':>8} {'speedup':>8}")
+    for n in args.sizes:
+        points = rng.random((n, args.dims))
+        A = kneighbors_graph(points, n_neighbors=args.k, mode='distance', include_self=False)
+
+        for step, slow, fast in (("zones", networkx_zones, csgraph_zones),
+                                 ("edges", networkx_edges, csgraph_edges)):
+            slow_result, slow_s, slow_mb = measure(lambda: slow(A))
+            fast_result, fast_s, fast_mb = measure(lambda: fast(A))
+            if step == "zones":
+                assert slow_result == fast_result, (slow_result, fast_result)
+            else:
+                assert len(slow_result) == len(fast_result), (len(slow_result), len(fast_result))
+            print(f"{n:>8} {step:<6} {slow_s:>11.3f} {slow_mb:>8.1f} {fast_s:>10.3f} {fast_mb:>8.1f} "
+                  f"{slow_s / fast_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
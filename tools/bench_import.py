@@ -0,0 +1,69 @@
+"""
+Import-time benchmark for lib.py.
+
+"before" replays what `import lib` used to do at module level (every heavy
+import plus creating the OpenAI client; the graph build that also ran on
+import is left out, so the real old cost was higher). "after" is a plain
+`import lib` with the current lazy imports. Each case runs in a fresh
+interpreter, several times, and the median wall time is reported.
+
+    python tools/bench_import.py --runs 5
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BEFORE = """
+import os, struct, base64, json
+import ollama
+import matplotlib.pyplot as plt
+import networkx as nx
+import numpy as np
+from openai import OpenAI
+from dotenv import load_dotenv
+from scipy.spatial.distance import euclidean
+from sklearn.decomposition import PCA
+from sklearn.neighbors import kneighbors_graph
+load_dotenv()
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY") or "unset", base_url="https://api.deepseek.com")
+"""
+
+AFTER = "import lib"
+
+BASELINE = "pass"
+
+
+def time_snippet(code, runs):
+    """
+    Median wall time (ms) of running `code` in a fresh interpreter.
+    """
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup cost of importing lib.py.')
+    parser.add_argument('--runs', type=int, default=5, help='Interpreter launches per case.')
+    args = parser.parse_args()
+
+    interpreter = time_snippet(BASELINE, args.runs)
+    before = time_snippet(BEFORE, args.runs)
+    after = time_snippet(AFTER, args.runs)
+
+    print(f"bare interpreter:        {interpreter:8.1f} ms")
+    print(f"before (eager imports):  {before:8.1f} ms  (+{before - interpreter:.1f} ms)")
+    print(f"after  (import lib):     {after:8.1f} ms  (+{after - interpreter:.1f} ms)")
+    print(f"startup {before / after:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
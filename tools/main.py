@@ -1,15 +1,21 @@
+import os
+import sys
 import numpy as np
-from sklearn.neighbors import kneighbors_graph
+from scipy.sparse.csgraph import connected_components
 import networkx as nx
 import matplotlib.pyplot as plt
 from sklearn.metrics import silhouette_score
 import warnings
 warnings.filterwarnings('ignore')
 
-def find_optimal_neighbors_fast(points, target_zones_range=(5, 20), max_neighbors=10):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from knn_graph import knn_lists, zone_counts, knn_adjacency
+
+def find_optimal_neighbors_fast(points, target_zones_range=(5, 20), max_neighbors=10, knn=None):
     """
     Fast heuristic to find optimal number of neighbors based on target zone count.
-    Uses binary search for efficiency.
+    Uses binary search for efficiency. The neighbour lists are computed once
+    (or passed in as `knn`) and the zone count of every k comes from the same pass.
     """
     n_points = len(points)
     low, high = 2, min(max_neighbors, n_points - 1)
@@ -17,13 +23,15 @@ def find_optimal_neighbors_fast(points, target_zones_range=(5, 20), max_neighbor
     best_zone_count = 0
     
     # Quick heuristic: start with sqrt(n) as initial guess
-    initial_k = max(2, int(np.sqrt(n_points)))
+    initial_k = min(max(2, int(np.sqrt(n_points))), n_points - 1)
+    
+    # Zone counts for every k = 1..max from a single kNN computation
+    if knn is None or knn[1].shape[1] < max(initial_k, high):
+        knn = knn_lists(points, max(initial_k, high))
+    counts = zone_counts(knn[1])
     
     # Test initial k
-    A = kneighbors_graph(points, n_neighbors=initial_k, mode='connectivity', include_self=False)
-    G = nx.from_scipy_sparse_array(A)
-    zones = list(nx.connected_components(G))
-    zone_count = len(zones)
+    zone_count = counts[initial_k - 1]
     
     if target_zones_range[0] <= zone_count <= target_zones_range[1]:
         return initial_k, zone_count
@@ -31,10 +39,7 @@ def find_optimal_neighbors_fast(points, target_zones_range=(5, 20), max_neighbor
     # Binary search for optimal k
     for _ in range(5):  # Limit iterations for efficiency
         mid = (low + high) // 2
-        A = kneighbors_graph(points, n_neighbors=mid, mode='connectivity', include_self=False)
-        G = nx.from_scipy_sparse_array(A)
-        zones = list(nx.connected_components(G))
-        zone_count = len(zones)
+        zone_count = counts[mid - 1]
         
         if target_zones_range[0] <= zone_count <= target_zones_range[1]:
             return mid, zone_count
@@ -110,18 +115,17 @@ def main():
     print(f"Dynamically calculated target zone range: {target_zones_range}")
     
     # Find optimal number of neighbors with dynamic zone range
-    optimal_k, zone_count = find_optimal_neighbors_fast(points, target_zones_range)
+    knn = knn_lists(points, max(10, int(np.sqrt(n_points))))
+    optimal_k, zone_count = find_optimal_neighbors_fast(points, target_zones_range, knn=knn)
     print(f"Optimal number of neighbors: {optimal_k}")
     print(f"Actual zones found: {zone_count}")
     
-    # Build k-NN graph with optimal neighbors
-    A = kneighbors_graph(points, n_neighbors=optimal_k, mode='connectivity', include_self=False)
+    # Build k-NN graph with optimal neighbors (prefix of the same neighbour lists)
+    A = knn_adjacency(*knn, optimal_k, mode='connectivity')
     
-    # Convert to networkx graph
-    G = nx.from_scipy_sparse_array(A)
-    
-    # Find connected components (zones)
-    zones = list(nx.connected_components(G))
+    # Find connected components (zones) on the sparse adjacency
+    n_zones, labels = connected_components(A, directed=False)
+    zones = [set(np.nonzero(labels == z)[0].tolist()) for z in range(n_zones)]
     print(f"Found {len(zones)} connected components (zones)")
     
     # Generate vibrant colors for zones
@@ -142,7 +146,8 @@ def main():
     # Plot the graph
     plt.figure(figsize=(12, 8))
     
-    # Create position dictionary
+    # Create position dictionary (networkx is only used for drawing)
+    G = nx.from_scipy_sparse_array(A)
     pos = {i: points[i] for i in range(len(points))}
     
     # Draw the graph
@@ -0,0 +1,95 @@
+"""
+Minimal stand-in for the Ollama embedding API, for running the embedding
+code offline.
+
+Serves `POST /api/embed` (batched) and `POST /api/embeddings` (single prompt)
+with deterministic vectors derived from a hash of the text, so the same text
+always gets the same embedding. Like Ollama, `/api/embeddings` returns the raw
+vector and `/api/embed` the L2-normalized one. `--fail-rate` makes a fraction of requests
+answer 503 to exercise the client's retry path.
+
+    python tools/stub_ollama.py --port 11435 --dim 64
+    OLLAMA_HOST=http://127.0.0.1:11435 python lib3d.py get_blob "hello"
+"""
+import json
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def stub_embedding(text, dim, normalize=False):
+    """
+    Deterministic vector for a text (unit-norm with `normalize`).
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector) if normalize else vector).tolist()
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        with self.server.lock:
+            self.server.requests += 1
+            failing = random.random() < self.server.fail_rate
+
+        if failing:
+            self._send(503, {"error": "stub: simulated overload"})
+        elif self.path == '/api/embed':
+            texts = request.get('input', [])
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send(200, {"model": request.get('model'),
+                             "embeddings": [stub_embedding(t, self.server.dim, normalize=True) for t in texts]})
+        elif self.path == '/api/embeddings':
+            self._send(200, {"embedding": stub_embedding(request.get('prompt', ''), self.server.dim)})
+        else:
+            self._send(404, {"error": f"stub: unknown path {self.path}"})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dim=1024, fail_rate=0.0):
+        super().__init__(address, StubOllamaHandler)
+        self.dim = dim
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub Ollama embedding server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--dim', type=int, default=1024, help='Embedding dimension.')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+    args = parser.parse_args()
+
+    server = StubOllamaServer((args.host, args.port), dim=args.dim, fail_rate=args.fail_rate)
+    print(f"Stub Ollama listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
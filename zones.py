@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# ============================================================================
+# zones.py - Zone gerarchiche sugli embedding + ricerca coarse-to-fine
+# ============================================================================
+#
+# lib.py e tools/main.py chiamano "zone" le componenti connesse del grafo kNN
+# (sui punti PCA) e le usano solo per colorare il grafico. Qui le zone si
+# calcolano sugli embedding completi e si salvano con centroidi e membri.
+#
+# Gerarchia: il livello 0 sono le zone dei punti (grafo kNN con `k` vicini,
+# di solito 1: componenti piccole e compatte). Il livello 1 sono le zone dei
+# centroidi del livello 0 (stessa regola, sul grafo kNN dei centroidi), e
+# così via finché restano al massimo `top_zones` zone. Ogni zona ha un solo
+# genitore, quindi i livelli sono annidati.
+#
+# Ricerca: si ordinano i centroidi del livello più alto e si tengono le
+# `beam` zone migliori; a ogni livello sotto si considerano solo i figli di
+# quelle e si tengono di nuovo le `beam` migliori; al livello 0 si scandiscono
+# in modo esatto le `nprobe` zone migliori tra i figli (ann_index.probe_lists).
+#
+# File salvato nella directory dello store:
+#
+#   zones.npz   assign (N,) zona di livello 0 di ogni riga; per livello l:
+#               centroids_l (Z_l, D), sizes_l (Z_l,), parent_l (Z_l,) -> zona l+1;
+#               fingerprint dello store (sync rifiuta zone di uno store
+#               ricreato o accorciato, vedi embedding_store.py)
+#
+#   python zones.py build store/
+#   python zones.py info store/
+#   python zones.py eval store/ --nprobe 4 16 --beam 2 4 8
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial.distance import cdist
+
+from ann_index import DEFAULT_NPROBE, assign_to_centroids, group_by_label, probe_lists
+from knn_graph import knn_lists, zone_labels
+
+ZONES_FILE = "zones.npz"
+DEFAULT_BEAM = 4
+
+# ============================================================================
+# FUNZIONI DI SUPPORTO
+# ============================================================================
+
+def zones_of(points, k=1):
+    """Zone come in lib.py (componenti del grafo kNN con k vicini), sui punti dati"""
+    if len(points) < 2:
+        return np.zeros(len(points), dtype=np.int64)
+    _, neigh_idx = knn_lists(points, k)
+    return zone_labels(neigh_idx)[-1]
+
+def centroids_of(matrix, labels, n_zones, chunk_size=65536):
+    """(centroidi, dimensioni) per etichetta, a blocchi (anche su memmap)"""
+    sums = np.zeros((n_zones, matrix.shape[1]))
+    for start in range(0, len(matrix), chunk_size):
+        block = np.asarray(matrix[start:start + chunk_size], dtype=np.float64)
+        rows = labels[start:start + len(block)]
+        group = csr_matrix((np.ones(len(block)), (rows, np.arange(len(block)))), shape=(n_zones, len(block)))
+        sums += group @ block
+    sizes = np.bincount(labels, minlength=n_zones)
+    return (sums / np.maximum(sizes, 1)[:, None]).astype(np.float32), sizes
+
+# ============================================================================
+# INDICE A ZONE
+# ============================================================================
+
+class ZoneIndex:
+    """Zone annidate per livello: centroidi, dimensioni, genitori + zona di ogni riga"""
+
+    def __init__(self, assign, centroids, sizes, parents, fingerprint=None):
+        self.assign = np.asarray(assign, dtype=np.int32)
+        self.fingerprint = fingerprint
+        self.centroids = [np.asarray(c, dtype=np.float32) for c in centroids]
+        self.sizes = [np.asarray(s, dtype=np.int64) for s in sizes]
+        self.parents = [np.asarray(p, dtype=np.int32) for p in parents]
+        self._lists = None
+        self._children = None
+
+    @property
+    def levels(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.assign)
+
+    @classmethod
+    def build(cls, matrix, k=1, top_zones=None):
+        """Zone dei punti, poi zone dei centroidi finché ne restano al massimo `top_zones`"""
+        n = len(matrix)
+        if n == 0:
+            raise ValueError("Cannot build zones over an empty matrix")
+        top_zones = top_zones or max(2, int(round(n ** 0.25)))
+
+        assign = zones_of(np.asarray(matrix, dtype=np.float32), k)
+        centroids, sizes = centroids_of(matrix, assign, int(assign.max()) + 1)
+        levels_c, levels_s, parents = [centroids], [sizes], []
+        while len(centroids) > top_zones:
+            parent = zones_of(centroids, k)
+            n_parents = int(parent.max()) + 1
+            if n_parents == len(centroids):
+                break
+            # Centroide di una zona = media dei figli pesata sulle loro dimensioni
+            weights = csr_matrix((sizes, (parent, np.arange(len(parent)))), shape=(n_parents, len(parent)))
+            sizes = np.bincount(parent, weights=sizes, minlength=n_parents).astype(np.int64)
+            centroids = ((weights @ centroids.astype(np.float64)) / sizes[:, None]).astype(np.float32)
+            parents.append(parent)
+            levels_c.append(centroids)
+            levels_s.append(sizes)
+        return cls(assign, levels_c, levels_s, parents)
+
+    def add(self, matrix):
+        """Righe nuove (in coda) assegnate alla zona di livello 0 più vicina; i centroidi restano"""
+        self.assign = np.concatenate([self.assign, assign_to_centroids(matrix, self.centroids[0])])
+        self._lists = None
+
+    def sync(self, store):
+        """Assegna le righe aggiunte allo store; StaleIndexError se le zone non sono di questo store"""
+        if self.fingerprint is not None:
+            store.check_index("Zones", len(self), self.fingerprint)
+        self.fingerprint = store.fingerprint()
+        if len(self) < len(store):
+            self.add(store.matrix[len(self):])
+        return self
+
+    def children(self, level):
+        """(membri, offset) delle zone di livello `level - 1` raggruppate per genitore"""
+        if self._children is None:
+            self._children = [group_by_label(p, len(self.centroids[l + 1])) for l, p in enumerate(self.parents)]
+        return self._children[level - 1]
+
+    def search(self, query, matrix, k=5, nprobe=DEFAULT_NPROBE, beam=DEFAULT_BEAM):
+        """Top k coarse-to-fine: (indici, distanze, candidati scanditi, centroidi confrontati)
+
+        `beam=None` salta la gerarchia e confronta tutti i centroidi di livello 0.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self._lists is None:
+            self._lists = group_by_label(self.assign, len(self.centroids[0]))
+        allowed, compared = None, 0
+
+        if beam is not None and self.levels > 1:
+            top = self.levels - 1
+            chosen = np.arange(len(self.centroids[top]))
+            for level in range(top, 0, -1):
+                if allowed is not None:
+                    chosen = allowed
+                dist = cdist([query], self.centroids[level][chosen])[0]
+                compared += len(chosen)
+                chosen = chosen[np.argpartition(dist, min(beam, len(chosen)) - 1)[:beam]]
+                members, offsets = self.children(level)
+                allowed = np.concatenate([members[offsets[z]:offsets[z + 1]] for z in chosen])
+
+        compared += len(self.centroids[0]) if allowed is None else len(allowed)
+        members, offsets = self._lists
+        idx, dist, scanned = probe_lists(query, matrix, self.centroids[0], members, offsets, nprobe, k, allowed)
+        return idx, dist, scanned, compared
+
+    def info(self):
+        sizes = self.sizes[0]
+        return {"rows": len(self), "levels": [len(c) for c in self.centroids],
+                "zone_size": {"min": int(sizes.min()), "median": float(np.median(sizes)),
+                              "max": int(sizes.max())}}
+
+    # ------------------------------------------------------------------------
+    # Persistenza
+    # ------------------------------------------------------------------------
+
+    def save(self, path):
+        """Salva nella directory dello store `path` (fingerprint di quello store se manca)"""
+        import embedding_store
+
+        if self.fingerprint is None:
+            self.fingerprint = embedding_store.open_store(path).fingerprint()
+        arrays = {"assign": self.assign, "fingerprint": np.array(self.fingerprint)}
+        for level, (c, s) in enumerate(zip(self.centroids, self.sizes)):
+            arrays[f"centroids_{level}"] = c
+            arrays[f"sizes_{level}"] = s
+        for level, p in enumerate(self.parents):
+            arrays[f"parent_{level}"] = p
+        tmp = os.path.join(path, ZONES_FILE + ".tmp.npz")
+        np.savez(tmp, **arrays)
+        os.replace(tmp, os.path.join(path, ZONES_FILE))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(os.path.join(path, ZONES_FILE)) as data:
+            levels = sum(name.startswith("centroids_") for name in data.files)
+            return cls(data["assign"],
+                       [data[f"centroids_{l}"] for l in range(levels)],
+                       [data[f"sizes_{l}"] for l in range(levels)],
+                       [data[f"parent_{l}"] for l in range(levels - 1)],
+                       str(data["fingerprint"]) if "fingerprint" in data.files else "")
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, ZONES_FILE))
+
+# ============================================================================
+# RECALL / CANDIDATI
+# ============================================================================
+
+def evaluate(store, index, nprobes, beams, n_queries=100, k=10, seed=0):
+    """Recall@k, candidati scanditi e centroidi confrontati rispetto alla ricerca esatta
+
+    Una riga per ogni combinazione (beam, nprobe); beam "all" = solo livello 0.
+    """
+    import lib3d
+
+    rng = np.random.default_rng(seed)
+    queries = store.matrix[rng.choice(len(store), size=min(n_queries, len(store)), replace=False)]
+
+    started = time.perf_counter()
+    exact = [set(lib3d.k_nearest_matrix(q, store.matrix, k)[0].tolist()) for q in queries]
+    report = {"exact": {"latency_ms": (time.perf_counter() - started) * 1000 / len(queries),
+                        "scanned": len(store)}}
+
+    for beam in [None] + list(beams):
+        for nprobe in nprobes:
+            hits, scanned, compared = 0, 0, 0
+            started = time.perf_counter()
+            for q, truth in zip(queries, exact):
+                idx, _, n_scanned, n_compared = index.search(q, store.matrix, k, nprobe, beam)
+                hits += len(truth & set(idx.tolist()))
+                scanned += n_scanned
+                compared += n_compared
+            report[f"beam={beam or 'all'} nprobe={nprobe}"] = {
+                "recall": hits / sum(len(t) for t in exact),
+                "latency_ms": (time.perf_counter() - started) * 1000 / len(queries),
+                "scanned": scanned / len(queries),
+                "scanned_fraction": scanned / len(queries) / len(store),
+                "centroids": compared / len(queries),
+            }
+    return report
+
+# ============================================================================
+# MAIN ENTRY POINT
+# ============================================================================
+
+def main():
+    import embedding_store
+
+    parser = argparse.ArgumentParser(description='Hierarchical kNN zones of an embedding store.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('build', help='Compute the zones and save them in the store.')
+    p.add_argument('store_path')
+    p.add_argument('-k', type=int, default=1, help='Neighbours per point when linking zones.')
+    p.add_argument('--top-zones', type=int, default=None, help='Stop merging at this many zones (default N^0.25).')
+
+    p = sub.add_parser('info', help='Zones per level and zone sizes.')
+    p.add_argument('store_path')
+
+    p = sub.add_parser('eval', help='Report recall and candidates scanned against exact search.')
+    p.add_argument('store_path')
+    p.add_argument('--nprobe', type=int, nargs='+', default=[4, 16])
+    p.add_argument('--beam', type=int, nargs='+', default=[2, 4, 8])
+    p.add_argument('--queries', type=int, default=100)
+    p.add_argument('-k', type=int, default=10)
+
+    args = parser.parse_args()
+    store = embedding_store.open_store(args.store_path)
+
+    if args.command == 'build':
+        index = ZoneIndex.build(store.matrix, k=args.k, top_zones=args.top_zones)
+        index.save(args.store_path)
+        print(f"Zones per level: {[len(c) for c in index.centroids]} over {len(index)} embeddings")
+    elif args.command == 'info':
+        print(json.dumps(ZoneIndex.load(args.store_path).sync(store).info(), indent=2))
+    else:
+        index = ZoneIndex.load(args.store_path).sync(store)
+        print(json.dumps(evaluate(store, index, args.nprobe, args.beam, args.queries, args.k), indent=2))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)